@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-04-12
+project: elasticizefiles
+
+Benchmark of the hashing strategies and functions of
+:mod:`elasticizefiles.utils.hashing` on files of different sizes.
+
+    python benchmarks/bench_hashing.py --sizes 4096 1048576 268435456
+"""
+import argparse
+import os
+import tempfile
+from time import time
+
+from elasticizefiles.utils.hashing import STRATEGIES
+from elasticizefiles.utils.hashing import hash_file
+
+HASH_TYPES = ['sha256', 'sha1', 'md5', 'blake2b', 'xxh3_64']
+
+
+def available(hash_types):
+    r = []
+    for h in hash_types:
+        try:
+            hash_file(__file__, hash_types=(h, ))
+            r.append(h)
+        except Exception as e:
+            print(f'skipping {h}: {e}')
+    return r
+
+
+def bench(filename, size, hash_types, strategy, min_time=1.):
+    """ Hash `filename` until `min_time` seconds elapsed
+
+    :returns: the throughput in MB/s
+    """
+    n = 0
+    tik = time()
+    while True:
+        hash_file(filename, hash_types=hash_types, strategy=strategy)
+        n += 1
+        elapsed = time() - tik
+        if elapsed >= min_time:
+            break
+    return n * size / elapsed / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hashing benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[4 * 1024, 1024 * 1024, 64 * 1024 * 1024],
+                        help='file sizes in bytes')
+    parser.add_argument('--min-time', type=float, default=1.,
+                        help='min seconds spent on each measure')
+    args = parser.parse_args()
+
+    hash_types = available(HASH_TYPES)
+    print(f'{"size":>12} {"strategy":>8} {"hash":>16} {"MB/s":>10}')
+    for size in args.sizes:
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(os.urandom(size))
+        try:
+            for strategy in STRATEGIES:
+                for h in hash_types + ['all']:
+                    types = tuple(hash_types) if h == 'all' else (h, )
+                    mbs = bench(f.name, size, types, strategy, args.min_time)
+                    print(f'{size:>12} {strategy:>8} {h:>16} {mbs:>10.1f}')
+        finally:
+            os.remove(f.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-07-04
+project: elasticizefiles
+
+Startup time of the package: each module is imported in a fresh interpreter
+`--repeat` times, the best time minus the one of an empty interpreter is
+compared with `--budget`. It fails (exit code 1) if a module is over budget
+or pulls in one of the slow dependencies that must be imported lazily.
+
+    python benchmarks/bench_import.py --budget 200
+"""
+import argparse
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+MODULES = ['elasticizefiles', 'elasticizefiles.cli', 'elasticizefiles.engine']
+LAZY = ['elasticsearch', 'requests', 'pkg_resources', 'asyncio']
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+def measure(code, repeat):
+    """ The best wall time of running `code` in a fresh interpreter
+
+    :returns: the time in milliseconds
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC, os.environ.get('PYTHONPATH', '')]))
+    best = None
+    for _ in range(repeat):
+        tik = perf_counter()
+        subprocess.run([sys.executable, '-c', code], env=env, check=True)
+        elapsed = (perf_counter() - tik) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def loaded(module):
+    """ The slow dependencies imported along with `module` """
+    code = f'import sys, {module}; print(" ".join(m for m in {LAZY!r} if m in sys.modules))'
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC, os.environ.get('PYTHONPATH', '')]))
+    out = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return out.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='import time benchmark')
+    parser.add_argument('--budget', type=float, default=200.,
+                        help='max milliseconds spent importing a module')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='number of measures of each module')
+    args = parser.parse_args()
+
+    baseline = measure('pass', args.repeat)
+    print(f'{"module":>24} {"ms":>8} {"slow imports":>24}')
+    failed = False
+    for module in MODULES:
+        ms = measure(f'import {module}', args.repeat) - baseline
+        slow = loaded(module)
+        ok = ms <= args.budget and len(slow) == 0
+        failed = failed or not ok
+        print(f'{module:>24} {ms:>8.1f} {",".join(slow) or "-":>24} {"" if ok else "FAIL"}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
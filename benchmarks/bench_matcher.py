@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-03-08
+project: elasticizefiles
+
+Micro-benchmark of :class:`RuleMatcher` against the plain loop over all the
+patterns of all the rules, on synthetic paths.
+
+    python benchmarks/bench_matcher.py --n 1000000
+"""
+import argparse
+import random
+import re
+from time import time
+
+from elasticizefiles.base.matcher import RuleMatcher
+
+EXTENSIONS = ['txt', 'log', 'py', 'jpg', 'JPG', 'png', 'pdf', 'docx', 'c', 'h',
+              'json', 'xml', 'so', 'dll', 'exe', 'gz', '']
+
+RULES = {
+    'text': {'pattern': [r'.*\.txt$', r'.*\.log$', r'.*\.json$'], 'extractor': [{'a': None}]},
+    'image': {'pattern': [r'(?i).*\.jpe?g$', r'.*\.png$'], 'extractor': [{'b': None}]},
+    'code': {'pattern': [r'.*\.py$', r'.*\.c$', r'.*\.h$'], 'extractor': [{'c': None}]},
+    'pe': {'pattern': [r'(?i).*\.(exe|dll)$'], 'extractor': [{'d': None}]},
+    'doc': {'pattern': [r'.*\.pdf$', r'.*\.docx$'], 'extractor': [{'e': None}]},
+    'config': {'pattern': [r'.*/etc/.*'], 'extractor': [{'f': None}]},
+}
+
+
+def synthetic_paths(n, seed=0):
+    """ Generate `n` random paths """
+    rnd = random.Random(seed)
+    dirs = ['home', 'usr', 'etc', 'var', 'lib', 'src', 'data', 'tmp', 'photos']
+    paths = []
+    for i in range(n):
+        depth = rnd.randint(1, 6)
+        ext = rnd.choice(EXTENSIONS)
+        name = f'file{i}' + (f'.{ext}' if ext else '')
+        paths.append('/' + '/'.join(rnd.choice(dirs) for _ in range(depth)) + '/' + name)
+    return paths
+
+
+def legacy(rules, filename):
+    """ The loop used by the engine before :class:`RuleMatcher` """
+    exts = []
+    for rule_name, rule in rules.items():
+        for pattern in rule['pattern']:
+            if re.match(pattern, filename):
+                for extractor in rule['extractor']:
+                    for n, e in extractor.items():
+                        exts.append({f'{rule_name}.{n}': e})
+    return exts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RuleMatcher micro-benchmark')
+    parser.add_argument('--n', type=int, default=1000000, help='number of paths')
+    args = parser.parse_args()
+
+    paths = synthetic_paths(args.n)
+
+    tik = time()
+    legacy_matched = sum(1 for p in paths if legacy(RULES, p))
+    legacy_time = time() - tik
+
+    tik = time()
+    matcher = RuleMatcher(RULES)
+    matched = sum(1 for p in paths if matcher.extractors(p))
+    matcher_time = time() - tik
+
+    assert matched == legacy_matched, f'{matched} != {legacy_matched}'
+    print(f'paths:   {args.n}, matched: {matched}')
+    print(f'legacy:  {legacy_time:.2f}s ({args.n / legacy_time:,.0f} paths/s)')
+    print(f'matcher: {matcher_time:.2f}s ({args.n / matcher_time:,.0f} paths/s)')
+    print(f'speedup: {legacy_time / matcher_time:.1f}x')
+    print(f'stats:   {matcher.stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-04-26
+project: elasticizefiles
+
+An in-process stand-in for an Elastic node, it answers the few APIs used by
+:class:`Elastic` (index management, `_bulk`, `_update`, `_search`) without
+storing anything, so that the benchmarks measure the client side only.
+"""
+import gzip
+import json
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from threading import Lock
+from threading import Thread
+from time import sleep
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('content-length', 0))
+        body = self.rfile.read(length) if length > 0 else b''
+        if self.headers.get('content-encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def _reply(self, status, data=None):
+        body = json.dumps(data if data is not None else {}).encode()
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('x-elastic-product', 'Elasticsearch')
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _handle(self):
+        server = self.server
+        body = self._body()
+        path = self.path.split('?')[0].strip('/').split('/')
+        if server.latency > 0:
+            sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            server.bytes += len(body)
+        if path == ['']:
+            return self._reply(200, {
+                'version': {'number': '7.17.0', 'build_flavor': 'default'},
+                'tagline': 'You Know, for Search',
+            })
+        if path[-1] == '_bulk':
+            lines = [line for line in body.split(b'\n') if line.strip()]
+            items = []
+            for line in lines[::2]:
+                action = json.loads(line)
+                op, meta = next(iter(action.items()))
+                items.append({op: {'_id': meta.get('_id'), 'status': 200}})
+            with server.lock:
+                server.documents += len(items)
+            return self._reply(200, {'took': 1, 'errors': False, 'items': items})
+        if '_update' in path or '_doc' in path:
+            with server.lock:
+                server.documents += 1
+            return self._reply(200, {'_id': path[-1], 'result': 'updated'})
+        if path[-1] == '_search':
+            return self._reply(200, {
+                '_scroll_id': 'scroll',
+                'hits': {'total': {'value': 0}, 'hits': []},
+            })
+        if self.command == 'HEAD':
+            index = path[0]
+            return self._reply(200 if index in server.indices else 404)
+        if self.command == 'PUT' and len(path) == 1:
+            server.indices.add(path[0])
+        if self.command == 'DELETE' and len(path) == 1:
+            server.indices.discard(path[0])
+        return self._reply(200, {'acknowledged': True})
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PUT = _handle
+    do_DELETE = _handle
+    do_HEAD = _handle
+
+
+class FakeElastic(ThreadingHTTPServer):
+    """ A fake Elastic node listening on `localhost`
+
+    Example:
+
+        with FakeElastic() as es:
+            ElasticizeEngine(..., elastic_hosts=[es.host], ...)
+
+    :param latency: seconds added to each response, to simulate a remote node
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.latency = latency
+        self.lock = Lock()
+        self.indices = set()
+        self.requests = 0
+        self.documents = 0
+        self.bytes = 0
+        self._thread = None
+
+    @property
+    def host(self):
+        return f'{self.server_address[0]}:{self.server_address[1]}'
+
+    def start(self):
+        self._thread = Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-04-26
+project: elasticizefiles
+
+Throughput benchmark of :class:`ElasticizeEngine` on synthetic trees, against
+an in-process fake Elastic node (no network or cluster needed).
+
+For each tree it reports the end-to-end files/s and MB/s and the time spent by
+each stage (walk, match, hash, extract, index) measured in isolation, along
+with the per-stage time recorded by the engine metrics during the crawl. Results
+can be saved as JSON and compared with a previous run:
+
+    python benchmarks/run.py --output new.json --compare old.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import elasticizefiles  # noqa: E402
+from benchmarks.fake_es import FakeElastic  # noqa: E402
+from benchmarks.trees import TREES  # noqa: E402
+from elasticizefiles.base import Elastic  # noqa: E402
+from elasticizefiles.base import ElasticBulk  # noqa: E402
+from elasticizefiles.base import FileContext  # noqa: E402
+from elasticizefiles.base import RuleMatcher  # noqa: E402
+from elasticizefiles.engine import ElasticizeEngine  # noqa: E402
+from elasticizefiles.extractors.simple import ExtractFilename  # noqa: E402
+from elasticizefiles.extractors.simple import ExtractPythonFunction  # noqa: E402
+from elasticizefiles.extractors.simple import ExtractSha256  # noqa: E402
+from elasticizefiles.utils.files import scan_path  # noqa: E402
+from elasticizefiles.utils.hashing import hash_file  # noqa: E402
+
+PRESETS = {
+    'quick': {
+        'small': {'n_files': 2000, 'n_dirs': 20},
+        'huge': {'n_files': 2, 'size': 32 * 1024 * 1024},
+        'deep': {'depth': 8},
+        'duplicates': {'n_files': 1000, 'n_unique': 20},
+    },
+    'full': {
+        'small': {'n_files': 100000, 'n_dirs': 1000},
+        'huge': {'n_files': 4, 'size': 512 * 1024 * 1024},
+        'deep': {'depth': 14},
+        'duplicates': {'n_files': 20000, 'n_unique': 100},
+    },
+}
+
+
+def rules():
+    return {
+        'all': {
+            'pattern': ['.*'],
+            'extractor': [{'fn': ExtractFilename()}, {'sha256': ExtractSha256()}],
+        },
+        'python': {
+            'pattern': [r'.*\.py$'],
+            'extractor': [{'fun': ExtractPythonFunction()}],
+        },
+    }
+
+
+def timed(fn, *args, **kwargs):
+    tik = time()
+    r = fn(*args, **kwargs)
+    return r, time() - tik
+
+
+def bench_stages(root, host):
+    """ Time each stage in isolation """
+    stages = {}
+    entries, stages['walk'] = timed(lambda: list(scan_path(root)))
+    filenames = [os.path.join(d, f).replace('\\', '/') for d, f, _ in entries]
+
+    matcher = RuleMatcher(rules())
+    plans, stages['match'] = timed(lambda: [matcher.extractors(f) for f in filenames])
+
+    _, stages['hash'] = timed(lambda: [hash_file(f) for f in filenames])
+
+    def extract():
+        docs = []
+        for filename, plan in zip(filenames, plans):
+            with FileContext(filename) as context:
+                docs.append({name: e.extract_context(context) for name, e in plan})
+        return docs
+
+    docs, stages['extract'] = timed(extract)
+
+    def index():
+        with Elastic([host], 'stages', 'file') as es:
+            bulk = ElasticBulk(es)
+            for i, doc in enumerate(docs):
+                bulk.update(id=str(i), data=doc)
+            bulk.flush()
+
+    _, stages['index'] = timed(index)
+    return stages
+
+
+def bench_tree(name, params, workdir, latency, n_jobs):
+    root = os.path.join(workdir, name)
+    _, generation = timed(TREES[name], root, **params)
+    n_files = 0
+    n_bytes = 0
+    for _, _, st in scan_path(root):
+        n_files += 1
+        n_bytes += st.st_size
+    with FakeElastic(latency=latency) as es:
+        engine = ElasticizeEngine(path=root, rules=rules(),
+                                  elastic_hosts=[es.host],
+                                  elastic_index=f'bench_{name}',
+                                  elastic_doc_type='file')
+        _, seconds = timed(engine.crawl_and_process, n_jobs=n_jobs)
+        metrics = engine.metrics.snapshot()
+        indexed = es.documents
+        stages = bench_stages(root, es.host)
+    if indexed != n_files:
+        logging.warning(f'{name}: {indexed} documents indexed out of {n_files} files')
+    return {
+        'params': params,
+        'files': n_files,
+        'bytes': n_bytes,
+        'generation_seconds': generation,
+        'seconds': seconds,
+        'files_per_s': n_files / seconds,
+        'mb_per_s': n_bytes / seconds / 1024 / 1024,
+        'stages': stages,
+        # seconds spent in each stage during the crawl, summed over threads
+        'engine_stages': {k: h['sum'] for k, h in metrics['histograms'].items()},
+    }
+
+
+def compare(results, baseline):
+    print(f'\n{"tree":>12} {"old files/s":>12} {"new files/s":>12} {"ratio":>8}')
+    for name, r in results['trees'].items():
+        old = baseline.get('trees', {}).get(name)
+        if old is None:
+            continue
+        ratio = r['files_per_s'] / old['files_per_s']
+        flag = '  <-- regression' if ratio < 0.9 else ''
+        print(f'{name:>12} {old["files_per_s"]:>12.1f} {r["files_per_s"]:>12.1f} {ratio:>8.2f}{flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='elasticizefiles throughput benchmark')
+    parser.add_argument('--trees', nargs='+', default=list(TREES), choices=list(TREES))
+    parser.add_argument('--preset', default='quick', choices=list(PRESETS))
+    parser.add_argument('--workdir', default=None, help='where trees are generated (default: a temp folder)')
+    parser.add_argument('--latency', type=float, default=0., help='seconds added to each fake Elastic response')
+    parser.add_argument('--n-jobs', type=int, default=-1)
+    parser.add_argument('--output', default=None, help='save results to this JSON file')
+    parser.add_argument('--compare', default=None, help='a previous JSON results file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='elasticizefiles-bench-')
+    results = {
+        'version': elasticizefiles.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'preset': args.preset,
+        'latency': args.latency,
+        'trees': {},
+    }
+    try:
+        print(f'{"tree":>12} {"files":>8} {"MB":>8} {"files/s":>10} {"MB/s":>8}   stages (s)')
+        for name in args.trees:
+            r = bench_tree(name, PRESETS[args.preset][name], workdir, args.latency, args.n_jobs)
+            results['trees'][name] = r
+            stages = ' '.join(f'{k}={v:.2f}' for k, v in r['stages'].items())
+            print(f'{name:>12} {r["files"]:>8} {r["bytes"] / 1024 / 1024:>8.1f} '
+                  f'{r["files_per_s"]:>10.1f} {r["mb_per_s"]:>8.1f}   {stages}')
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-04-26
+project: elasticizefiles
+
+Generators of synthetic file trees used by the benchmarks. Trees are
+deterministic given the seed, so runs on different versions are comparable.
+"""
+import os
+import random
+
+EXTENSIONS = ['txt', 'py', 'log', 'json', 'bin']
+
+
+def _write(filename, size, rnd):
+    with open(filename, 'wb') as f:
+        while size > 0:
+            n = min(size, 1024 * 1024)
+            f.write(rnd.getrandbits(8 * n).to_bytes(n, 'little'))
+            size -= n
+
+
+def _python(rnd, n_lines):
+    lines = []
+    for i in range(n_lines):
+        kind = rnd.random()
+        if kind < 0.05:
+            lines.append(f'class Class{i}(object):')
+        elif kind < 0.2:
+            lines.append(f'    def method{i}(self):')
+        else:
+            lines.append(f'        value = {rnd.randint(0, 1000)}')
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def small_files(root, n_files=10000, n_dirs=100, seed=0):
+    """ Many small files (1 byte - 8KB) spread in a flat set of folders """
+    rnd = random.Random(seed)
+    for i in range(n_files):
+        dirname = os.path.join(root, f'd{i % n_dirs}')
+        os.makedirs(dirname, exist_ok=True)
+        ext = rnd.choice(EXTENSIONS)
+        filename = os.path.join(dirname, f'f{i}.{ext}')
+        if ext == 'py':
+            with open(filename, 'wb') as f:
+                f.write(_python(rnd, rnd.randint(1, 200)))
+        else:
+            _write(filename, rnd.randint(1, 8 * 1024), rnd)
+
+
+def huge_files(root, n_files=4, size=256 * 1024 * 1024, seed=0):
+    """ Few huge files """
+    rnd = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    for i in range(n_files):
+        _write(os.path.join(root, f'huge{i}.bin'), size, rnd)
+
+
+def deep_tree(root, depth=12, fanout=2, files_per_dir=4, seed=0):
+    """ A deeply nested tree of small files """
+    rnd = random.Random(seed)
+
+    def build(dirname, level):
+        os.makedirs(dirname, exist_ok=True)
+        for i in range(files_per_dir):
+            _write(os.path.join(dirname, f'f{i}.txt'), rnd.randint(1, 4 * 1024), rnd)
+        if level < depth:
+            for i in range(fanout):
+                build(os.path.join(dirname, f's{i}'), level + 1)
+
+    build(root, 1)
+
+
+def duplicates(root, n_files=5000, n_unique=50, size=64 * 1024, seed=0):
+    """ Many copies of few distinct contents """
+    rnd = random.Random(seed)
+    contents = [rnd.getrandbits(8 * size).to_bytes(size, 'little') for _ in range(n_unique)]
+    for i in range(n_files):
+        dirname = os.path.join(root, f'copy{i % 50}')
+        os.makedirs(dirname, exist_ok=True)
+        with open(os.path.join(dirname, f'f{i}.bin'), 'wb') as f:
+            f.write(contents[i % n_unique])
+
+
+TREES = {
+    'small': small_files,
+    'huge': huge_files,
+    'deep': deep_tree,
+    'duplicates': duplicates,
+}
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-04-19
+project: elasticizefiles
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import perf_counter
+from time import time
+
+from elasticizefiles.base import AsyncElasticBulk
+from elasticizefiles.base import SeenIds
+from elasticizefiles.engine import ElasticizeEngine
+from elasticizefiles.utils.pipeline import InFlight
+
+
+class AsyncElasticizeEngine(ElasticizeEngine):
+    """ An :class:`ElasticizeEngine` driving the crawl from one event loop:
+    files are read and processed by a bounded pool of threads (extractors are
+    still sync), while the writes to Elastic are async and many bulk requests
+    can be in flight at the same time. It pays off with remote clusters,
+    where the latency of each request dominates.
+
+    It accepts the same params of :class:`ElasticizeEngine`, it requires
+    `aiohttp` (`pip install -U elasticsearch[async]`). With a `sink` the
+    documents are written to it from the event loop. Files are processed one
+    at a time, extractors with a `batch_size` included.
+    """
+
+    def crawl_and_process(self, n_jobs=-1, n_processes=-1, queue_size=None,
+                          n_walkers=4, log_interval=None, profiler=None,
+                          path=None, recursive=True, reconcile=False, *,
+                          max_in_flight=1000, max_requests=8):
+        """ Crawl files and apply extractor on them, see :meth:`crawl`. """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.crawl(n_jobs=n_jobs,
+                                                      n_processes=n_processes,
+                                                      queue_size=queue_size,
+                                                      n_walkers=n_walkers,
+                                                      log_interval=log_interval,
+                                                      profiler=profiler,
+                                                      path=path,
+                                                      recursive=recursive,
+                                                      reconcile=reconcile,
+                                                      max_in_flight=max_in_flight,
+                                                      max_requests=max_requests))
+        finally:
+            loop.close()
+
+    async def crawl(self, n_jobs=-1, n_processes=-1, queue_size=None,
+                    n_walkers=4, log_interval=None, profiler=None, path=None,
+                    recursive=True, reconcile=False, *, max_in_flight=1000,
+                    max_requests=8):
+        """ Crawl files and apply extractor on them. The params are the ones
+        of :meth:`ElasticizeEngine.crawl_and_process`, plus:
+
+        :param queue_size: the size of the queue of the files waiting to be
+                           processed, if None will be set to `max_in_flight`
+        :param max_in_flight: max number of files being processed or waiting
+                              to be indexed
+        :param max_requests: max number of bulk requests in flight
+        :return: the number of files processed
+        """
+        n_jobs, _ = self._start(n_jobs, n_processes, queue_size, log_interval, profiler)
+        if queue_size is None:
+            queue_size = max_in_flight
+        if reconcile is True:
+            reconcile = SeenIds()
+        if reconcile is not False:
+            self._seen = reconcile
+            self._failed_files = set()
+            self._unconfirmed = {}
+        self._completed = 0
+        self._skipped = 0
+        self._tik = time()
+        # the files in flight are bounded by `max_in_flight`, only the bytes
+        # of the documents are capped here
+        self._in_flight = InFlight(None, self._max_in_flight_bytes)
+        applier = self._applier
+        if self._profiler is not None:
+            applier = self._profiler.profiled(applier)
+        loop = asyncio.get_event_loop()
+        files = asyncio.Queue(maxsize=queue_size)
+        self.metrics.gauge_fn('queue.files', files.qsize)
+        if self._sink is None:
+            bulk = AsyncElasticBulk(self._es, **dict(self._bulk_config,
+                                                     max_requests=max_requests))
+        else:
+            bulk = self._sink
+        executor = ThreadPoolExecutor(n_jobs)
+        walker = ThreadPoolExecutor(1)
+        try:
+            workers = [asyncio.ensure_future(self._worker(files, executor, bulk, applier))
+                       for _ in range(max_in_flight)]
+            await loop.run_in_executor(walker, self._walk_into, files, loop, n_walkers,
+                                       path, recursive)
+            for _ in workers:
+                await files.put(None)
+            await asyncio.gather(*workers)
+            if self._sink is None:
+                await bulk.close()
+            else:
+                bulk.close()
+            if self._state is not None:
+                self._state.commit()
+            if self._cache is not None:
+                self._cache.commit()
+            if reconcile is not False:
+                # Elastic is read and written through the sync client
+                await loop.run_in_executor(walker, partial(self.reconcile, reconcile, path=path,
+                                                           recursive=recursive,
+                                                           failed=self._failed_files))
+        finally:
+            self._seen = None
+            self._failed_files = None
+            self._unconfirmed = None
+            walker.shutdown()
+            executor.shutdown()
+            if self._es is not None:
+                await self._es.async_close()
+            self._stop()
+        logging.info(f'completed {self._completed} in {(time() - self._tik):.2f}s')
+        logging.info(f'skipped: {self._skipped} unchanged files')
+        logging.info(f'matcher: {self._matcher.stats}, rules: {self._matcher.hits}')
+        logging.info(f'indexed: {bulk.sent} documents, failed: {bulk.failed}')
+        self.metrics.log()
+        return self._completed
+
+    def _walk_into(self, files, loop, n_walkers, path=None, recursive=True, batch_size=100):
+        """ Walk the path (in a thread) putting the files to be processed in
+        the `files` queue of the event loop """
+
+        def put(items):
+            self._in_flight.acquire(len(items))
+            if self._state is not None:
+                items = self._skip_unchanged(items)
+            for item in items:
+                asyncio.run_coroutine_threadsafe(files.put(item), loop).result()
+
+        batch = []
+        for item in self._walk(n_walkers, path, recursive):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                put(batch)
+                batch = []
+        put(batch)
+
+    async def _worker(self, files, executor, bulk, applier):
+        loop = asyncio.get_event_loop()
+        while True:
+            item = await files.get()
+            if item is None:
+                break
+            try:
+                r = await loop.run_in_executor(executor, applier, item)
+            except Exception as e:
+                logging.exception(f'[extract] failed: {e}')
+                self._task_failed(item)
+                continue
+            tik = perf_counter()
+            size = ElasticizeEngine._doc_size(r)
+            docs = self._documents(r)
+            try:
+                for doc in docs:
+                    if self._sink is None:
+                        await bulk.update(id=doc['file_id'], data=doc)
+                    else:
+                        bulk.update(id=doc['file_id'], data=doc)
+            finally:
+                self._in_flight.release(1, size)
+            self.metrics.observe('index', perf_counter() - tik)
+            self._indexed(docs)
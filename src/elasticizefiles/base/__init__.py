@@ -3,5 +3,22 @@
 Created by Pierluigi on 2020-02-02
 project: elasticizefiles
 """
+from elasticizefiles.base.context import FileContext
 from elasticizefiles.base.extractor import Extractor
-from elasticizefiles.base.elastic import Elastic
\ No newline at end of file
+from elasticizefiles.base.elastic import Elastic
+from elasticizefiles.base.elastic import ElasticBulk
+from elasticizefiles.base.state import FileState
+from elasticizefiles.base.matcher import RuleMatcher
+from elasticizefiles.base.pool import ExtractorPool
+from elasticizefiles.base.dedup import ContentDedup
+from elasticizefiles.base.elastic import AsyncElasticBulk
+from elasticizefiles.base.sink import Sink
+from elasticizefiles.base.sink import NdjsonSink
+from elasticizefiles.base.sink import SpoolSink
+from elasticizefiles.base.sink import Shipper
+from elasticizefiles.base.workqueue import WorkQueue
+from elasticizefiles.base.seen import SeenIds
+from elasticizefiles.base.seen import BloomFilter
+from elasticizefiles.base.cache import ExtractorCache
+from elasticizefiles.base.task import Extraction
+from elasticizefiles.base.task import Task
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-06-13
+project: elasticizefiles
+"""
+import json
+import logging
+import sqlite3
+import zlib
+from threading import Lock
+from time import time
+
+from elasticizefiles.base.sink import serialize
+
+
+class ExtractorCache(object):
+    """ A local SQLite cache of the outputs of the extractors, keyed by the
+    content hash of the file and the :meth:`Extractor.cache_key` of the
+    extractor (its class and `version`), so that rebuilding an index or
+    adding a rule runs only the extractors whose output is not known yet.
+
+    Outputs are stored as zlib compressed JSON; once the cache is larger than
+    `max_bytes` the least recently used outputs are evicted. Writes (and the
+    last use of the outputs read) are batched and written by :meth:`commit`.
+
+    :param filename: the SQLite database filename
+    :param max_bytes: the max size of the outputs stored
+    :param level: the zlib compression level
+    :param batch_size: number of writes batched in a single transaction
+    """
+
+    def __init__(self, filename, max_bytes=1024 * 1024 * 1024, level=6,
+                 batch_size=500):
+        self._filename = filename
+        self._max_bytes = max_bytes
+        self._level = level
+        self._batch_size = batch_size
+        self._lock = Lock()
+        self._writes = {}
+        self._uses = {}
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS outputs ('
+                         'key TEXT PRIMARY KEY, data BLOB, size INTEGER, '
+                         'used REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS outputs_used ON outputs (used)')
+        self._db.commit()
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM outputs').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        logging.debug(f'extractor cache: {filename} ({self._size} bytes)')
+
+    @staticmethod
+    def _key(sha256, extractor):
+        return f'{sha256}:{extractor.cache_key()}'
+
+    def get(self, sha256, extractor):
+        """ The output of `extractor` on a content
+
+        :param sha256: the content hash
+        :param extractor: an :class:`Extractor`
+        :return: the output or None if it is not cached
+        """
+        key = ExtractorCache._key(sha256, extractor)
+        with self._lock:
+            row = self._writes.get(key)
+            if row is None:
+                row = self._db.execute('SELECT data FROM outputs WHERE key = ?', (key, )).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._uses[key] = time()
+            flush = len(self._uses) >= self._batch_size
+        if flush:
+            self.commit()
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, sha256, extractor, output):
+        """ Record the `output` of `extractor` on a content """
+        try:
+            data = zlib.compress(serialize(output).encode(), self._level)
+        except Exception as e:
+            logging.debug(f'output of {extractor.cache_key()} not cached: {e}')
+            return
+        with self._lock:
+            self._writes[ExtractorCache._key(sha256, extractor)] = (data, len(data), time())
+            flush = len(self._writes) >= self._batch_size
+        if flush:
+            self.commit()
+
+    def commit(self):
+        """ Write the pending outputs and evict the least recently used ones
+        if the cache is too large """
+        with self._lock:
+            writes = self._writes
+            uses = self._uses
+            self._writes = {}
+            self._uses = {}
+            if len(writes) + len(uses) == 0:
+                return
+            keys = list(writes)
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                replaced = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM outputs '
+                                            f'WHERE key IN ({marks})', chunk).fetchone()[0]
+                self._size -= replaced
+            self._db.executemany('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)',
+                                 [(key, ) + w for key, w in writes.items()])
+            self._size += sum(w[1] for w in writes.values())
+            self._db.executemany('UPDATE outputs SET used = ? WHERE key = ?',
+                                 [(used, key) for key, used in uses.items()])
+            if self._size > self._max_bytes:
+                self._evict()
+            self._db.commit()
+        logging.debug(f'extractor cache: {len(writes)} outputs written')
+
+    def _evict(self):
+        """ Drop the least recently used outputs down to 90% of `max_bytes`,
+        to be called holding the lock """
+        target = self._max_bytes * .9
+        evicted = 0
+        cursor = self._db.execute('SELECT key, size FROM outputs ORDER BY used')
+        keys = []
+        for key, size in cursor:
+            if self._size <= target:
+                break
+            keys.append((key, ))
+            self._size -= size
+            evicted += 1
+        self._db.executemany('DELETE FROM outputs WHERE key = ?', keys)
+        logging.debug(f'extractor cache: {evicted} outputs evicted')
+
+    def close(self):
+        """ Write the pending outputs and close the database """
+        self.commit()
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-03-15
+project: elasticizefiles
+"""
+import mmap
+import os
+
+from elasticizefiles.utils.hashing import new_hash
+
+
+class FileContext(object):
+    """ A file being processed, shared by the engine and all the extractors
+    applied on it. The file is opened once and memory-mapped, all the values
+    computed on it are memoized so they are read only once.
+
+    :param filename: the filename (path+filename)
+    :param stat: the :func:`os.stat` result if already known
+    :param chunk_size: the size of the chunks fed to the hash functions
+    """
+
+    def __init__(self, filename, stat=None, chunk_size=1024 * 1024):
+        self.filename = filename
+        self._stat = stat
+        self._chunk_size = chunk_size
+        self._fd = None
+        self._mmap = None
+        self._view = None
+        self._hashes = {}
+        self._text = {}
+
+    @property
+    def stat(self):
+        """ The :func:`os.stat` result of the file """
+        if self._stat is None:
+            if self._fd is not None:
+                self._stat = os.fstat(self._fd)
+            else:
+                self._stat = os.stat(self.filename)
+        return self._stat
+
+    @property
+    def size(self):
+        """ The file size in bytes """
+        return self.stat.st_size
+
+    def view(self):
+        """ A read-only zero-copy view of the whole file content
+
+        :returns: a :class:`memoryview`
+        """
+        if self._view is None:
+            self._fd = os.open(self.filename, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            if os.fstat(self._fd).st_size == 0:
+                # empty files cannot be mapped
+                self._view = memoryview(b'')
+            else:
+                self._mmap = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._mmap)
+        return self._view
+
+    def header(self, size=512):
+        """ The first `size` bytes of the file """
+        return bytes(self.view()[:size])
+
+    def hash(self, hash_type='sha256'):
+        """ The hex digest of the file content
+
+        :param hash_type: an hashing function, see :func:`new_hash`
+        """
+        return self.hashes(hash_type)[hash_type]
+
+    def hashes(self, *hash_types):
+        """ Compute several hex digests reading the content once
+
+        :param hash_types: hashing functions, see :func:`new_hash`
+        :returns: a dict `{hash_type: digest}`
+        """
+        missing = [h for h in hash_types if h not in self._hashes]
+        if len(missing) > 0:
+            funcs = [new_hash(h) for h in missing]
+            view = self.view()
+            for i in range(0, len(view), self._chunk_size):
+                chunk = view[i:i + self._chunk_size]
+                for func in funcs:
+                    func.update(chunk)
+            for h, func in zip(missing, funcs):
+                self._hashes[h] = func.hexdigest()
+        return {h: self._hashes[h] for h in hash_types}
+
+    def text(self, encoding='utf-8', errors='replace'):
+        """ The file content decoded as text """
+        key = (encoding, errors)
+        if key not in self._text:
+            self._text[key] = str(self.view(), encoding, errors)
+        return self._text[key]
+
+    def close(self):
+        """ Release the file """
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # an extractor still holds a view, it will be closed once
+                # garbage collected
+                pass
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._text = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-04-05
+project: elasticizefiles
+"""
+import logging
+from collections import OrderedDict
+from threading import Lock
+
+
+class ContentDedup(object):
+    """ Reuse the outputs of the extractors for files with the same content.
+
+    Outputs are keyed by `(sha256, 'rule.extractor')`: they are kept in an
+    in-memory LRU during a crawl and, if `elastic` is given, looked up among
+    the documents already in the index, so they are shared across runs and
+    machines.
+
+    :param max_size: max number of contents kept in memory
+    :param elastic: an :class:`Elastic` instance to look up in, or None
+    """
+
+    def __init__(self, max_size=10000, elastic=None):
+        self._max_size = max_size
+        self._elastic = elastic
+        self._lock = Lock()
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, sha256, keys):
+        """ Get the outputs already known for a content
+
+        :param sha256: the content hash
+        :param keys: the `'rule.extractor'` names of the outputs needed
+        :return: a dict `{key: output}` of the outputs found
+        """
+        if len(keys) == 0:
+            return {}
+        with self._lock:
+            outputs = self._cache.get(sha256)
+            if outputs is not None:
+                self._cache.move_to_end(sha256)
+                outputs = dict(outputs)
+        if outputs is None:
+            outputs = {}
+            if self._elastic is not None:
+                # remember misses too, so the index is searched only once
+                outputs = self._search(sha256, keys)
+                with self._lock:
+                    self._store(sha256, outputs)
+        r = {k: outputs[k] for k in keys if k in outputs}
+        with self._lock:
+            self.hits += len(r)
+            self.misses += len(keys) - len(r)
+        return r
+
+    def put(self, sha256, key, output):
+        """ Record the `output` of the extractor `key` on a content """
+        with self._lock:
+            outputs = self._cache.get(sha256)
+            if outputs is None:
+                self._store(sha256, {key: output})
+            else:
+                outputs[key] = output
+
+    def _store(self, sha256, outputs):
+        self._cache[sha256] = outputs
+        self._cache.move_to_end(sha256)
+        while len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+
+    def _search(self, sha256, keys):
+        """ Look for a document with the same content in the index """
+        query = {
+            # the child documents of chunked outputs share the content hash
+            'query': {'bool': {'must': {'match': {'sha256': sha256}},
+                               'must_not': {'exists': {'field': 'parent_id'}}}},
+            '_source': list(keys),
+        }
+        try:
+            res = self._elastic.search(query, size=1)
+        except Exception as e:
+            logging.warning(f'dedup lookup of {sha256} failed: {e}')
+            return {}
+        hits = res['hits']['hits']
+        if len(hits) == 0:
+            return {}
+        return hits[0]['_source']
@@ -6,9 +6,58 @@ project: elasticizefiles
 
 import logging
 import math
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full
+from queue import Queue
+from threading import Condition
+from threading import Event
+from threading import Lock
+from threading import Thread
+from time import perf_counter
+from time import sleep
+from time import time
 
-from elasticsearch import Elasticsearch
-from elasticsearch.connection import RequestsHttpConnection
+from elasticizefiles.base.sink import NdjsonSink
+from elasticizefiles.base.sink import RETRY_STATUS
+from elasticizefiles.base.sink import Sink
+from elasticizefiles.base.sink import bulk_action
+from elasticizefiles.base.sink import delete_action
+from elasticizefiles.base.sink import request_status
+from elasticizefiles.base.sink import retry_delay
+
+
+_connection_class = None
+
+
+def pooled_connection_class():
+    """ The connection class of the clients, defined on first use so that
+    `elasticsearch` and `requests` (slow to import) are imported only when a
+    client is needed """
+    global _connection_class
+    if _connection_class is not None:
+        return _connection_class
+    from elasticsearch.connection import RequestsHttpConnection
+    from requests.adapters import HTTPAdapter
+
+    class PooledHttpConnection(RequestsHttpConnection):
+        """ A :class:`RequestsHttpConnection` whose session keeps up to
+        `maxsize` connections alive, so that it can be shared by several
+        threads.
+
+        :param maxsize: the number of connections kept in the pool
+        :param keep_alive: if False connections are closed after each request
+        """
+
+        def __init__(self, maxsize=10, keep_alive=True, **kwargs):
+            RequestsHttpConnection.__init__(self, **kwargs)
+            adapter = HTTPAdapter(pool_connections=maxsize, pool_maxsize=maxsize)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            if not keep_alive:
+                self.session.headers['connection'] = 'close'
+
+    _connection_class = PooledHttpConnection
+    return _connection_class
 
 
 class Elastic(object):
@@ -18,15 +67,102 @@ class Elastic(object):
     AND is spelled must
     NOR is spelled should_not
 
+    The underlying client is created on first use and shared by all the
+    threads using this instance, call :meth:`close` (or use it as a context
+    manager) to release its connections.
+
     :param hosts: list of nodes {host}:{port}
     :param index: index name
     :param doc_type: document type
+    :param timeout: the timeout in seconds of each request
+    :param maxsize: the number of connections kept alive for each node
+    :param keep_alive: if False connections are closed after each request
+    :param client_kwargs: additional params for :class:`Elasticsearch`
     """
 
-    def __init__(self, hosts, index, doc_type):
+    def __init__(self, hosts, index, doc_type, timeout=30, maxsize=10,
+                 keep_alive=True, **client_kwargs):
         self._hosts = hosts
         self._index = index
         self._doc_type = doc_type
+        self._timeout = timeout
+        self._maxsize = maxsize
+        self._keep_alive = keep_alive
+        self._client_kwargs = client_kwargs
+        self._es = None
+        self._es_lock = Lock()
+        self._aes = None
+
+    def _client(self):
+        """ Internal helper returning the shared ES client """
+        if self._es is None:
+            with self._es_lock:
+                if self._es is None:
+                    from elasticsearch import Elasticsearch
+
+                    logging.debug(f'connecting to {self._hosts}')
+                    kwargs = {
+                        'http_compress': True,
+                        'retry_on_timeout': True,
+                    }
+                    kwargs.update(self._client_kwargs)
+                    self._es = Elasticsearch(hosts=self._hosts,
+                                             connection_class=pooled_connection_class(),
+                                             timeout=self._timeout,
+                                             maxsize=self._maxsize,
+                                             keep_alive=self._keep_alive,
+                                             **kwargs)
+        return self._es
+
+    def _async_client(self):
+        """ Internal helper returning the shared async ES client, it must be
+        used from a single event loop """
+        if self._aes is None:
+            try:
+                from elasticsearch import AsyncElasticsearch
+            except Exception as e:
+                raise Exception('module `aiohttp` is not installed, try `pip install -U elasticsearch[async]`')
+            kwargs = {
+                'http_compress': True,
+                'retry_on_timeout': True,
+            }
+            kwargs.update(self._client_kwargs)
+            self._aes = AsyncElasticsearch(hosts=self._hosts,
+                                           timeout=self._timeout,
+                                           maxsize=self._maxsize,
+                                           **kwargs)
+        return self._aes
+
+    async def async_bulk(self, body):
+        """ES bulk wrapper, async version of :meth:`bulk`"""
+        logging.debug(f'async bulk in {self._index}')
+        es = self._async_client()
+        try:
+            r = await es.bulk(body=body, index=self._index, doc_type=self._doc_type)
+        except Exception as e:
+            logging.warning(f'exception: {e}')
+            raise e
+        return r['items']
+
+    async def async_close(self):
+        """ Close all the connections of the shared async client """
+        if self._aes is not None:
+            await self._aes.close()
+            self._aes = None
+
+    def close(self):
+        """ Close all the connections of the shared client """
+        with self._es_lock:
+            if self._es is not None:
+                self._es.transport.close()
+                self._es = None
+                logging.debug(f'disconnected from {self._hosts}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def create_index(self, index_name, doc_type, create_if_not_exists=True,
                      drop_if_exists=False, config=None, mapping=None,
@@ -41,9 +177,7 @@ class Elastic(object):
         :param mapping: the data type mapping for the current index
         :param alias_name: an alias name for this index
         """
-        es = Elasticsearch(hosts=self._hosts, http_compress=True,
-                           connection_class=RequestsHttpConnection,
-                           timeout=30)
+        es = self._client()
         if drop_if_exists:
             es.indices.delete(index=index_name)
             logging.debug(f'index: {index_name} dropped')
@@ -64,91 +198,175 @@ class Elastic(object):
         self._doc_type = doc_type
         return self
 
-    def iterate_data(self, query, page_size=100, raw=False):
+    def iterate_data(self, query, page_size=1000, raw=False, slices=1,
+                     source=None, scroll='5m'):
         """ A generator to collect data from ES matching `query`
 
+        With `slices` greater than 1 the query is split in independent
+        sliced scrolls read in parallel by as many threads, their documents
+        are merged in a single stream (in no particular order). Scroll
+        contexts are cleared as soon as they are consumed, or when the
+        generator is closed.
+
         :param query: ES query dictionary
         :param page_size: used for pagination (do not touch if you do not know)
         :param raw: whether return elastic metadata too or not
+        :param slices: number of scrolls read in parallel
+        :param source: the fields of `_source` to be returned, False for none,
+                       by default the whole `_source`
+        :param scroll: how long each scroll context is kept between pages
         :return: a list of documents
         """
         logging.debug(f'iterate_data from {self._index}')
+        if source is not None:
+            query = dict(query, _source=source)
+        if slices > 1:
+            pages = self._sliced(query, slices, page_size=page_size, scroll=scroll)
+        else:
+            pages = self._scroll(query, page_size=page_size, scroll=scroll)
         try:
-            for page in self._scroll(query, page_size=page_size):
-                docs = page['hits']['hits']
-                if len(docs) == 0:
-                    break
-                for doc in docs:
+            for page in pages:
+                for doc in page['hits']['hits']:
                     if raw is False:
-                        yield doc['_source']
+                        yield doc.get('_source', {})
                     else:
                         yield doc
         except Exception as e:
             logging.warning(f'exception: {e}')
             raise e
+        finally:
+            pages.close()
 
-    def get_data(self, query, limit=1000, page_size=100, raw=False):
+    def get_data(self, query, limit=1000, page_size=100, raw=False, source=None):
         """ Collect data from ES matching `query`
 
         :param query: ES query dictionary
         :param limit: max number of docs to be returned
         :param page_size: used for pagination (do not touch if you do not know)
         :param raw: whether return elastic metadata too or not
+        :param source: the fields of `_source` to be returned, False for none,
+                       by default the whole `_source`
         :return: a list of documents
         """
         logging.debug(f'get_data from {self._index}')
         _data = []
-        try:
-            for page in self._scroll(query, page_size=page_size):
-                docs = page['hits']['hits']
-                if len(docs) == 0:
-                    break
-                if raw is False:
-                    for doc in docs:
-                        _data.append(doc['_source'])
-                else:
-                    _data.extend(docs)
-                logging.debug(f'collected {len(_data)} docs')
-                if len(_data) >= limit:
-                    break
-        except Exception as e:
-            logging.warning(f'[es] exception: {e}')
-            raise e
-        return _data[:limit]
+        for doc in self.iterate_data(query, page_size=min(page_size, limit),
+                                     raw=raw, source=source):
+            _data.append(doc)
+            if len(_data) >= limit:
+                break
+        logging.debug(f'collected {len(_data)} docs')
+        return _data
 
-    def _scroll(self, query, page_size=100, scroll='5m'):
-        """ Internal helper to ES scroll
+    def export(self, filename, query=None, slices=1, page_size=1000,
+               source=None, compress=None):
+        """ Export the documents matching `query` in a NDJSON file of `_bulk`
+        actions (see :class:`NdjsonSink`), ready to be indexed again
+
+        :param filename: the output file
+        :param query: ES query dictionary, by default all the documents
+        :param slices: number of scrolls read in parallel
+        :param page_size: used for pagination
+        :param source: the fields of `_source` to be exported
+        :param compress: if True the file is gzipped, if None it is when
+                         `filename` ends with `.gz`
+        :return: the number of documents exported
+        """
+        if query is None:
+            query = {'query': {'match_all': {}}}
+        with NdjsonSink(filename, compress=compress, max_docs=10 * page_size) as sink:
+            for doc in self.iterate_data(query, page_size=page_size, raw=True,
+                                         slices=slices, source=source):
+                sink.update(doc['_id'], doc.get('_source', {}))
+        logging.info(f'exported {sink.sent} documents from {self._index} to {filename}')
+        return sink.sent
+
+    def _scroll(self, query, page_size=100, scroll='5m', slice=None):
+        """ Internal helper to ES scroll, the scroll context is cleared when
+        the pages end or the generator is closed
+
+        :param slice: a tuple `(id, max)` to read a single slice
         """
-        es = Elasticsearch(hosts=self._hosts, http_compress=True,
-                           connection_class=RequestsHttpConnection,
-                           timeout=30)
+        es = self._client()
+        if slice is not None:
+            query = dict(query, slice={'id': slice[0], 'max': slice[1]})
         page = es.search(index=self._index, doc_type=self._doc_type,
                          scroll=scroll, size=page_size, body=query)
-        sid = page['_scroll_id']
+        sid = page.get('_scroll_id')
         scroll_size = page['hits']['total']['value']
         page_counter = 0
         logging.debug(f'total items : {scroll_size}')
         logging.debug(f'total pages : {math.ceil(scroll_size / page_size)}')
-        # Start scrolling
-        while scroll_size > 0:
-            # Get the number of results that we returned in the last scroll
-            scroll_size = len(page['hits']['hits'])
-            if scroll_size > 0:
+        try:
+            while len(page['hits']['hits']) > 0:
                 logging.debug((f'> scrolling page {page_counter} : '
-                               f'{scroll_size} items'))
+                               f'{len(page["hits"]["hits"])} items'))
                 yield page
-            # get next page
-            page = es.scroll(scroll_id=sid, scroll=scroll)
-            page_counter += 1
-            # Update the scroll ID
-            sid = page['_scroll_id']
+                # get next page
+                page = es.scroll(scroll_id=sid, scroll=scroll)
+                page_counter += 1
+                # Update the scroll ID
+                sid = page.get('_scroll_id', sid)
+        finally:
+            if sid is not None:
+                try:
+                    es.clear_scroll(scroll_id=sid)
+                except Exception as e:
+                    logging.debug(f'cannot clear scroll {sid}: {e}')
+
+    def _sliced(self, query, slices, page_size=100, scroll='5m'):
+        """ Internal helper reading `slices` sliced scrolls in parallel and
+        merging their pages """
+        pages = Queue(maxsize=2 * slices)
+        stop = Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=.1)
+                    return
+                except Full:
+                    pass
+
+        def worker(i):
+            scroller = self._scroll(query, page_size=page_size, scroll=scroll,
+                                    slice=(i, slices))
+            try:
+                for page in scroller:
+                    if stop.is_set():
+                        break
+                    put(page)
+            except Exception as e:
+                put(e)
+            finally:
+                scroller.close()
+                put(done)
+
+        threads = [Thread(target=worker, args=(i, ), name=f'slice-{i}', daemon=True)
+                   for i in range(slices)]
+        for t in threads:
+            t.start()
+        try:
+            finished = 0
+            while finished < slices:
+                page = pages.get()
+                if page is done:
+                    finished += 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            # the consumer may stop early: unblock and wait the workers
+            stop.set()
+            for t in threads:
+                t.join()
 
     def search(self, query, **kwargs):
         """ES search wrapper"""
         logging.debug(f'search in {self._index}')
-        es = Elasticsearch(hosts=self._hosts, http_compress=True,
-                           connection_class=RequestsHttpConnection,
-                           timeout=30)
+        es = self._client()
         try:
             res = es.search(index=self._index, doc_type=self._doc_type,
                             body=query, **kwargs)
@@ -160,9 +378,7 @@ class Elastic(object):
     def store(self, data):
         """ES store wrapper"""
         logging.debug(f'store in {self._index}')
-        es = Elasticsearch(hosts=self._hosts, http_compress=True,
-                           connection_class=RequestsHttpConnection,
-                           timeout=30)
+        es = self._client()
         try:
             r = es.index(index=self._index, doc_type=self._doc_type,
                          body=data)
@@ -174,12 +390,425 @@ class Elastic(object):
     def update(self, id, data, upsert=True):
         """ES update wrapper"""
         logging.debug(f'update in {self._index}')
-        es = Elasticsearch(hosts=self._hosts, http_compress=True,
-                           connection_class=RequestsHttpConnection,
-                           timeout=30)
+        es = self._client()
         try:
             r = es.update(index=self._index, doc_type=self._doc_type,
                           id=id, body={'doc': data, 'doc_as_upsert': upsert})
         except Exception as e:
             logging.warning(f'exception: {e}')
             raise e
+
+    def bulk(self, body):
+        """ES bulk wrapper
+
+        :param body: the newline delimited actions already serialized
+        :return: the `items` list of the bulk response
+        """
+        logging.debug(f'bulk in {self._index}')
+        es = self._client()
+        try:
+            r = es.bulk(body=body, index=self._index, doc_type=self._doc_type)
+        except Exception as e:
+            logging.warning(f'exception: {e}')
+            raise e
+        return r['items']
+
+
+class AdaptiveLimit(object):
+    """ A limit adapted with the AIMD rule (additive increase, multiplicative
+    decrease) used by TCP congestion control: it grows by `step` while the
+    cluster keeps up and it is halved as soon as it pushes back.
+
+    :param maximum: the upper bound of the limit
+    :param minimum: the lower bound of the limit
+    :param initial: the starting value, by default `maximum`
+    :param step: the additive increase
+    """
+
+    def __init__(self, maximum, minimum=1, initial=None, step=1):
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.value = maximum if initial is None else initial
+        self._step = step
+
+    def increase(self):
+        self.value = min(self.maximum, self.value + self._step)
+
+    def decrease(self):
+        self.value = max(self.minimum, self.value // 2)
+
+
+class ElasticBulk(Sink):
+    """ Collect upsert actions and send them to Elastic through the `_bulk`
+    API. Actions are flushed as soon as one of the limits is hit, or when
+    :meth:`flush` is called explicitly. A background timer flushes the
+    actions buffered for longer than `max_seconds` even if no other action
+    is added, it is stopped by :meth:`close`.
+
+    It exposes the same `update` method of :class:`Elastic` so it can be used
+    in place of it, the upsert semantic is preserved: every document is
+    sent as `{'doc': data, 'doc_as_upsert': upsert}` on its `id`. It is the
+    :class:`Sink` used by the engine by default.
+
+    Items rejected because the cluster is overloaded (429) or unavailable
+    (502, 503, 504, timeouts and connection errors) are sent again, alone,
+    after an exponential backoff with jitter; the other errors are final.
+    With `adaptive` the number of actions per request and the number of
+    requests in flight follow the cluster: they are halved when it rejects
+    items or answers slower than `target_seconds`, and they grow back while
+    it keeps up.
+
+    :param elastic: an :class:`Elastic` instance
+    :param max_docs: flush when this number of actions is buffered
+    :param max_bytes: flush when the buffered payload reaches this size
+    :param max_seconds: flush when the oldest buffered action is older than
+                        this number of seconds
+    :param on_failure: a callable `(id, error)` called for each item rejected
+                       by Elastic
+    :param on_success: a callable `(ids)` called with the ids of the items
+                       indexed by each bulk request
+    :param metrics: a :class:`Metrics` where to record the requests
+    :param max_requests: max number of bulk requests in flight, when greater
+                         than 1 requests are sent by background threads
+    :param max_retries: max number of times an item is sent again
+    :param backoff: the base delay in seconds between two retries
+    :param max_backoff: the max delay in seconds between two retries
+    :param adaptive: if True adapt the size of the requests and the number
+                     of requests in flight to the cluster
+    :param target_seconds: the latency of a bulk request above which the
+                           cluster is considered overloaded
+    """
+
+    RETRY_STATUS = RETRY_STATUS
+
+    def __init__(self, elastic, max_docs=500, max_bytes=5 * 1024 * 1024,
+                 max_seconds=5., on_failure=None, on_success=None,
+                 metrics=None, max_requests=1, max_retries=5, backoff=.5,
+                 max_backoff=30., adaptive=True, target_seconds=2.):
+        Sink.__init__(self, on_failure=on_failure, on_success=on_success,
+                      metrics=metrics)
+        self._elastic = elastic
+        self._max_bytes = max_bytes
+        self._max_seconds = max_seconds
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._adaptive = adaptive
+        self._target_seconds = target_seconds
+        self._docs = AdaptiveLimit(max_docs, minimum=10, step=max(1, max_docs // 10))
+        self._requests = AdaptiveLimit(max_requests, initial=1 if adaptive else None)
+        self._lock = Lock()
+        self._in_flight = 0
+        self._idle = Condition(Lock())
+        self._executor = None
+        self._pending = []
+        self._buffer = []
+        self._size = 0
+        self._since = None
+        self._flushing = Lock()
+        self._timer = None
+        self._closed = Event()
+        self.retried = 0
+
+    def update(self, id, data, upsert=True):
+        """ Buffer an upsert of `data` on document `id` """
+        if self._add(id, bulk_action(id, data, upsert)):
+            self._flush(wait=False)
+
+    def delete(self, id):
+        """ Buffer the deletion of document `id` """
+        if self._add(id, delete_action(id)):
+            self._flush(wait=False)
+
+    def flush(self):
+        """ Send all the buffered actions and wait for the requests in flight
+
+        :return: a list of `(id, error)` for the rejected items
+        """
+        return self._flush(wait=True)
+
+    def _flush(self, wait):
+        """ Send the buffered actions, from the calling thread or, with
+        `max_requests` greater than 1, from a background thread as soon as
+        one is allowed
+
+        :return: the rejected items of the requests completed
+        """
+        # the timer flushes from its own thread
+        with self._flushing:
+            buffer = self._take()
+            failures = []
+            if len(buffer) > 0:
+                logging.debug(f'flushing {len(buffer)} actions')
+                with self._idle:
+                    self._idle.wait_for(lambda: self._in_flight < self._requests.value)
+                    self._in_flight += 1
+                if self._requests.maximum == 1:
+                    failures = self._release(buffer)
+                else:
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(self._requests.maximum)
+                    self._pending.append(self._executor.submit(self._release, buffer))
+            if wait:
+                for future in self._pending:
+                    failures.extend(future.result())
+                self._pending = []
+            else:
+                # keep only the requests not completed, their errors are
+                # reported by the callbacks anyway
+                self._pending = [f for f in self._pending if not f.done()]
+            return failures
+
+    def _release(self, buffer):
+        """ Send `buffer` and release its slot of the requests in flight """
+        try:
+            return self._send(buffer)
+        finally:
+            with self._idle:
+                self._in_flight -= 1
+                self._idle.notify_all()
+
+    def _send(self, buffer):
+        """ Send `buffer` retrying the items that can be retried
+
+        :return: a list of `(id, error)` for the rejected items
+        """
+        failures = []
+        attempt = 0
+        while len(buffer) > 0:
+            tik = perf_counter()
+            try:
+                items = self._elastic.bulk(''.join(p for _, p in buffer))
+            except Exception as e:
+                items = self._failed(buffer, e)
+            buffer, rejected = self._settle(buffer, items, perf_counter() - tik, attempt)
+            failures.extend(rejected)
+            if len(buffer) > 0:
+                sleep(self._delay(attempt))
+                attempt += 1
+        return failures
+
+    def _add(self, id, payload):
+        """ Buffer an action already serialized
+
+        :return: True if the buffer must be flushed
+        """
+        with self._lock:
+            if self._since is None:
+                self._since = time()
+            if self._timer is None:
+                self._start_timer()
+            self._buffer.append((id, payload))
+            self._size += len(payload.encode())
+            return (len(self._buffer) >= self._docs.value or
+                    self._size >= self._max_bytes or
+                    time() - self._since >= self._max_seconds)
+
+    def _start_timer(self):
+        """ Start the thread flushing the actions older than `max_seconds` """
+        self._timer = Thread(target=self._tick, name='bulk-timer', daemon=True)
+        self._timer.start()
+
+    def _tick(self):
+        """ Flush the expired actions until :meth:`close` is called """
+        while not self._closed.wait(self._wait()):
+            if self._expired():
+                self._flush(wait=False)
+
+    def _wait(self):
+        """ The seconds until the oldest buffered action expires """
+        with self._lock:
+            if self._since is None:
+                return self._max_seconds
+            return max(0., self._since + self._max_seconds - time())
+
+    def _expired(self):
+        """ True if the oldest buffered action is older than `max_seconds` """
+        with self._lock:
+            return self._since is not None and time() - self._since >= self._max_seconds
+
+    def _take(self):
+        """ Empty the buffer returning its actions """
+        with self._lock:
+            buffer = self._buffer
+            self._buffer = []
+            self._size = 0
+            self._since = None
+        return buffer
+
+    @staticmethod
+    def _failed(buffer, e):
+        """ The bulk response items of a request failed as a whole """
+        status = request_status(e)
+        return [{'update': {'_id': i, 'status': status, 'error': str(e)}} for i, _ in buffer]
+
+    def _delay(self, attempt):
+        """ The seconds to wait before the retry number `attempt`, the
+        exponential backoff with full jitter """
+        return retry_delay(attempt, self._backoff, self._max_backoff)
+
+    def _settle(self, buffer, items, seconds, attempt):
+        """ Report the results of a bulk request, adapt the limits to them
+        and collect the items to be retried
+
+        :return: a tuple `(retry, rejected)`, the actions to be sent again and
+                 the `(id, error)` of the items rejected
+        """
+        retry = []
+        failures = []
+        succeeded = []
+        pushed_back = False
+        for action, item in zip(buffer, items):
+            res = next(iter(item.values()))
+            if 'error' not in res:
+                succeeded.append(res.get('_id', action[0]))
+            elif res.get('status') in ElasticBulk.RETRY_STATUS:
+                pushed_back = True
+                if attempt < self._max_retries:
+                    retry.append(action)
+                else:
+                    failures.append((action[0], res['error']))
+            else:
+                failures.append((res.get('_id', action[0]), res['error']))
+        if self._adaptive:
+            if pushed_back or seconds > self._target_seconds:
+                self._docs.decrease()
+                self._requests.decrease()
+            else:
+                self._docs.increase()
+                self._requests.increase()
+        with self._lock:
+            self.sent += len(succeeded)
+            self.failed += len(failures)
+            self.retried += len(retry)
+        if self._metrics is not None:
+            self._metrics.observe('es.bulk', seconds)
+            self._metrics.count('es.documents', len(succeeded))
+            self._metrics.count('es.failures', len(failures))
+            self._metrics.count('es.retries', len(retry))
+            self._metrics.gauge('es.batch_size', self._docs.value)
+            self._metrics.gauge('es.max_requests', self._requests.value)
+        for id, error in failures:
+            if self._on_failure is None:
+                logging.warning(f'bulk item {id} failed: {error}')
+            else:
+                self._on_failure(id, error)
+        if self._on_success is not None and len(succeeded) > 0:
+            self._on_success(succeeded)
+        if len(retry) > 0:
+            logging.debug(f'retrying {len(retry)} actions (attempt {attempt + 1})')
+        return retry, failures
+
+    def close(self):
+        """ Flush the pending actions and stop the background threads """
+        if self._timer is not None:
+            self._closed.set()
+            self._timer.join()
+            self._timer = None
+            self._closed.clear()
+        failures = self.flush()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        return failures
+
+
+class AsyncElasticBulk(ElasticBulk):
+    """ The async version of :class:`ElasticBulk`: `update` and `flush` are
+    coroutines and up to `max_requests` bulk requests are sent at the same
+    time. It must be used from a single event loop.
+
+    :param max_requests: max number of bulk requests in flight
+    """
+
+    def __init__(self, elastic, max_requests=8, **kwargs):
+        ElasticBulk.__init__(self, elastic, **kwargs)
+        self._requests = AdaptiveLimit(max_requests,
+                                       initial=1 if self._adaptive else None)
+        self._gate = None
+
+    async def update(self, id, data, upsert=True):
+        """ Buffer an upsert of `data` on document `id`, when the buffer is
+        full the caller waits for it to be sent """
+        if self._add(id, bulk_action(id, data, upsert)):
+            await self.flush()
+
+    async def delete(self, id):
+        """ Buffer the deletion of document `id` """
+        if self._add(id, delete_action(id)):
+            await self.flush()
+
+    async def flush(self):
+        """ Send all the buffered actions
+
+        :return: a list of `(id, error)` for the rejected items
+        """
+        if self._gate is None:
+            # imported here, the event loop running has imported it already
+            import asyncio
+
+            self._gate = asyncio.Condition()
+        buffer = self._take()
+        if len(buffer) == 0:
+            return []
+        logging.debug(f'flushing {len(buffer)} actions')
+        async with self._gate:
+            await self._gate.wait_for(lambda: self._in_flight < self._requests.value)
+            self._in_flight += 1
+        try:
+            return await self._send(buffer)
+        finally:
+            async with self._gate:
+                self._in_flight -= 1
+                self._gate.notify_all()
+
+    async def _send(self, buffer):
+        """ Send `buffer` retrying the items that can be retried
+
+        :return: a list of `(id, error)` for the rejected items
+        """
+        failures = []
+        attempt = 0
+        while len(buffer) > 0:
+            tik = perf_counter()
+            try:
+                items = await self._elastic.async_bulk(''.join(p for _, p in buffer))
+            except Exception as e:
+                items = self._failed(buffer, e)
+            buffer, rejected = self._settle(buffer, items, perf_counter() - tik, attempt)
+            failures.extend(rejected)
+            if len(buffer) > 0:
+                import asyncio
+
+                await asyncio.sleep(self._delay(attempt))
+                attempt += 1
+        return failures
+
+    def _start_timer(self):
+        """ Start the task flushing the actions older than `max_seconds`, on
+        the event loop running """
+        import asyncio
+
+        self._timer = asyncio.ensure_future(self._tick())
+
+    async def _tick(self):
+        """ Flush the expired actions until :meth:`close` is called """
+        import asyncio
+
+        while True:
+            await asyncio.sleep(self._wait())
+            if self._expired():
+                await self.flush()
+
+    async def close(self):
+        """ Flush the pending actions and stop the timer """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return await self.flush()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -9,6 +9,40 @@ from elasticizefiles.utils import to_snake
 
 
 class Extractor(metaclass=ABCMeta):
+    """ Base class of all the extractors
+
+    Set `cpu_bound = True` on extractors spending most of their time
+    computing rather than waiting on I/O: the engine will run them in a pool
+    of processes, so they must be picklable.
+
+    Set `path_dependent = True` on extractors whose output does not depend
+    only on the file content: their output is never shared among copies of
+    the same file when the engine runs with `dedup`, nor cached.
+
+    Change `version` whenever the output of the extractor changes, the
+    outputs of the previous version in an :class:`ExtractorCache` are no
+    longer used.
+
+    An output may hold, under the key `CHUNKS`, a list of partial outputs
+    (e.g. the pieces of a long text): the engine indexes each of them as a
+    child document of the file, linked to it by `parent_id`; such extractors
+    set `chunked = True`, their outputs are not shared by `dedup` (the copy in
+    the index lacks the chunks).
+
+    Expensive initializations (imports, models, long-lived subprocesses) go
+    in :meth:`setup`, called once before the first extraction (in each worker
+    process for CPU-bound extractors), and are released by :meth:`teardown`.
+    Set `batch_size` greater than 1 on extractors amortizing their work over
+    several files: the engine groups the files matched by them and calls
+    :meth:`extract_context_batch`, the other extractors are called per file.
+    """
+
+    cpu_bound = False
+    path_dependent = False
+    version = '1'
+    batch_size = 1
+    chunked = False
+    CHUNKS = '_chunks'
 
     def __init__(self, name=None, **kwargs):
         self.name = name
@@ -24,6 +58,51 @@ class Extractor(metaclass=ABCMeta):
         """
         raise NotImplementedError()
 
+    def extract_context(self, context):
+        """ Like :meth:`extract` but receiving the :class:`FileContext` shared
+        by all the extractors applied on the same file. Override it to reuse
+        the content already read or the values already computed on it.
+
+        :param context: a :class:`FileContext`
+        :returns: a dictionary with the output of the extraction
+        """
+        return self.extract(context.filename)
+
+    def extract_batch(self, filenames):
+        """ Like :meth:`extract` on several files, by default one at a time.
+        Override it to process them at once.
+
+        :param filenames: a list of filenames
+        :returns: a list with the output of each file
+        """
+        return [self.extract(filename) for filename in filenames]
+
+    def extract_context_batch(self, contexts):
+        """ Like :meth:`extract_context` on several files, by default it
+        calls :meth:`extract_batch` with the filenames
+
+        :param contexts: a list of :class:`FileContext`
+        :returns: a list with the output of each file
+        """
+        return self.extract_batch([context.filename for context in contexts])
+
+    def setup(self):
+        """ Prepare the extractor, called once before the first extraction """
+        pass
+
+    def teardown(self):
+        """ Release what :meth:`setup` prepared """
+        pass
+
+    def cache_key(self):
+        """ The key of the outputs of this extractor in an
+        :class:`ExtractorCache`, override it if the output depends on the
+        params of the extractor too
+
+        :returns: a string
+        """
+        return f'{self.__class__.__module__}.{self.__class__.__qualname__}:{self.version}'
+
     @abstractmethod
     def mapping(self):
         """ This should return the Elastic type mapping related to result
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-03-08
+project: elasticizefiles
+"""
+import logging
+import re
+
+_FLAGS = re.compile(r'^\(\?([aiLmsux]+)\)')
+_SPECIAL = set('.^$*+?{}[]\\|()')
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+
+def literal_suffix(pattern):
+    """ Get the literal suffix a string must end with to match `pattern`
+
+    Only simple patterns anchored by `$` are handled (e.g. `.*\\.txt$`),
+    for anything else an empty string is returned.
+
+    :param pattern: a regex
+    :returns: the literal suffix, or an empty string if unknown
+    """
+    if '|' in pattern or not pattern.endswith('$') or pattern.endswith('\\$'):
+        return ''
+    if re.compile(pattern).flags & re.VERBOSE:
+        return ''
+    chars = []
+    i = len(pattern) - 2
+    while i >= 0:
+        c = pattern[i]
+        if i > 0 and pattern[i - 1] == '\\' and not (i > 1 and pattern[i - 2] == '\\'):
+            if c.isalnum():
+                # an escaped letter is a class like \d or \w
+                break
+            chars.append(c)
+            i -= 2
+            continue
+        if c in _SPECIAL:
+            break
+        chars.append(c)
+        i -= 1
+    return ''.join(reversed(chars))
+
+
+def _extension(filename):
+    """ The lowercase text after the last dot of the basename """
+    dot = filename.rfind('.')
+    if dot == -1 or dot < filename.rfind('/'):
+        return ''
+    return filename[dot + 1:].lower()
+
+
+class _PatternGroup(object):
+    """ A set of patterns evaluated together through a single combined
+    regex, the patterns are `(rule_name, compiled)` pairs. """
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.combined = None
+        if len(patterns) > 1 and not any(_BACKREFERENCE.search(p.pattern) for _, p in patterns):
+            alternatives = []
+            for n, (_, p) in enumerate(patterns):
+                alternatives.append(f'(?P<_p{n}>{_scoped(p.pattern)})')
+            try:
+                self.combined = re.compile('|'.join(alternatives))
+            except re.error as e:
+                logging.debug(f'patterns cannot be combined: {e}')
+
+
+def _scoped(pattern):
+    """ Turn global inline flags at the start of `pattern` in scoped ones,
+    so that the pattern can be part of an alternation """
+    m = _FLAGS.match(pattern)
+    if m is None:
+        return pattern
+    return f'(?{m.group(1)}:{pattern[m.end():]})'
+
+
+class RuleMatcher(object):
+    """ Match filenames against the patterns of all the `rules` at once.
+
+    Patterns are compiled once and bucketed by the extension of their literal
+    suffix (if any), so a filename is only tested against the patterns that
+    can match it. The candidate patterns are joined in a single regex: when
+    it does not match no rule is applied, otherwise only the patterns after
+    the matching alternative still need to be tested.
+
+    Each distinct combination of matched rules gets an extraction plan (the
+    list of its extractors) built once and stored in :attr:`plans`, files
+    refer to it by index (see :meth:`plan`); plan 0 is the empty one.
+
+    :param rules: the rules, see :mod:`elasticizefiles.rules`
+    """
+
+    def __init__(self, rules):
+        self._rules = list(rules.keys())
+        self._plan = {}
+        self._plan_ids = {(): 0}
+        self.plans = [[]]
+        generic = []
+        by_extension = {}
+        for rule_name, rule in rules.items():
+            self._plan[rule_name] = [(f'{rule_name}.{n}', e)
+                                     for extractor in rule['extractor']
+                                     for n, e in extractor.items()]
+            for pattern in rule['pattern']:
+                compiled = re.compile(pattern)
+                # only the basename has an extension, see `_extension`
+                basename = literal_suffix(pattern).rpartition('/')[2]
+                if '.' in basename:
+                    ext = basename[basename.rfind('.') + 1:].lower()
+                    by_extension.setdefault(ext, []).append((rule_name, compiled))
+                else:
+                    generic.append((rule_name, compiled))
+        self._generic = _PatternGroup(generic)
+        self._groups = {ext: _PatternGroup(patterns + generic)
+                        for ext, patterns in by_extension.items()}
+        self.stats = {
+            'files': 0,
+            'matched': 0,
+            'prefiltered': 0,
+            'evaluations': 0,
+        }
+        self.hits = {rule_name: 0 for rule_name in self._rules}
+        logging.debug(f'matcher: {len(self._groups)} extensions, {len(generic)} generic patterns')
+
+    def match(self, filename):
+        """ Get the rules matching `filename`
+
+        :param filename: the full filename (path included)
+        :returns: a tuple of rule names, in the same order of the rules
+        """
+        self.stats['files'] += 1
+        group = self._groups.get(_extension(filename), self._generic)
+        if len(group.patterns) == 0:
+            self.stats['prefiltered'] += 1
+            return ()
+        matched = set()
+        start = 0
+        if group.combined is not None:
+            self.stats['evaluations'] += 1
+            m = group.combined.match(filename)
+            if m is None:
+                return ()
+            if m.lastgroup is not None and m.lastgroup.startswith('_p'):
+                first = int(m.lastgroup[2:])
+                matched.add(group.patterns[first][0])
+                start = first + 1
+        for rule_name, compiled in group.patterns[start:]:
+            if rule_name in matched:
+                continue
+            self.stats['evaluations'] += 1
+            if compiled.match(filename):
+                matched.add(rule_name)
+        if len(matched) == 0:
+            return ()
+        self.stats['matched'] += 1
+        r = tuple(rule_name for rule_name in self._rules if rule_name in matched)
+        for rule_name in r:
+            self.hits[rule_name] += 1
+        return r
+
+    def plan(self, filename):
+        """ Get the extraction plan of `filename`
+
+        :param filename: the full filename (path included)
+        :returns: the index in :attr:`plans` of the extractors to be applied,
+                  0 if none
+        """
+        rule_names = self.match(filename)
+        plan = self._plan_ids.get(rule_names)
+        if plan is None:
+            # the plans are only appended, readers never see a partial list
+            self.plans.append([e for rule_name in rule_names for e in self._plan[rule_name]])
+            plan = len(self.plans) - 1
+            self._plan_ids[rule_names] = plan
+        return plan
+
+    def extractors(self, filename):
+        """ Get the extractors to be applied on `filename`
+
+        :param filename: the full filename (path included)
+        :returns: a list of `('rule_name.extractor_name', extractor)`
+        """
+        return self.plans[self.plan(filename)]
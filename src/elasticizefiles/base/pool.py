@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-03-22
+project: elasticizefiles
+"""
+import logging
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+
+from elasticizefiles.base.context import FileContext
+
+# the extractors of the current worker process, set once by `_init_worker`
+_extractors = {}
+
+
+def _init_worker(extractors):
+    global _extractors
+    _extractors = extractors
+    for name, extractor in extractors.items():
+        try:
+            extractor.setup()
+        except Exception as e:
+            # a failing initializer would make the pool respawn the workers
+            # forever, the extractor fails on each file instead
+            logging.exception(f'setup of extractor {name} failed: {e}')
+        # run when the worker process exits
+        Finalize(extractor, extractor.teardown, exitpriority=10)
+    logging.debug(f'worker ready with {len(extractors)} extractors')
+
+
+def _extract(name, filename):
+    with FileContext(filename) as context:
+        return _extractors[name].extract_context(context)
+
+
+def _extract_batch(name, filenames):
+    contexts = [FileContext(filename) for filename in filenames]
+    try:
+        return _extractors[name].extract_context_batch(contexts)
+    finally:
+        for context in contexts:
+            context.close()
+
+
+class ExtractorPool(object):
+    """ A pool of processes running CPU-bound extractors, so that they do not
+    serialize on the GIL. The extractors are sent to each worker once, when
+    it starts (where :meth:`Extractor.setup` is called), and then referred by
+    name.
+
+    :param extractors: a dict `{name: extractor}`
+    :param n_processes: the number of worker processes
+    """
+
+    def __init__(self, extractors, n_processes):
+        self._pool = Pool(n_processes, initializer=_init_worker,
+                          initargs=(extractors, ))
+        logging.debug(f'started {n_processes} extractor processes')
+
+    def submit(self, name, filename):
+        """ Apply the extractor `name` on `filename` in a worker process
+
+        :returns: an async result, call `get()` to wait for the output
+        """
+        return self._pool.apply_async(_extract, (name, filename))
+
+    def submit_batch(self, name, filenames):
+        """ Apply the extractor `name` on `filenames` at once in a worker
+        process, see :meth:`Extractor.extract_context_batch`
+
+        :returns: an async result, call `get()` to wait for the outputs
+        """
+        return self._pool.apply_async(_extract_batch, (name, filenames))
+
+    def close(self):
+        """ Wait for the pending work and stop the workers """
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
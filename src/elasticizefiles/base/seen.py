@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-06-06
+project: elasticizefiles
+"""
+import math
+import re
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
+from heapq import merge
+from threading import Lock
+
+
+_DIGEST = re.compile(r'[0-9a-fA-F]{32,}')
+
+
+def _key(id, start=0):
+    """ 64 bits of the document id `id`, taken from its hex digits when it
+    is a digest (as the `file_id` is) or hashed otherwise: the whole id is
+    hashed, the ids of the chunks of a file start with its `file_id` """
+    if _DIGEST.fullmatch(id):
+        return int(id[start:start + 16], 16)
+    return int.from_bytes(blake2b(f'{start}{id}'.encode(), digest_size=8).digest(), 'big')
+
+
+class SeenIds(object):
+    """ A compact set of document ids: ids are stored as 64 bits integers in
+    sorted arrays (8 bytes each, ~80MB for 10 millions documents).
+
+    Ids are collected in a buffer sorted every `run_size` ids, the sorted runs
+    are merged in a single array on the first lookup. Two ids sharing their
+    first 64 bits are the same id for this set, with sha256 ids the odds are
+    negligible even with billions of documents.
+
+    :param run_size: the number of ids sorted at once
+    """
+
+    def __init__(self, run_size=1 << 20):
+        self._run_size = run_size
+        self._lock = Lock()
+        self._runs = []
+        self._buffer = array('Q')
+
+    def add(self, id):
+        with self._lock:
+            self._buffer.append(_key(id))
+            if len(self._buffer) >= self._run_size:
+                self._runs.append(array('Q', sorted(self._buffer)))
+                self._buffer = array('Q')
+
+    def _freeze(self):
+        """ Merge the buffer and the runs in a single sorted array """
+        with self._lock:
+            if len(self._buffer) > 0:
+                self._runs.append(array('Q', sorted(self._buffer)))
+                self._buffer = array('Q')
+            if len(self._runs) > 1:
+                self._runs = [array('Q', merge(*self._runs))]
+            elif len(self._runs) == 0:
+                self._runs = [array('Q')]
+            return self._runs[0]
+
+    def __contains__(self, id):
+        ids = self._runs[0] if len(self._runs) == 1 and len(self._buffer) == 0 else self._freeze()
+        key = _key(id)
+        i = bisect_left(ids, key)
+        return i < len(ids) and ids[i] == key
+
+    def __len__(self):
+        return sum(len(r) for r in self._runs) + len(self._buffer)
+
+
+class BloomFilter(object):
+    """ A probabilistic set of document ids, for trees so large that even a
+    :class:`SeenIds` does not fit in memory: with the default error rate it
+    takes less than 2 bytes per id. An id never added may be reported as
+    present with probability `error_rate`, an id added is always reported.
+
+    :param capacity: the number of ids expected
+    :param error_rate: the false positive rate at `capacity`
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self._size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+        self._lock = Lock()
+        self._count = 0
+
+    def _positions(self, id):
+        # double hashing: two independent 64 bits values give all the hashes
+        h1 = _key(id)
+        h2 = _key(id, 16) | 1
+        return [(h1 + i * h2) % self._size for i in range(self._hashes)]
+
+    def add(self, id):
+        positions = self._positions(id)
+        with self._lock:
+            for p in positions:
+                self._bits[p >> 3] |= 1 << (p & 7)
+            self._count += 1
+
+    def __contains__(self, id):
+        return all(self._bits[p >> 3] & (1 << (p & 7)) for p in self._positions(id))
+
+    def __len__(self):
+        return self._count
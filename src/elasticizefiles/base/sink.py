@@ -0,0 +1,567 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-16
+project: elasticizefiles
+"""
+import gzip
+import json
+import logging
+import os
+from random import random
+from threading import Event
+from threading import Lock
+from time import perf_counter
+from time import sleep
+
+# the statuses of the bulk items rejected because the cluster is overloaded
+# or unavailable, they can be sent again
+RETRY_STATUS = (429, 502, 503, 504)
+
+_serializer = None
+
+
+def serialize(data):
+    """ Serialize `data` to JSON as the Elastic client does (dates,
+    decimals, uuids...), `elasticsearch` is imported on first use
+
+    :return: a string
+    """
+    global _serializer
+    if _serializer is None:
+        from elasticsearch.serializer import JSONSerializer
+
+        _serializer = JSONSerializer()
+    return _serializer.dumps(data)
+
+
+def bulk_action(id, data, upsert=True):
+    """ Serialize an upsert of `data` on document `id` as the two lines
+    expected by the Elastic `_bulk` API
+
+    :return: the action as a string
+    """
+    action = serialize({'update': {'_id': id}})
+    source = serialize({'doc': data, 'doc_as_upsert': upsert})
+    return f'{action}\n{source}\n'
+
+
+def delete_action(id):
+    """ Serialize a delete of document `id` as the line expected by the
+    Elastic `_bulk` API
+
+    :return: the action as a string
+    """
+    return serialize({'delete': {'_id': id}}) + '\n'
+
+
+def retry_delay(attempt, backoff, max_backoff):
+    """ The seconds to wait before the retry number `attempt`, the
+    exponential backoff with full jitter
+
+    :param backoff: the base delay in seconds
+    :param max_backoff: the max delay in seconds
+    """
+    return random() * min(max_backoff, backoff * 2 ** attempt)
+
+
+def request_status(e):
+    """ The HTTP status corresponding to the exception `e` raised by a
+    request, 0 if unknown """
+    from elasticsearch.exceptions import ConnectionError as ESConnectionError
+    from elasticsearch.exceptions import ConnectionTimeout
+    from elasticsearch.exceptions import TransportError
+
+    if isinstance(e, ConnectionTimeout):
+        return 504
+    if isinstance(e, ESConnectionError):
+        return 503
+    if isinstance(e, TransportError) and isinstance(e.status_code, int):
+        return e.status_code
+    return 0
+
+
+def read_action(f):
+    """ Read a whole `_bulk` action (one line for deletes, two for the
+    others) from the binary file `f`
+
+    :return: the action as bytes, empty if the file ends before it is complete
+    """
+    action = f.readline()
+    if not action.endswith(b'\n'):
+        return b''
+    if action.startswith(b'{"delete"'):
+        return action
+    source = f.readline()
+    if not source.endswith(b'\n'):
+        return b''
+    return action + source
+
+
+class Sink(object):
+    """ Where the engine writes the documents. A sink buffers upserts with
+    :meth:`update` and writes them out on :meth:`flush`, reporting what has
+    been written through the callbacks.
+
+    :param on_failure: a callable `(id, error)` called for each document that
+                       could not be written
+    :param on_success: a callable `(ids)` called with the ids of the documents
+                       written by each flush
+    :param metrics: a :class:`Metrics` where to record the writes
+    """
+
+    def __init__(self, on_failure=None, on_success=None, metrics=None):
+        self._on_failure = on_failure
+        self._on_success = on_success
+        self._metrics = metrics
+        self.sent = 0
+        self.failed = 0
+
+    def attach(self, on_failure=None, on_success=None, metrics=None):
+        """ Set the callbacks and the metrics not given to the constructor,
+        the engine attaches its own to the sink it writes to """
+        if self._on_failure is None:
+            self._on_failure = on_failure
+        if self._on_success is None:
+            self._on_success = on_success
+        if self._metrics is None:
+            self._metrics = metrics
+        return self
+
+    def update(self, id, data, upsert=True):
+        """ Buffer an upsert of `data` on document `id` """
+        raise NotImplementedError
+
+    def delete(self, id):
+        """ Buffer the deletion of document `id` """
+        raise NotImplementedError
+
+    def flush(self):
+        """ Write all the buffered documents
+
+        :return: a list of `(id, error)` for the documents not written
+        """
+        return []
+
+    def close(self):
+        """ Flush the pending documents and release the resources """
+        return self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class NdjsonSink(Sink):
+    """ Write the documents in a file as `_bulk` actions, so that the file can
+    be sent as it is to Elastic later on (e.g. by a :class:`Shipper`, or
+    `curl -H 'Content-Type: application/x-ndjson' --data-binary @file`).
+
+    :param filename: the output file, appended if it exists
+    :param compress: if True the file is gzipped, if None it is when
+                     `filename` ends with `.gz`
+    :param max_docs: flush when this number of documents is buffered
+    """
+
+    def __init__(self, filename, compress=None, max_docs=500, **kwargs):
+        Sink.__init__(self, **kwargs)
+        if compress is None:
+            compress = filename.endswith('.gz')
+        self._filename = filename
+        self._compress = compress
+        self._max_docs = max_docs
+        self._lock = Lock()
+        self._file = None
+        self._pending = []
+
+    def update(self, id, data, upsert=True):
+        """ Buffer an upsert of `data` on document `id` """
+        self._write(id, bulk_action(id, data, upsert).encode())
+
+    def delete(self, id):
+        """ Buffer the deletion of document `id` """
+        self._write(id, delete_action(id).encode())
+
+    def _write(self, id, payload):
+        with self._lock:
+            if self._file is None:
+                if self._compress:
+                    self._file = gzip.open(self._filename, 'ab', compresslevel=6)
+                else:
+                    self._file = open(self._filename, 'ab')
+            self._file.write(payload)
+            self._pending.append(id)
+            full = len(self._pending) >= self._max_docs
+        if self._metrics is not None:
+            self._metrics.count('sink.bytes', len(payload))
+        if full:
+            self.flush()
+
+    def flush(self):
+        """ Write all the buffered documents
+
+        :return: a list of `(id, error)` for the documents not written
+        """
+        tik = perf_counter()
+        with self._lock:
+            ids = self._pending
+            self._pending = []
+            if self._file is not None:
+                self._file.flush()
+        if len(ids) == 0:
+            return []
+        self.sent += len(ids)
+        if self._metrics is not None:
+            self._metrics.observe('sink.flush', perf_counter() - tik)
+            self._metrics.count('sink.documents', len(ids))
+        if self._on_success is not None:
+            self._on_success(ids)
+        return []
+
+    def close(self):
+        """ Flush the pending documents and close the file """
+        failures = self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        return failures
+
+
+class SpoolSink(Sink):
+    """ A durable write-ahead spool: documents are appended as `_bulk` actions
+    to segment files in `directory` and synced to disk on each flush, so the
+    crawl runs at the speed of the local disk whatever the state of Elastic.
+    A :class:`Shipper` sends the spooled segments to Elastic later on, or at
+    the same time from another thread or process.
+
+    The segment being written is named `{n}.ndjson.open` and it is renamed to
+    `{n}.ndjson` once complete; an open segment left by a crash is recovered
+    (truncated to its last complete action) when the spool is opened again.
+
+    :param directory: the spool folder, created if it does not exist
+    :param segment_size: the size in bytes after which a new segment starts
+    :param max_docs: flush when this number of documents is buffered
+    :param sync: if True each flush waits for the data to be on disk
+    """
+
+    OPEN = '.ndjson.open'
+    CLOSED = '.ndjson'
+    CHECKPOINT = 'checkpoint'
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, max_docs=500,
+                 sync=True, **kwargs):
+        Sink.__init__(self, **kwargs)
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._segment_size = segment_size
+        self._max_docs = max_docs
+        self._sync = sync
+        self._lock = Lock()
+        self._pending = []
+        self._file = None
+        self._number = self._recover()
+
+    @staticmethod
+    def segments(directory):
+        """ The complete segments of the spool in `directory`, oldest first
+
+        :return: a sorted list of filenames
+        """
+        return sorted(f for f in os.listdir(directory)
+                      if f.endswith(SpoolSink.CLOSED) and f.split('.')[0].isdigit())
+
+    def _recover(self):
+        """ Close the segments left open by a crash
+
+        :return: the number of the next segment
+        """
+        last = -1
+        # numbers keep growing after the shipped segments have been removed
+        segment, _ = Shipper.checkpoint(self._directory)
+        if segment:
+            last = int(segment.split('.')[0])
+        for f in sorted(os.listdir(self._directory)):
+            if not f.split('.')[0].isdigit():
+                continue
+            if f.endswith(SpoolSink.OPEN):
+                filename = os.path.join(self._directory, f)
+                actions = 0
+                end = 0
+                with open(filename, 'r+b') as s:
+                    # drop the half written action
+                    while len(read_action(s)) > 0:
+                        actions += 1
+                        end = s.tell()
+                    s.truncate(end)
+                logging.warning(f'spool: recovered {actions} actions from {f}')
+                self._seal(filename)
+            if f.endswith(SpoolSink.OPEN) or f.endswith(SpoolSink.CLOSED):
+                last = max(last, int(f.split('.')[0]))
+        return last + 1
+
+    @staticmethod
+    def _seal(filename):
+        """ Rename an open segment as complete, empty ones are removed """
+        if os.path.getsize(filename) == 0:
+            os.remove(filename)
+        else:
+            os.replace(filename, filename[:-len('.open')])
+
+    def _open(self):
+        """ Start a new segment """
+        filename = os.path.join(self._directory, f'{self._number:010d}{SpoolSink.OPEN}')
+        self._number += 1
+        logging.debug(f'spool: writing {filename}')
+        return open(filename, 'ab')
+
+    def _rotate(self):
+        """ Complete the current segment, to be called holding the lock """
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            SpoolSink._seal(self._file.name)
+            self._file = None
+
+    def update(self, id, data, upsert=True):
+        """ Buffer an upsert of `data` on document `id` """
+        self._write(id, bulk_action(id, data, upsert).encode())
+
+    def delete(self, id):
+        """ Buffer the deletion of document `id` """
+        self._write(id, delete_action(id).encode())
+
+    def _write(self, id, payload):
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(payload)
+            self._pending.append(id)
+            full = len(self._pending) >= self._max_docs
+            rotate = self._file.tell() >= self._segment_size
+        if self._metrics is not None:
+            self._metrics.count('sink.bytes', len(payload))
+        if full or rotate:
+            self.flush(rotate=rotate)
+
+    def flush(self, rotate=False):
+        """ Write all the buffered documents to disk
+
+        :param rotate: if True the current segment is completed
+        :return: a list of `(id, error)` for the documents not written
+        """
+        tik = perf_counter()
+        with self._lock:
+            ids = self._pending
+            self._pending = []
+            if rotate:
+                self._rotate()
+            elif self._file is not None:
+                self._file.flush()
+                if self._sync:
+                    os.fsync(self._file.fileno())
+        if len(ids) == 0:
+            return []
+        self.sent += len(ids)
+        if self._metrics is not None:
+            self._metrics.observe('sink.flush', perf_counter() - tik)
+            self._metrics.count('sink.documents', len(ids))
+        if self._on_success is not None:
+            self._on_success(ids)
+        return []
+
+    def close(self):
+        """ Flush the pending documents and complete the current segment """
+        return self.flush(rotate=True)
+
+
+class Shipper(object):
+    """ Send the segments of a :class:`SpoolSink` to Elastic through the
+    `_bulk` API. The spooled lines are sent as they are, without parsing them
+    again, and the position reached is saved in a `checkpoint` file after each
+    request, so a shipper stopped or crashed resumes where it was. Shipped
+    segments are removed.
+
+    As with :class:`ElasticBulk`, the actions rejected because the cluster
+    is overloaded (429) or unavailable (502, 503, 504) are sent again after
+    an exponential backoff with jitter; the ones still rejected after
+    `max_retries` and the ones rejected for good are appended to
+    `rejected.ndjson` in the spool folder. A whole request failing the same
+    way (timeouts and connection errors included) is sent again as well,
+    after `max_retries` the error is raised and the shipping stops at the
+    last checkpoint.
+
+    :param directory: the spool folder
+    :param elastic: an :class:`Elastic` instance, its index must exist
+    :param max_docs: max number of actions sent in a single bulk request
+    :param max_bytes: max size of a single bulk request
+    :param keep: if True shipped segments are not removed
+    :param metrics: a :class:`Metrics` where to record the requests
+    :param max_retries: max number of times an action is sent again
+    :param backoff: the base delay in seconds between two retries
+    :param max_backoff: the max delay in seconds between two retries
+    """
+
+    def __init__(self, directory, elastic, max_docs=500,
+                 max_bytes=5 * 1024 * 1024, keep=False, metrics=None,
+                 max_retries=5, backoff=.5, max_backoff=30.):
+        self._directory = directory
+        self._elastic = elastic
+        self._max_docs = max_docs
+        self._max_bytes = max_bytes
+        self._keep = keep
+        self._metrics = metrics
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._checkpoint = os.path.join(directory, SpoolSink.CHECKPOINT)
+        self._stop = Event()
+        self.sent = 0
+        self.failed = 0
+
+    @staticmethod
+    def checkpoint(directory):
+        """ The last position shipped from the spool in `directory`
+
+        :return: a tuple `(segment, offset)`, `offset` is -1 when the whole
+                 segment has been shipped
+        """
+        try:
+            with open(os.path.join(directory, SpoolSink.CHECKPOINT)) as f:
+                c = json.load(f)
+            return c['segment'], c['offset']
+        except FileNotFoundError:
+            return '', 0
+
+    def _save(self, segment, offset):
+        """ Atomically save the position shipped """
+        tmp = f'{self._checkpoint}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'segment': segment, 'offset': offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._checkpoint)
+
+    def _batches(self, f):
+        """ Read the actions of segment `f` in batches bounded by count and
+        size
+
+        :return: a generator of `(lines, offset)`, `offset` is the position
+                 after the batch
+        """
+        lines = []
+        size = 0
+        while True:
+            action = read_action(f)
+            if len(action) == 0:
+                break
+            lines.append(action)
+            size += len(lines[-1])
+            if len(lines) >= self._max_docs or size >= self._max_bytes:
+                yield lines, f.tell()
+                lines = []
+                size = 0
+        if len(lines) > 0:
+            yield lines, f.tell()
+
+    def _send(self, lines):
+        """ Send a batch retrying the actions that can be retried, the
+        rejected ones are set aside """
+        tik = perf_counter()
+        sent = 0
+        retried = 0
+        rejected = []
+        attempt = 0
+        while len(lines) > 0:
+            try:
+                items = self._elastic.bulk(b''.join(lines))
+            except Exception as e:
+                status = request_status(e)
+                if status not in RETRY_STATUS or attempt >= self._max_retries:
+                    raise e
+                logging.warning(f'shipper: bulk request failed ({status}): {e}')
+                items = [{'update': {'status': status, 'error': str(e)}}] * len(lines)
+            retry = []
+            for line, item in zip(lines, items):
+                res = next(iter(item.values()))
+                if 'error' not in res:
+                    sent += 1
+                elif res.get('status') in RETRY_STATUS and attempt < self._max_retries:
+                    retry.append(line)
+                else:
+                    rejected.append(line)
+            lines = retry
+            if len(retry) > 0:
+                logging.debug(f'shipper: retrying {len(retry)} actions (attempt {attempt + 1})')
+                retried += len(retry)
+                sleep(retry_delay(attempt, self._backoff, self._max_backoff))
+                attempt += 1
+        if len(rejected) > 0:
+            logging.warning(f'shipper: {len(rejected)} actions rejected')
+            with open(os.path.join(self._directory, 'rejected.ndjson'), 'ab') as f:
+                f.write(b''.join(rejected))
+        self.sent += sent
+        self.failed += len(rejected)
+        if self._metrics is not None:
+            self._metrics.observe('es.bulk', perf_counter() - tik)
+            self._metrics.count('es.documents', sent)
+            self._metrics.count('es.failures', len(rejected))
+            self._metrics.count('es.retries', retried)
+
+    def ship_once(self):
+        """ Ship all the complete segments
+
+        :return: the number of actions shipped
+        """
+        sent = self.sent + self.failed
+        last, offset = Shipper.checkpoint(self._directory)
+        for segment in SpoolSink.segments(self._directory):
+            if segment < last or (segment == last and offset < 0):
+                # shipped already, the shipper stopped before removing it
+                if not self._keep:
+                    os.remove(os.path.join(self._directory, segment))
+                continue
+            start = offset if segment == last else 0
+            with open(os.path.join(self._directory, segment), 'rb') as f:
+                f.seek(start)
+                for lines, position in self._batches(f):
+                    self._send(lines)
+                    self._save(segment, position)
+                    if self._stop.is_set():
+                        return self.sent + self.failed - sent
+            # -1 marks the segment as shipped
+            self._save(segment, -1)
+            if not self._keep:
+                os.remove(os.path.join(self._directory, segment))
+            logging.info(f'shipper: {segment} shipped')
+            last, offset = segment, -1
+        return self.sent + self.failed - sent
+
+    def ship(self, follow=False, interval=1.):
+        """ Ship the spooled segments. Errors reaching Elastic stop the
+        shipper, unless `follow` is True: in that case they are logged and
+        retried after `interval` seconds.
+
+        :param follow: if True keep shipping the new segments until
+                       :meth:`stop` is called
+        :param interval: seconds between two checks of the spool
+        :return: the number of actions shipped
+        """
+        sent = self.sent + self.failed
+        while not self._stop.is_set():
+            try:
+                self.ship_once()
+            except Exception as e:
+                if not follow:
+                    raise e
+                logging.warning(f'shipper: {e}, retrying in {interval}s')
+            if not follow:
+                break
+            self._stop.wait(interval)
+        return self.sent + self.failed - sent
+
+    def stop(self):
+        """ Stop a shipper running in another thread """
+        self._stop.set()
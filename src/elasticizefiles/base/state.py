@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-03-01
+project: elasticizefiles
+"""
+import json
+import logging
+import sqlite3
+from threading import Lock
+from time import time
+
+
+class FileState(object):
+    """ A local SQLite store recording, for each indexed file, the stats it
+    had when it was indexed. It allows to skip unchanged files on rescans.
+
+    Records go through two steps: they are staged when a document is built
+    and written only once Elastic confirmed it (see :meth:`confirm`), so
+    that a failure does not mark a file as indexed.
+
+    The number of chunks indexed as child documents of a file (see
+    :attr:`Extractor.CHUNKS`) is recorded too, so that they can be removed
+    with the document of the file (see :meth:`chunks`).
+
+    :param filename: the SQLite database filename
+    :param lookup_size: max number of paths queried in a single statement
+    """
+
+    def __init__(self, filename, lookup_size=500):
+        self._filename = filename
+        self._lookup_size = lookup_size
+        self._lock = Lock()
+        self._staged = {}
+        self._confirmed = []
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS files ('
+                         'path TEXT PRIMARY KEY, size INTEGER, '
+                         'mtime_ns INTEGER, inode INTEGER, file_id TEXT, '
+                         'sha256 TEXT, plan TEXT, indexed REAL, chunks TEXT)')
+        columns = [c[1] for c in self._db.execute('PRAGMA table_info(files)')]
+        if 'chunks' not in columns:
+            # a state written before the chunks were recorded
+            self._db.execute('ALTER TABLE files ADD COLUMN chunks TEXT')
+        self._db.execute('CREATE INDEX IF NOT EXISTS files_file_id '
+                         'ON files (file_id)')
+        self._db.commit()
+        logging.debug(f'file state: {filename}')
+
+    def lookup(self, paths):
+        """ Bulk lookup of the state of `paths`
+
+        :param paths: a list of paths
+        :return: a dict `{path: (size, mtime_ns, inode, plan)}` for the known
+                 paths only
+        """
+        r = {}
+        with self._lock:
+            for i in range(0, len(paths), self._lookup_size):
+                chunk = paths[i:i + self._lookup_size]
+                marks = ','.join('?' * len(chunk))
+                cursor = self._db.execute('SELECT path, size, mtime_ns, inode, plan '
+                                          f'FROM files WHERE path IN ({marks})', chunk)
+                for path, size, mtime_ns, inode, plan in cursor:
+                    r[path] = (size, mtime_ns, inode, plan)
+        return r
+
+    def unchanged(self, paths, stats, plans):
+        """ Filter the paths not changed since they were indexed
+
+        :param paths: a list of paths
+        :param stats: the :func:`os.stat` result of each path
+        :param plans: a signature of the extractors applied to each path
+        :return: a set of unchanged paths
+        """
+        known = self.lookup(paths)
+        r = set()
+        for path, st, plan in zip(paths, stats, plans):
+            if known.get(path) == (st.st_size, st.st_mtime_ns, st.st_ino, plan):
+                r.add(path)
+        return r
+
+    def indexed(self, paths):
+        """ The documents indexed for `paths` and, when a path is a folder,
+        for the files under it
+
+        :param paths: a list of paths
+        :return: a list of `(path, file_id)`
+        """
+        r = []
+        with self._lock:
+            for path in paths:
+                # the files under `path/` sort between `path/` and `path0`
+                cursor = self._db.execute('SELECT path, file_id FROM files '
+                                          'WHERE path = ? OR (path >= ? AND path < ?)',
+                                          (path, f'{path}/', f'{path}0'))
+                r.extend(cursor)
+        return r
+
+    def file_ids(self, paths):
+        """ Bulk lookup of the documents indexed for `paths`
+
+        :return: a list of file ids
+        """
+        r = []
+        with self._lock:
+            for i in range(0, len(paths), self._lookup_size):
+                chunk = paths[i:i + self._lookup_size]
+                marks = ','.join('?' * len(chunk))
+                cursor = self._db.execute(f'SELECT file_id FROM files WHERE path IN ({marks})', chunk)
+                r.extend(file_id for file_id, in cursor)
+        return r
+
+    def chunks(self, file_ids):
+        """ Bulk lookup of the chunks indexed with the documents `file_ids`
+
+        :return: a dict `{file_id: {name: count}}` for the documents with
+                 chunks only, `name` is the output they come from
+        """
+        r = {}
+        with self._lock:
+            for i in range(0, len(file_ids), self._lookup_size):
+                chunk = file_ids[i:i + self._lookup_size]
+                marks = ','.join('?' * len(chunk))
+                cursor = self._db.execute('SELECT file_id, chunks FROM files '
+                                          f'WHERE file_id IN ({marks}) AND chunks IS NOT NULL',
+                                          chunk)
+                for file_id, chunks in cursor:
+                    r[file_id] = json.loads(chunks)
+        return r
+
+    def remove_ids(self, file_ids):
+        """ Forget the files whose document is `file_ids` """
+        with self._lock:
+            for i in range(0, len(file_ids), self._lookup_size):
+                chunk = file_ids[i:i + self._lookup_size]
+                marks = ','.join('?' * len(chunk))
+                self._db.execute(f'DELETE FROM files WHERE file_id IN ({marks})', chunk)
+            self._db.commit()
+
+    def remove(self, paths):
+        """ Forget `paths` and the files under them, e.g. because they have
+        been deleted """
+        with self._lock:
+            for path in paths:
+                self._db.execute('DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)',
+                                 (path, f'{path}/', f'{path}0'))
+            self._db.commit()
+
+    def stage(self, file_id, path, stat, sha256, plan, chunks=None):
+        """ Stage the state of `path` waiting for the document to be indexed
+
+        :param chunks: the number of chunks of the document by output, a dict
+                       `{name: count}`
+        """
+        if chunks:
+            chunks = json.dumps(chunks, sort_keys=True)
+        else:
+            chunks = None
+        with self._lock:
+            self._staged[file_id] = (path, stat.st_size, stat.st_mtime_ns,
+                                     stat.st_ino, file_id, sha256, plan, chunks)
+
+    def confirm(self, file_ids):
+        """ Mark the documents `file_ids` as indexed """
+        now = time()
+        with self._lock:
+            for file_id in file_ids:
+                staged = self._staged.pop(file_id, None)
+                if staged is not None:
+                    self._confirmed.append(staged + (now, ))
+            flush = len(self._confirmed) >= self._lookup_size
+        if flush:
+            self.commit()
+
+    def discard(self, file_id):
+        """ Forget a staged document, e.g. because indexing failed """
+        with self._lock:
+            self._staged.pop(file_id, None)
+
+    def commit(self):
+        """ Write the confirmed states """
+        with self._lock:
+            rows = self._confirmed
+            self._confirmed = []
+            if len(rows) == 0:
+                return
+            self._db.executemany('INSERT OR REPLACE INTO files (path, size, mtime_ns, '
+                                 'inode, file_id, sha256, plan, chunks, indexed) '
+                                 'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._db.commit()
+        logging.debug(f'file state: {len(rows)} records written')
+
+    def close(self):
+        """ Write the confirmed states and close the database """
+        self.commit()
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
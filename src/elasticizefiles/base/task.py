@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-07-11
+project: elasticizefiles
+"""
+
+
+class Task(object):
+    """ A file on its way through the crawl pipeline. Millions of them can be
+    queued, so they are kept small: no per instance dict and the extractors
+    are not listed but referred by the index of their plan in the
+    :class:`RuleMatcher` (see :meth:`RuleMatcher.plan`).
+
+    :param filename: the full filename (path included)
+    :param stat: the :func:`os.stat` result of the file
+    :param plan: the index of the extraction plan
+    :param signature: the signature of the plan recorded in the file state
+    """
+
+    __slots__ = ('filename', 'stat', 'plan', 'signature')
+
+    def __init__(self, filename, stat, plan, signature=None):
+        self.filename = filename
+        self.stat = stat
+        self.plan = plan
+        self.signature = signature
+
+    def __repr__(self):
+        return f'Task({self.filename!r}, plan={self.plan})'
+
+
+class Extraction(object):
+    """ A :class:`Task` being extracted together with other files (see
+    `ElasticizeEngine._batch_applier`)
+
+    :param task: the :class:`Task`
+    :param context: the :class:`FileContext` of the file
+    :param doc: the document being built
+    :param exts: the extractors still to be applied
+    """
+
+    __slots__ = ('task', 'context', 'doc', 'exts', 'error')
+
+    def __init__(self, task, context, doc, exts):
+        self.task = task
+        self.context = context
+        self.doc = doc
+        self.exts = exts
+        self.error = None
+
+    def __repr__(self):
+        return f'Extraction({self.task.filename!r}, error={self.error!r})'
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-23
+project: elasticizefiles
+"""
+import logging
+import sqlite3
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+
+class WorkQueue(object):
+    """ A queue of work units (folders to be scanned) stored in SQLite and
+    shared by several worker processes: units are leased to a worker for
+    `lease_seconds`, a worker renews its lease while it is alive and a unit
+    whose lease expired is handed out again, so the units of a dead worker
+    are reassigned.
+
+    With `shared` the database can live on a shared folder to coordinate
+    several hosts, as long as the filesystem supports SQLite locking: it
+    uses the rollback journal, as the WAL mode (the default, faster) needs
+    the memory shared by the processes of a single host and does not work
+    on network filesystems.
+
+    The queue has a random `namespace`, created with the database, that the
+    workers use to derive the ids of the documents: a unit crawled again by
+    another host overwrites the documents instead of duplicating them.
+
+    :param filename: the SQLite database filename
+    :param lease_seconds: how long a unit is assigned to a worker without
+                          news from it
+    :param max_attempts: how many times a unit is leased before being marked
+                         as failed
+    :param shared: True if the database is shared by several hosts
+    """
+
+    def __init__(self, filename, lease_seconds=300, max_attempts=3, shared=False):
+        self._filename = filename
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._lock = Lock()
+        self._db = sqlite3.connect(filename, timeout=60, isolation_level=None,
+                                   check_same_thread=False)
+        # the mode is stored in the database, a shared one leaves WAL
+        self._db.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+        self._db.execute('CREATE TABLE IF NOT EXISTS units ('
+                         'id INTEGER PRIMARY KEY, path TEXT, recursive INTEGER, '
+                         'estimate INTEGER, status TEXT, worker TEXT, '
+                         'lease_until REAL, attempts INTEGER, files INTEGER, '
+                         'error TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS units_status '
+                         'ON units (status, estimate)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        # the first process creating the queue sets it
+        self._db.execute("INSERT OR IGNORE INTO meta VALUES ('namespace', ?)", (uuid4().hex, ))
+        self.namespace = self._db.execute("SELECT value FROM meta WHERE key = 'namespace'").fetchone()[0]
+        logging.debug(f'work queue: {filename}')
+
+    def add(self, units):
+        """ Add work units to the queue
+
+        :param units: a list of `(path, recursive, estimate)`, `estimate` is
+                      the expected number of files, bigger units are handed
+                      out first
+        """
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            self._db.executemany('INSERT INTO units (path, recursive, estimate, '
+                                 "status, attempts) VALUES (?, ?, ?, 'pending', 0)",
+                                 [(p, int(r), e) for p, r, e in units])
+            self._db.execute('COMMIT')
+        logging.info(f'work queue: {len(units)} units added')
+
+    def lease(self, worker):
+        """ Assign the biggest unit available to `worker`
+
+        :param worker: a name identifying the worker
+        :return: a tuple `(id, path, recursive)` or None if there is nothing
+                 to do right now
+        """
+        now = time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                # expired leases of units tried too many times are given up
+                self._db.execute("UPDATE units SET status = 'failed', "
+                                 "error = 'lease expired' WHERE status = 'leased' "
+                                 'AND lease_until < ? AND attempts >= ?',
+                                 (now, self._max_attempts))
+                row = self._db.execute('SELECT id, path, recursive FROM units '
+                                       "WHERE status = 'pending' OR "
+                                       "(status = 'leased' AND lease_until < ?) "
+                                       'ORDER BY estimate DESC LIMIT 1',
+                                       (now, )).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE units SET status = 'leased', "
+                                     'worker = ?, lease_until = ?, '
+                                     'attempts = attempts + 1 WHERE id = ?',
+                                     (worker, now + self._lease_seconds, row[0]))
+            finally:
+                self._db.execute('COMMIT')
+        if row is None:
+            return None
+        return row[0], row[1], bool(row[2])
+
+    def renew(self, id, worker):
+        """ Extend the lease of unit `id`
+
+        :return: False if the unit is no longer assigned to `worker`
+        """
+        with self._lock:
+            cursor = self._db.execute('UPDATE units SET lease_until = ? '
+                                      "WHERE id = ? AND worker = ? AND status = 'leased'",
+                                      (time() + self._lease_seconds, id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, id, worker, files=None):
+        """ Mark unit `id` as done
+
+        :param files: the number of files processed
+        :return: False if the unit is no longer assigned to `worker` (its
+                 lease expired and it was handed out again)
+        """
+        with self._lock:
+            cursor = self._db.execute("UPDATE units SET status = 'done', files = ? "
+                                      'WHERE id = ? AND worker = ?', (files, id, worker))
+        return cursor.rowcount == 1
+
+    def fail(self, id, worker, error):
+        """ Give back unit `id` after an error, it is leased again unless it
+        has been tried `max_attempts` times """
+        with self._lock:
+            self._db.execute("UPDATE units SET status = CASE WHEN attempts >= ? "
+                             "THEN 'failed' ELSE 'pending' END, error = ? "
+                             'WHERE id = ? AND worker = ?',
+                             (self._max_attempts, str(error), id, worker))
+
+    def progress(self):
+        """ The number of units and of files processed by status
+
+        :return: a dict `{status: (units, files)}`
+        """
+        with self._lock:
+            cursor = self._db.execute('SELECT status, COUNT(*), SUM(files) '
+                                      'FROM units GROUP BY status')
+            return {status: (units, files or 0) for status, units, files in cursor}
+
+    def finished(self):
+        """ True when no unit is pending or being processed """
+        p = self.progress()
+        return p.get('pending', (0, ))[0] + p.get('leased', (0, ))[0] == 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
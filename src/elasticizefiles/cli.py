@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-07-04
+project: elasticizefiles
+
+Command line entry point: crawl or watch a path as described by a JSON or
+YAML configuration file, e.g.
+
+    path: /data
+    elastic:
+      hosts: [localhost:9200]
+      index: files
+      doc_type: _doc
+    engine:
+      state_file: /var/lib/elasticizefiles/state.db
+    rules:
+      python:
+        pattern: ['.*\\.py$']
+        extractor:
+          - sha256: elasticizefiles.extractors.simple.ExtractSha256
+          - text:
+              class: elasticizefiles.extractors.text.ExtractText
+              params: {max_chars: 1000000}
+    crawl:
+      n_jobs: 8
+
+    elasticizefiles crawl config.yml
+
+Extractors (and the `sink`, if any) are given by their dotted class path,
+optionally with the params of the class. Only the modules needed are
+imported, so that short runs (e.g. from cron) start fast.
+
+The `crawl` section holds the params of `crawl_and_process`; `watch` takes
+the ones it accepts too (e.g. `n_jobs`, `queue_size`), the others (e.g.
+`reconcile`, `profiler`) are ignored with a warning.
+"""
+import argparse
+import inspect
+import json
+import logging
+import sys
+from importlib import import_module
+
+
+def load_object(spec):
+    """ Create an object from its dotted class path
+
+    :param spec: a dotted class path or a dict `{'class': path, 'params': {}}`
+    :return: the object
+    """
+    params = {}
+    if isinstance(spec, dict):
+        params = spec.get('params', {})
+        spec = spec['class']
+    module_name, _, class_name = spec.rpartition('.')
+    if module_name == '':
+        raise Exception(f'`{spec}` is not a dotted class path')
+    cls = getattr(import_module(module_name), class_name)
+    return cls(**params)
+
+
+def load_rules(rules):
+    """ Create the extractors of `rules` given by dotted class paths
+
+    :param rules: a dict `{rule: {'pattern': [...], 'extractor': [{name: spec}]}}`
+    :return: the rules as expected by :class:`ElasticizeEngine`
+    """
+    r = {}
+    for rule_name, rule in rules.items():
+        r[rule_name] = {
+            'pattern': rule['pattern'],
+            'extractor': [{name: load_object(spec) for name, spec in extractor.items()}
+                          for extractor in rule['extractor']],
+        }
+    return r
+
+
+def load_config(filename):
+    """ Read a configuration file, YAML if its extension is `.yml` or `.yaml`
+    and JSON otherwise
+
+    :return: a dict
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        if filename.lower().endswith(('.yml', '.yaml')):
+            try:
+                import yaml
+            except Exception as e:
+                raise Exception('module `yaml` is not installed, try `pip install -U pyyaml`')
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def build_engine(config, path=None):
+    """ Create the :class:`ElasticizeEngine` described by `config` """
+    from elasticizefiles.engine import ElasticizeEngine
+
+    elastic = config.get('elastic', {})
+    kwargs = dict(config.get('engine', {}))
+    if config.get('sink') is not None:
+        kwargs['sink'] = load_object(config['sink'])
+    return ElasticizeEngine(path or config['path'], load_rules(config['rules']),
+                            elastic.get('hosts'), elastic.get('index'),
+                            elastic.get('doc_type', '_doc'), **kwargs)
+
+
+def accepted(fn, kwargs):
+    """ The `kwargs` accepted by `fn`, the others are logged and dropped
+
+    :return: a dict
+    """
+    params = inspect.signature(fn).parameters
+    ignored = [k for k in kwargs if k not in params]
+    if len(ignored) > 0:
+        logging.warning(f'ignored by {fn.__name__}: {", ".join(ignored)}')
+    return {k: v for k, v in kwargs.items() if k in params}
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(prog='elasticizefiles',
+                                     description='Crawl, process and index your files')
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='the logging level')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    crawl = commands.add_parser('crawl', help='crawl the path once')
+    crawl.add_argument('config', help='a JSON or YAML configuration file')
+    crawl.add_argument('--path', help='the path to be crawled instead of `path`')
+    crawl.add_argument('--reconcile', action='store_true',
+                       help='remove the documents of files no longer on disk')
+
+    watch = commands.add_parser('watch', help='crawl the path and keep it indexed')
+    watch.add_argument('config', help='a JSON or YAML configuration file')
+    watch.add_argument('--path', help='the path to be watched instead of `path`')
+    watch.add_argument('--no-crawl', action='store_true',
+                       help='process only the changes, without crawling first')
+    watch.add_argument('--poll-interval', type=float,
+                       help='poll the path every this many seconds instead of using inotify')
+    return parser.parse_args(args)
+
+
+def main(args):
+    """ Run the command in `args`
+
+    :param args: the command line parameters as a list of strings
+    """
+    args = parse_args(args)
+    logging.basicConfig(level=args.log_level,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    config = load_config(args.config)
+    engine = build_engine(config, path=args.path)
+    kwargs = dict(config.get('crawl', {}))
+    if args.command == 'crawl':
+        if args.reconcile:
+            kwargs['reconcile'] = True
+        completed = engine.crawl_and_process(**accepted(engine.crawl_and_process, kwargs))
+        logging.info(f'done: {completed} files')
+    else:
+        kwargs.update(crawl=not args.no_crawl, poll_interval=args.poll_interval)
+        engine.watch(**accepted(engine.watch, kwargs))
+
+
+def run():
+    """ Entry point for console_scripts """
+    main(sys.argv[1:])
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-23
+project: elasticizefiles
+"""
+import logging
+import os
+from threading import Event
+from threading import Thread
+from time import sleep
+from uuid import uuid4
+
+from elasticizefiles.utils.files import get_machine_info
+
+
+def _list(dirname):
+    """ List a folder without stat-ing its entries
+
+    :return: a tuple `(files, subfolders)`, the number of files and the list
+             of subfolders
+    """
+    files = 0
+    folders = []
+    try:
+        with os.scandir(dirname) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                else:
+                    files += 1
+    except OSError as e:
+        logging.warning(f'cannot scan {dirname}: {e}')
+    return files, folders
+
+
+def plan_units(roots, unit_size=10000, max_depth=4):
+    """ Split the trees in `roots` into work units of about `unit_size` files.
+
+    Folders are listed (not stat-ed) top down: a folder is split in its own
+    files (a non recursive unit) plus one unit for each subfolder while its
+    estimated size exceeds `unit_size`. The size of a subtree not listed yet
+    is estimated from the mean number of files per folder seen so far, so the
+    estimate is rough but cheap; the queue hands out the biggest units first
+    and the workers pull units as they go, which evens the load out anyway.
+
+    :param roots: a list of paths
+    :param unit_size: the target number of files of a unit
+    :param max_depth: folders deeper than this are never split
+    :return: a list of `(path, recursive, estimate)`
+    """
+    units = []
+    listed = 0
+    files_seen = 0
+    stack = [(root, 0) for root in roots]
+    while len(stack) > 0:
+        dirname, depth = stack.pop()
+        files, folders = _list(dirname)
+        listed += 1
+        files_seen += files
+        mean = files_seen / listed
+        estimate = int(files + len(folders) * mean)
+        if depth < max_depth and len(folders) > 0 and estimate > unit_size:
+            if files > 0:
+                units.append((dirname, False, files))
+            stack.extend((f, depth + 1) for f in folders)
+        else:
+            units.append((dirname, True, estimate))
+    return units
+
+
+class ScanCoordinator(object):
+    """ Split a crawl in work units and follow their progress. The units are
+    processed by any number of :class:`ScanWorker`, on this host or on others
+    sharing the same :class:`WorkQueue`.
+
+    :param queue: a :class:`WorkQueue`
+    :param roots: a list of paths to be scanned
+    :param unit_size: the target number of files of a unit
+    :param max_depth: folders deeper than this are never split
+    """
+
+    def __init__(self, queue, roots, unit_size=10000, max_depth=4):
+        self._queue = queue
+        self._roots = roots
+        self._unit_size = unit_size
+        self._max_depth = max_depth
+
+    def plan(self):
+        """ Split the roots and add the units to the queue
+
+        :return: the number of units
+        """
+        units = plan_units(self._roots, unit_size=self._unit_size,
+                           max_depth=self._max_depth)
+        self._queue.add(units)
+        return len(units)
+
+    def wait(self, interval=10.):
+        """ Log the progress until all the units have been processed
+
+        :param interval: seconds between two checks
+        :return: the final progress, see :meth:`WorkQueue.progress`
+        """
+        while True:
+            progress = self._queue.progress()
+            logging.info(f'coordinator: {progress}')
+            if self._queue.finished():
+                return progress
+            sleep(interval)
+
+
+class ScanWorker(object):
+    """ Take work units from a :class:`WorkQueue` and crawl them with an
+    :class:`ElasticizeEngine`. While a unit is being crawled its lease is
+    renewed in background, if the worker dies the lease expires and the unit
+    goes to another worker.
+
+    The engine takes the `namespace` of the queue, unless it has its own: the
+    ids of the documents do not depend on the host, so a unit crawled again
+    by another worker upserts the same documents instead of duplicating them,
+    and `reconcile` removes the stale documents written by any host.
+
+    :param queue: a :class:`WorkQueue`
+    :param engine: an :class:`ElasticizeEngine`, its `path` is ignored
+    :param name: the name of this worker, by default the hostname followed by
+                 a random suffix
+    :param crawl_kwargs: additional params for
+                         :meth:`ElasticizeEngine.crawl_and_process`
+    """
+
+    def __init__(self, queue, engine, name=None, **crawl_kwargs):
+        self._queue = queue
+        self._engine = engine
+        if engine.namespace is None:
+            engine.namespace = queue.namespace
+        if name is None:
+            name = f"{get_machine_info()['hostname']}-{uuid4().hex[:8]}"
+        self.name = name
+        self._crawl_kwargs = crawl_kwargs
+        self.units = 0
+        self.files = 0
+
+    def _heartbeat(self, id, stop, interval):
+        """ Renew the lease of unit `id` until `stop` is set """
+        while not stop.wait(interval):
+            if not self._queue.renew(id, self.name):
+                logging.warning(f'{self.name}: lease of unit {id} lost')
+                return
+
+    def run(self, wait=False, interval=10.):
+        """ Process units until the queue is empty
+
+        :param wait: if True, when there are no units available wait for the
+                     ones leased by other workers to be completed (or to be
+                     handed out again) before exiting
+        :param interval: seconds between two attempts to get a unit and
+                         between two lease renewals
+        :return: the number of units processed
+        """
+        units = self.units
+        while True:
+            unit = self._queue.lease(self.name)
+            if unit is None:
+                if not wait or self._queue.finished():
+                    break
+                sleep(interval)
+                continue
+            id, path, recursive = unit
+            logging.info(f'{self.name}: unit {id} {path} (recursive: {recursive})')
+            stop = Event()
+            heartbeat = Thread(target=self._heartbeat, args=(id, stop, interval),
+                               name=f'heartbeat-{id}', daemon=True)
+            heartbeat.start()
+            try:
+                files = self._engine.crawl_and_process(path=path, recursive=recursive,
+                                                       **self._crawl_kwargs)
+            except Exception as e:
+                logging.exception(f'{self.name}: unit {id} failed: {e}')
+                self._queue.fail(id, self.name, e)
+                continue
+            finally:
+                stop.set()
+                heartbeat.join()
+            if not self._queue.complete(id, self.name, files):
+                logging.warning(f'{self.name}: unit {id} was handed out to another worker')
+            self.units += 1
+            self.files += files
+        return self.units - units
@@ -8,17 +8,36 @@ import os
 import re
 from datetime import datetime
 from hashlib import sha256
+from itertools import chain
 from multiprocessing import cpu_count
+from stat import S_ISDIR
+from stat import S_ISREG
+from time import perf_counter
 from time import time
 
-from joblib import Parallel
-from joblib import delayed
-
+from elasticizefiles.base import ContentDedup
 from elasticizefiles.base import Elastic
-from elasticizefiles.utils.files import explore_path
+from elasticizefiles.base import ElasticBulk
+from elasticizefiles.base import Extraction
+from elasticizefiles.base import Extractor
+from elasticizefiles.base import ExtractorCache
+from elasticizefiles.base import ExtractorPool
+from elasticizefiles.base import FileContext
+from elasticizefiles.base import FileState
+from elasticizefiles.base import RuleMatcher
+from elasticizefiles.base import SeenIds
+from elasticizefiles.base import Task
 from elasticizefiles.utils.files import filestat
-from elasticizefiles.utils.files import get_hash
 from elasticizefiles.utils.files import get_machine_info
+from elasticizefiles.utils.files import scan_path
+from elasticizefiles.utils.metrics import Metrics
+from elasticizefiles.utils.metrics import max_rss
+from elasticizefiles.utils.pipeline import InFlight
+from elasticizefiles.utils.pipeline import Pipeline
+from elasticizefiles.utils.profiling import no_span
+from elasticizefiles.utils.watch import DELETED
+from elasticizefiles.utils.watch import debounce
+from elasticizefiles.utils.watch import watcher
 
 
 class ElasticizeEngine(object):
@@ -34,66 +53,634 @@ class ElasticizeEngine(object):
     :param index_config: additional config params to create the index
     :param index_mapping: the data type mapping for the current index
     :param index_alias_name: an alias name for this index
+    :param bulk_max_docs: max number of documents sent in a single bulk request
+    :param bulk_max_bytes: max size of a single bulk request
+    :param bulk_max_seconds: max time a document waits before being sent
+    :param bulk_max_requests: max number of bulk requests in flight
+    :param bulk_max_retries: max number of times a document rejected by an
+                             overloaded or unavailable cluster is sent again
+    :param bulk_adaptive: if True the size of the bulk requests and the number
+                          of requests in flight follow the latency and the
+                          rejections of the cluster (see :class:`ElasticBulk`)
+    :param elastic_timeout: the timeout in seconds of each Elastic request
+    :param elastic_pool_size: connections kept alive for each Elastic node,
+                              if None it is set to the number of cpus
+    :param state_file: a SQLite file where to keep the state of the indexed
+                       files, if set files not changed since the previous
+                       scan are skipped
+    :param dedup: if True the extractors outputs are reused for files with the
+                  same content (see :class:`ContentDedup`)
+    :param dedup_cache_size: number of contents kept in memory by `dedup`
+    :param dedup_lookup_index: if True `dedup` looks for the outputs in the
+                               documents already in the index too
+    :param sink: a :class:`Sink` where to write the documents (e.g. a
+                 :class:`SpoolSink` shipped to Elastic later on), by default
+                 they are sent to Elastic in bulk; with a sink `elastic_hosts`
+                 can be None and no connection to Elastic is made
+    :param cache_file: a SQLite file where to keep the extractors outputs
+                       (see :class:`ExtractorCache`), if set the extractors
+                       are not run again on contents already processed, e.g.
+                       when the index is rebuilt
+    :param cache_max_bytes: the max size of the outputs kept in `cache_file`
+    :param max_in_flight: max number of files between the walk and the index,
+                          by default only the queues between the stages
+                          bound them
+    :param max_in_flight_bytes: max (estimated) size of the documents built
+                                and not indexed yet, the extraction waits
+                                while it is reached
+    :param namespace: the documents ids are derived from it in place of the
+                      MAC address of the machine, so that the hosts of a
+                      distributed crawl share them (see :class:`ScanWorker`);
+                      reconcile then covers the documents of the namespace
     """
 
     def __init__(self, path, rules, elastic_hosts, elastic_index, elastic_doc_type,
                  index_create_if_not_exists=True, index_drop_if_exists=False,
-                 index_config=None, index_mapping=None, index_alias_name=None):
+                 index_config=None, index_mapping=None, index_alias_name=None,
+                 bulk_max_docs=500, bulk_max_bytes=5 * 1024 * 1024,
+                 bulk_max_seconds=5., bulk_max_requests=4,
+                 bulk_max_retries=5, bulk_adaptive=True, elastic_timeout=30,
+                 elastic_pool_size=None, state_file=None, dedup=False,
+                 dedup_cache_size=10000, dedup_lookup_index=True, sink=None,
+                 cache_file=None, cache_max_bytes=1024 * 1024 * 1024,
+                 max_in_flight=None, max_in_flight_bytes=256 * 1024 * 1024,
+                 namespace=None):
 
         self._path = path
         ElasticizeEngine._check_rules(rules)
         self._rules = rules
+        self._matcher = RuleMatcher(rules)
         self._machine_info = get_machine_info()
+        self.namespace = namespace
+        self.metrics = Metrics()
 
         if index_mapping is None:
             index_mapping = ElasticizeEngine._build_mapping(rules)
 
-        self._es = Elastic(elastic_hosts, elastic_index, elastic_doc_type)
-        self._es.create_index(elastic_index, elastic_doc_type,
-                              create_if_not_exists=index_create_if_not_exists,
-                              drop_if_exists=index_drop_if_exists,
-                              config=index_config, mapping=index_mapping,
-                              alias_name=index_alias_name)
+        if elastic_hosts is None and sink is None:
+            raise Exception('either `elastic_hosts` or `sink` must be set')
+        if elastic_pool_size is None:
+            elastic_pool_size = cpu_count()
+        self._es = None
+        if elastic_hosts is not None:
+            self._es = Elastic(elastic_hosts, elastic_index, elastic_doc_type,
+                               timeout=elastic_timeout, maxsize=elastic_pool_size)
+            self._es.create_index(elastic_index, elastic_doc_type,
+                                  create_if_not_exists=index_create_if_not_exists,
+                                  drop_if_exists=index_drop_if_exists,
+                                  config=index_config, mapping=index_mapping,
+                                  alias_name=index_alias_name)
+        self._bulk_config = {
+            'max_docs': bulk_max_docs,
+            'max_bytes': bulk_max_bytes,
+            'max_seconds': bulk_max_seconds,
+            'max_requests': bulk_max_requests,
+            'max_retries': bulk_max_retries,
+            'adaptive': bulk_adaptive,
+            'on_failure': self._on_index_failure,
+            'on_success': self._on_index_success,
+            'metrics': self.metrics,
+        }
+        self._sink = sink
+        if sink is None:
+            self._bulk = ElasticBulk(self._es, **self._bulk_config)
+        else:
+            self._bulk = sink.attach(on_failure=self._on_index_failure,
+                                     on_success=self._on_index_success,
+                                     metrics=self.metrics)
+        self._state = None
+        if state_file is not None:
+            self._state = FileState(state_file)
+        self._dedup = None
+        if dedup:
+            self._dedup = ContentDedup(max_size=dedup_cache_size,
+                                       elastic=self._es if dedup_lookup_index else None)
+        self._cache = None
+        if cache_file is not None:
+            self._cache = ExtractorCache(cache_file, max_bytes=cache_max_bytes)
+        self._pool = None
+        self._profiler = None
+        self._recent = None
+        self._seen = None
+        self._failed_files = None
+        self._unconfirmed = None
+        self._ready = []
+        self._max_in_flight = max_in_flight
+        self._max_in_flight_bytes = max_in_flight_bytes
+        self._in_flight = None
+        self._signatures = {}
 
-    def crawl_and_process(self, n_jobs=-1):
+    def crawl_and_process(self, n_jobs=-1, n_processes=-1, queue_size=None,
+                          n_walkers=4, log_interval=None, profiler=None,
+                          path=None, recursive=True, reconcile=False):
         """ Crawl files and apply extractor on them.
 
         :param n_jobs: number of parallel job, if -1 will be automatically set
                        to the number of cpus available
+        :param n_processes: number of processes running the CPU-bound
+                            extractors, if -1 will be automatically set to the
+                            number of cpus available, if 0 they run in the
+                            same threads of the other extractors
+        :param queue_size: the size of the queues between the stages, if None
+                           will be set to `5 * n_jobs`
+        :param n_walkers: number of folders scanned at the same time
+        :param log_interval: if set, log the :attr:`metrics` every
+                             `log_interval` seconds
+        :param profiler: a :class:`Profiler` collecting profiling data of this
+                         crawl, by default nothing is profiled
+        :param path: the path to be scanned instead of the one of the engine,
+                     e.g. a work unit of a :class:`ScanWorker`
+        :param recursive: if False the subfolders of the path are not scanned
+        :param reconcile: if True, after the crawl remove from the index the
+                          documents no longer on disk (see :meth:`reconcile`);
+                          it can be a :class:`SeenIds` or a
+                          :class:`BloomFilter` collecting the ids of the
+                          crawl, by default a :class:`SeenIds`
+        :return: the number of files processed
+        """
+        n_jobs, queue_size = self._start(n_jobs, n_processes, queue_size,
+                                         log_interval, profiler)
+        if reconcile is True:
+            reconcile = SeenIds()
+        if reconcile is not False:
+            self._seen = reconcile
+            self._failed_files = set()
+            self._unconfirmed = {}
+        try:
+            completed = self._crawl(n_jobs, queue_size,
+                                    self._walk(n_walkers, path, recursive))
+            if reconcile is not False:
+                self.reconcile(reconcile, path=path, recursive=recursive,
+                               failed=self._failed_files)
+            return completed
+        finally:
+            self._seen = None
+            self._failed_files = None
+            self._unconfirmed = None
+            self._stop()
+
+    def reconcile(self, seen, path=None, recursive=True, failed=(), slices=1):
+        """ Remove from the index the documents of this machine (or of the
+        `namespace` of the engine), under `path`, whose id has not been seen by the last crawl: the documents of
+        files deleted from disk and of the previous contents of the modified
+        ones. Documents are streamed from Elastic with their filename only and
+        deleted in bulk, memory is bounded by `seen`.
+
+        :param seen: the ids of the documents of the files found by the crawl,
+                     a :class:`SeenIds` or a :class:`BloomFilter` (its false
+                     positives are stale documents kept)
+        :param path: the path crawled, by default the one of the engine
+        :param recursive: if False the crawl did not scan the subfolders
+        :param failed: the filenames whose processing failed, their
+                       documents are kept
+        :param slices: number of sliced scrolls reading the documents in
+                       parallel, see :meth:`Elastic.iterate_data`
+        :return: the number of documents removed
+        """
+        if self._es is None:
+            raise Exception('reconciliation needs `elastic_hosts`')
+        path = os.path.abspath(self._path if path is None else path).replace('\\', '/').rstrip('/')
+        if self.namespace is None:
+            owner = {'match_phrase': {'machine_info.mac_address': self._machine_info['mac_address']}}
+        else:
+            owner = {'term': {'namespace': self.namespace}}
+        query = {
+            'query': {'bool': {'filter': [
+                owner,
+                {'prefix': {'filename.keywords': f'{path}/'}},
+            ]}},
+        }
+        tik = time()
+        checked = 0
+        removed = 0
+        stale = []
+        for doc in self._es.iterate_data(query, page_size=1000, raw=True,
+                                         slices=slices, source=['filename']):
+            checked += 1
+            filename = doc['_source']['filename']
+            if not recursive and '/' in filename[len(path) + 1:]:
+                continue
+            if doc['_id'] in seen or filename in failed:
+                continue
+            self._bulk.delete(doc['_id'])
+            removed += 1
+            stale.append(doc['_id'])
+            if self._state is not None and len(stale) >= 1000:
+                self._state.remove_ids(stale)
+                stale = []
+        if self._state is not None:
+            self._state.remove_ids(stale)
+        self._bulk.close()
+        self.metrics.count('reconcile.removed', removed)
+        logging.info(f'reconcile: {checked} documents checked, {removed} removed '
+                     f'in {(time() - tik):.2f}s')
+        return removed
+
+    def watch(self, n_jobs=-1, n_processes=-1, queue_size=None, n_walkers=4,
+              crawl=True, quiet=1., max_delay=10., poll_interval=None,
+              stop=None, log_interval=None):
+        """ Keep the index in sync with the path: the files created,
+        modified, moved or deleted are processed within seconds from their
+        change, the documents of deleted files (or of the previous content of
+        modified ones) are removed.
+
+        Changes are reported by inotify on Linux, elsewhere the path is polled
+        (see :func:`watcher`); with inotify every folder is watched. The old
+        documents are found in the `state_file`, or in Elastic without it
+        (documents indexed less than a refresh interval before may be missed).
+
+        :param n_jobs: number of parallel job, if -1 will be automatically set
+                       to the number of cpus available
+        :param n_processes: number of processes running the CPU-bound
+                            extractors, see :meth:`crawl_and_process`
+        :param queue_size: the size of the queues between the stages, if None
+                           will be set to `5 * n_jobs`
+        :param n_walkers: number of folders scanned at the same time
+        :param crawl: if True the whole path is crawled first
+        :param quiet: seconds without changes after which the changes
+                      collected are processed
+        :param max_delay: max seconds a change waits to be processed
+        :param poll_interval: if set, poll the path every `poll_interval`
+                              seconds instead of using inotify
+        :param stop: a :class:`threading.Event` ending the watch when set, by
+                     default it runs forever
+        :param log_interval: if set, log the :attr:`metrics` every
+                             `log_interval` seconds
+        """
+        n_jobs, queue_size = self._start(n_jobs, n_processes, queue_size,
+                                         log_interval, None)
+        # changes happening during the first crawl are caught too
+        w = watcher(self._path, interval=poll_interval)
+        try:
+            if crawl:
+                self._crawl(n_jobs, queue_size, self._walk(n_walkers))
+            for changes in debounce(w, quiet=quiet, max_delay=max_delay, stop=stop):
+                self._apply_changes(changes, n_jobs, queue_size, n_walkers)
+        finally:
+            w.close()
+            self._stop()
+
+    def _start(self, n_jobs, n_processes, queue_size, log_interval, profiler):
+        """ Prepare the resources shared by the crawls
+
+        :return: a tuple `(n_jobs, queue_size)` with the defaults applied
         """
         if n_jobs < 1:
             n_jobs = cpu_count()
-        tot = 0
-        buffer = []
-        tik = time()
-        for dirname, filename in explore_path(self._path):
+        if n_processes < 0:
+            n_processes = cpu_count()
+        if queue_size is None:
+            queue_size = 5 * n_jobs
+        cpu_bound = self._cpu_bound_extractors()
+        if n_processes > 0 and len(cpu_bound) > 0:
+            self._pool = ExtractorPool(cpu_bound, n_processes)
+        self._setup_extractors()
+        if log_interval is not None:
+            self.metrics.start_logging(log_interval)
+        self._profiler = profiler
+        return n_jobs, queue_size
+
+    def _stop(self):
+        """ Release the resources shared by the crawls """
+        self._profiler = None
+        self.metrics.stop_logging()
+        self._teardown_extractors()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def _extractors(self):
+        """ Collect the distinct extractors of the rules """
+        r = {}
+        for rule in self._rules.values():
+            for extractor in rule['extractor']:
+                for e in extractor.values():
+                    r[id(e)] = e
+        return list(r.values())
+
+    def _setup_extractors(self):
+        """ Call :meth:`Extractor.setup` on the extractors run in this
+        process, the ones of the pool are set up by its workers """
+        self._ready = []
+        for e in self._extractors():
+            if self._pool is not None and getattr(e, 'cpu_bound', False):
+                continue
+            if hasattr(e, 'setup'):
+                e.setup()
+                self._ready.append(e)
+
+    def _teardown_extractors(self):
+        for e in self._ready:
+            try:
+                e.teardown()
+            except Exception as ex:
+                logging.warning(f'teardown of {e.name} failed: {ex}')
+        self._ready = []
+
+    def _cpu_bound_extractors(self):
+        """ Collect the CPU-bound extractors as `{'rule.name': extractor}` """
+        r = {}
+        for rule_name, rule in self._rules.items():
+            for extractor in rule['extractor']:
+                for n, e in extractor.items():
+                    if getattr(e, 'cpu_bound', False):
+                        r[f'{rule_name}.{n}'] = e
+        return r
+
+    def _crawl(self, n_jobs, queue_size, files):
+        self._completed = 0
+        self._skipped = 0
+        self._tik = time()
+        self._in_flight = InFlight(self._max_in_flight, self._max_in_flight_bytes)
+        applier = self._applier
+        index = self._index
+        if self._profiler is not None:
+            applier = self._profiler.profiled(applier)
+            index = self._profiler.profiled(index)
+        applier = self._tracked(applier)
+        pipeline = Pipeline(queue_size=queue_size)
+        pipeline.source('walk', self._admit(files))
+        if self._state is not None:
+            pipeline.stage('state', self._skip_unchanged, batch_size=100)
+        batch_size = max([getattr(e, 'batch_size', 1) for e in self._extractors()], default=1)
+        if batch_size > 1:
+            # files are handed to the extractors with a `batch_size` together
+            batch_applier = self._batch_applier
+            if self._profiler is not None:
+                batch_applier = self._profiler.profiled(batch_applier)
+            batch_applier = self._tracked_batch(batch_applier)
+            pipeline.stage('extract', batch_applier, n_threads=n_jobs, batch_size=batch_size)
+        else:
+            pipeline.stage('extract', applier, n_threads=n_jobs)
+        pipeline.stage('index', index)
+        for stage in pipeline.stages:
+            self.metrics.gauge_fn(f'queue.{stage.name}', lambda stage=stage: stage.backlog)
+        pipeline.run()
+        self._bulk.close()
+        if self._es is not None:
+            self._es.close()
+        if self._state is not None:
+            self._state.commit()
+        if self._cache is not None:
+            self._cache.commit()
+        logging.info(f'completed {self._completed} in {(time() - self._tik):.2f}s')
+        logging.info(f'skipped: {self._skipped} unchanged files')
+        for stage in pipeline.stages:
+            logging.info(f'{stage.name}: {stage.processed} processed, {stage.errors} errors')
+        logging.info(f'matcher: {self._matcher.stats}, rules: {self._matcher.hits}')
+        logging.info(f'indexed: {self._bulk.sent} documents, failed: {self._bulk.failed}')
+        if self._dedup is not None:
+            logging.info(f'dedup: {self._dedup.hits} outputs reused, {self._dedup.misses} extracted')
+        if self._cache is not None:
+            logging.info(f'cache: {self._cache.hits} outputs reused, {self._cache.misses} extracted')
+        rss = max_rss()
+        logging.info(f'memory: {"unknown" if rss is None else f"{rss / 1024 / 1024:.1f}MB"} peak rss, '
+                     f'in flight peak {self._in_flight.peak_items} files, '
+                     f'{self._in_flight.peak_bytes / 1024 / 1024:.1f}MB of documents')
+        self.metrics.log()
+        return self._completed
+
+    def _tracked(self, applier):
+        """ Wrap `applier` recording the files it fails to process """
+
+        def fn(task):
+            try:
+                return applier(task)
+            except Exception as e:
+                self._task_failed(task)
+                raise e
+
+        return fn
+
+    def _tracked_batch(self, applier):
+        """ Like :meth:`_tracked` for the batches of :meth:`_batch_applier` """
+
+        def fn(tasks):
+            try:
+                return applier(tasks)
+            except Exception as e:
+                for task in tasks:
+                    self._task_failed(task)
+                raise e
+
+        return fn
+
+    def _admit(self, tasks):
+        """ Let the tasks in the pipeline while fewer than `max_in_flight`
+        are being processed """
+        for task in tasks:
+            self._in_flight.acquire()
+            yield task
+
+    def _task_failed(self, task):
+        """ A task leaving the pipeline because its file failed """
+        self._in_flight.release()
+        if self._failed_files is not None:
+            self._failed_files.add(task.filename)
+
+    def _walk(self, n_walkers, path=None, recursive=True):
+        """ Walk the path yielding the matched files with their extractors
+        and stats """
+        return self._match(scan_path(self._path if path is None else path,
+                                     recursive=recursive, n_threads=n_walkers))
+
+    def _match(self, entries):
+        """ Match the `(dirname, filename, stat)` entries yielding a
+        :class:`Task` for each file to be processed """
+        while True:
+            tik = perf_counter()
+            entry = next(entries, None)
+            if entry is None:
+                break
+            dirname, filename, stat = entry
+            self.metrics.observe('walk', perf_counter() - tik)
+            self.metrics.count('walk.files')
             full_filename = os.path.abspath(os.path.join(dirname, filename)).replace('\\', '/')
-            exts = []
-            for rule_name, rule in self._rules.items():
-                for pattern in rule['pattern']:
-                    if re.match(pattern, full_filename):
-                        logging.debug(f'matched: {full_filename}')
-                        for extractor in rule['extractor']:
-                            for n, e in extractor.items():
-                                exts.append({f'{rule_name}.{n}': e})
-            if len(exts) > 0:
-                buffer.append((full_filename, exts))
-            if len(buffer) >= 5 * n_jobs:
-                Parallel(n_jobs=n_jobs, verbose=1, backend='threading')(map(delayed(self._applier), buffer))
-                tot += len(buffer)
-                logging.info(f'completed: {tot} files ({(time() - tik) / tot:.2f}s per file)')
-                buffer = []
-        if len(buffer) > 0:
-            Parallel(n_jobs=n_jobs, verbose=1, backend='threading')(map(delayed(self._applier), buffer))
-            tot += len(buffer)
-            logging.info(f'completed: {tot} files ({(time() - tik) / tot:.2f}s per file)')
-        logging.info(f'completed {tot} in {(time() - tik):.2f}s')
-
-    def _applier(self, args):
-        filename, exts = args
-        logging.info(f'processing: {filename}')
-        sha = get_hash(filename, hash_type='sha256')
-        file_id = sha256((self._machine_info['mac_address'] + sha + filename).encode()).hexdigest()
+            with self.metrics.timer('match'):
+                plan = self._matcher.plan(full_filename)
+            if plan > 0:
+                self.metrics.count('match.files')
+                logging.debug(f'matched: {full_filename}')
+                yield Task(full_filename, stat, plan)
+
+    def _index(self, r):
+        span = self._profiler.span if self._profiler is not None else no_span
+        size = ElasticizeEngine._doc_size(r)
+        docs = self._documents(r)
+        try:
+            with self.metrics.timer('index'), span('index', r['filename']):
+                for doc in docs:
+                    self._bulk.update(id=doc['file_id'], data=doc)
+        except Exception as e:
+            # the file keeps its previous documents
+            if self._failed_files is not None:
+                self._failed_files.add(r['filename'])
+            raise e
+        finally:
+            self._in_flight.release(1, size)
+        self._indexed(docs)
+
+    def _documents(self, r):
+        """ Split the document `r` of a file from the documents of its chunks
+        (see :meth:`_split_chunks`)
+
+        :return: a list of documents, the one of the file first
+        """
+        r, children = ElasticizeEngine._split_chunks(r)
+        docs = [r] + children
+        if self._unconfirmed is not None:
+            # the file fails if Elastic rejects any of its documents
+            for doc in docs:
+                self._unconfirmed[doc['file_id']] = r['filename']
+        return docs
+
+    def _indexed(self, docs):
+        """ Record the documents of a file sent to the index """
+        if self._seen is not None:
+            for doc in docs:
+                self._seen.add(doc['file_id'])
+        if self._recent is not None:
+            self._recent[docs[0]['filename']] = {doc['file_id'] for doc in docs}
+        self._completed += 1
+        if self._completed % 100 == 0:
+            logging.info(f'completed: {self._completed} files '
+                         f'({(time() - self._tik) / self._completed:.2f}s per file)')
+
+    def _apply_changes(self, changes, n_jobs, queue_size, n_walkers):
+        """ Process a batch of changes reported by a watcher
+
+        :param changes: a dict `{path: kind}`, see :func:`debounce`
+        """
+        deleted = []
+        files = []
+        folders = []
+        for path, kind in changes.items():
+            path = os.path.abspath(path).replace('\\', '/')
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                kind = DELETED
+            if kind == DELETED:
+                deleted.append(path)
+            elif S_ISDIR(st.st_mode):
+                folders.append(path)
+            elif S_ISREG(st.st_mode):
+                files.append((os.path.dirname(path), os.path.basename(path), st))
+        logging.info(f'changes: {len(files)} files, {len(folders)} folders, {len(deleted)} deleted')
+        previous = self._indexed_files([f'{d}/{f}' for d, f, _ in files])
+        if len(files) + len(folders) > 0:
+            self._recent = {}
+            try:
+                entries = chain(files, *[scan_path(f, n_threads=n_walkers) for f in folders])
+                self._crawl(n_jobs, queue_size, self._match(entries))
+                # the documents of the previous content of the files (the
+                # ones of the files not indexed again are kept)
+                stale = [i for path, _, ids in previous if path in self._recent
+                         for i in ids if i not in self._recent[path]]
+            finally:
+                self._recent = None
+        else:
+            stale = []
+        stale.extend(i for _, _, ids in self._indexed_files(deleted) for i in ids)
+        if self._state is not None and len(deleted) > 0:
+            self._state.remove(deleted)
+        for i in stale:
+            self._bulk.delete(i)
+        self._bulk.close()
+        self.metrics.count('watch.changes', len(changes))
+        self.metrics.count('watch.deleted', len(stale))
+
+    def _indexed_files(self, paths, chunk_size=100):
+        """ The documents indexed for `paths` and for the files under them
+
+        :return: a list of `(filename, file_id, ids)`, `ids` are the documents
+                 of the file and of its chunks
+        """
+        if len(paths) == 0:
+            return []
+        if self._state is not None:
+            indexed = self._state.indexed(paths)
+            chunks = self._state.chunks([file_id for _, file_id in indexed])
+            return [(path, file_id, ElasticizeEngine._document_ids(file_id, chunks.get(file_id)))
+                    for path, file_id in indexed]
+        if self._es is None:
+            logging.warning('without `state_file` or Elastic old documents are not removed')
+            return []
+        r = {}
+        for i in range(0, len(paths), chunk_size):
+            chunk = paths[i:i + chunk_size]
+            should = [{'term': {'filename.keywords': p}} for p in chunk]
+            should.extend({'prefix': {'filename.keywords': f'{p}/'}} for p in chunk)
+            query = {'query': {'bool': {'should': should}}, '_source': ['filename', 'parent_id']}
+            for d in self._es.iterate_data(query, raw=True):
+                # chunks are grouped with the document of their file
+                file_id = d['_source'].get('parent_id', d['_id'])
+                r.setdefault(file_id, (d['_source']['filename'], []))[1].append(d['_id'])
+        return [(filename, file_id, ids) for file_id, (filename, ids) in r.items()]
+
+    def _skip_unchanged(self, buffer):
+        """ Drop from `buffer` the files not changed since the last scan and
+        add to each item the signature of its extractors.
+
+        :return: the filtered buffer
+        """
+        try:
+            for task in buffer:
+                task.signature = self._signature(task.plan)
+            with self.metrics.timer('state'):
+                unchanged = self._state.unchanged([t.filename for t in buffer],
+                                                  [t.stat for t in buffer],
+                                                  [t.signature for t in buffer])
+            if self._seen is not None and len(unchanged) > 0:
+                # unchanged files keep their documents, chunks included
+                file_ids = self._state.file_ids(list(unchanged))
+                chunks = self._state.chunks(file_ids)
+                for file_id in file_ids:
+                    for i in ElasticizeEngine._document_ids(file_id, chunks.get(file_id)):
+                        self._seen.add(i)
+        except Exception as e:
+            for task in buffer:
+                self._task_failed(task)
+            raise e
+        self._in_flight.release(len(unchanged))
+        self._skipped += len(unchanged)
+        self.metrics.count('state.skipped', len(unchanged))
+        return [t for t in buffer if t.filename not in unchanged]
+
+    def _signature(self, plan):
+        """ A signature of the extractors of `plan`, so that changing the
+        rules invalidates the file state """
+        signature = self._signatures.get(plan)
+        if signature is None:
+            signature = ','.join(sorted(k for k, _ in self._matcher.plans[plan]))
+            self._signatures[plan] = signature
+        return signature
+
+    @staticmethod
+    def _doc_size(r):
+        """ A cheap estimate of the size of the document `r` once serialized """
+        if isinstance(r, dict):
+            return sum(len(k) + 4 + ElasticizeEngine._doc_size(v) for k, v in r.items())
+        if isinstance(r, (list, tuple)):
+            return sum(ElasticizeEngine._doc_size(v) + 1 for v in r)
+        if isinstance(r, (str, bytes)):
+            return len(r) + 2
+        return 8
+
+    def _lookup(self, task, context):
+        """ Build the document of a file with the outputs already known (by
+        `dedup` or the cache)
+
+        :return: a tuple `(document, exts)`, `exts` are the extractors still
+                 to be applied
+        """
+        filename, exts, stat = task.filename, self._matcher.plans[task.plan], task.stat
+        span = self._profiler.span if self._profiler is not None else no_span
+        with self.metrics.timer('hash'), span('hash', filename, stat.st_size):
+            sha = context.hash('sha256')
+        self.metrics.count('bytes_read', context.size)
+        owner = self._machine_info['mac_address'] if self.namespace is None else self.namespace
+        file_id = sha256((owner + sha + filename).encode()).hexdigest()
         now = datetime.now()
         r = {
             'file_id': file_id,
@@ -101,13 +688,247 @@ class ElasticizeEngine(object):
             'scan_timestamp': now.timestamp() * 1000,
             'sha256': sha,
             'filename': filename,
-            'file_stats': filestat(filename),
+            'file_stats': filestat(filename, stat=stat),
             'machine_info': self._machine_info,
         }
-        for fun in exts:
-            for name, obj in fun.items():
-                r[name] = obj.extract(filename)
-        self._es.update(id=r['file_id'], data=r)
+        if self.namespace is not None:
+            r['namespace'] = self.namespace
+        if self._dedup is not None:
+            shared = [name for name, obj in exts if not getattr(obj, 'path_dependent', False)
+                      and not getattr(obj, 'chunked', False)]
+            r.update(self._dedup.lookup(sha, shared))
+            exts = [(name, obj) for name, obj in exts if name not in r]
+        if self._cache is not None:
+            missing = []
+            for name, obj in exts:
+                output = None
+                if not getattr(obj, 'path_dependent', False):
+                    output = self._cache.get(sha, obj)
+                if output is None:
+                    missing.append((name, obj))
+                else:
+                    r[name] = output
+            self.metrics.count('cache.hits', len(exts) - len(missing))
+            exts = missing
+        return r, exts
+
+    def _finish(self, task, r, exts):
+        """ Record the outputs extracted from a file and stage its state
+
+        :return: the document
+        """
+        sha = r['sha256']
+        if self._dedup is not None:
+            for name, obj in exts:
+                if not getattr(obj, 'path_dependent', False) and not getattr(obj, 'chunked', False):
+                    self._dedup.put(sha, name, r[name])
+        if self._cache is not None:
+            for name, obj in exts:
+                if not getattr(obj, 'path_dependent', False):
+                    self._cache.put(sha, obj, r[name])
+        if self._state is not None:
+            chunks = {name: len(output[Extractor.CHUNKS]) for name, output in r.items()
+                      if isinstance(output, dict) and Extractor.CHUNKS in output}
+            self._state.stage(r['file_id'], task.filename, task.stat, sha, task.signature,
+                              chunks=chunks)
+        return r
+
+    def _applier(self, task):
+        filename, stat = task.filename, task.stat
+        logging.info(f'processing: {filename}')
+        span = self._profiler.span if self._profiler is not None else no_span
+        with FileContext(filename, stat=stat) as context:
+            r, exts = self._lookup(task, context)
+            pending = []
+            if self._pool is not None:
+                # CPU-bound extractors start first, so they overlap with the rest
+                pending = [(name, self._pool.submit(name, filename), perf_counter())
+                           for name, obj in exts if getattr(obj, 'cpu_bound', False)]
+            for name, obj in exts:
+                if self._pool is None or not getattr(obj, 'cpu_bound', False):
+                    key = f'extract.{name}'
+                    with self.metrics.timer(key), span(key, filename, stat.st_size):
+                        r[name] = obj.extract_context(context)
+        for name, result, tik in pending:
+            r[name] = result.get()
+            elapsed = perf_counter() - tik
+            self.metrics.observe(f'extract.{name}', elapsed)
+            if self._profiler is not None:
+                self._profiler.record(f'extract.{name}', filename, stat.st_size, elapsed)
+        r = self._finish(task, r, exts)
+        # wait while too many documents are waiting to be indexed
+        self._in_flight.acquire(0, ElasticizeEngine._doc_size(r))
+        return r
+
+    def _batch_applier(self, tasks):
+        """ Like :meth:`_applier` on several files: each extractor with a
+        `batch_size` is applied at once on the files it matched, the others
+        file by file. A failure drops only the files it concerns.
+
+        :return: the list of documents
+        """
+        span = self._profiler.span if self._profiler is not None else no_span
+        files = []
+        for task in tasks:
+            logging.info(f'processing: {task.filename}')
+            context = FileContext(task.filename, stat=task.stat)
+            try:
+                r, exts = self._lookup(task, context)
+            except Exception as e:
+                context.close()
+                self._batch_failed(task, e)
+                continue
+            files.append(Extraction(task, context, r, exts))
+        groups = {}
+        for f in files:
+            for name, obj in f.exts:
+                if getattr(obj, 'batch_size', 1) > 1:
+                    groups.setdefault(name, (obj, []))[1].append(f)
+        pending = []
+        for name, (obj, group) in groups.items():
+            for i in range(0, len(group), obj.batch_size):
+                batch = group[i:i + obj.batch_size]
+                if self._pool is not None and getattr(obj, 'cpu_bound', False):
+                    filenames = [f.task.filename for f in batch]
+                    pending.append((name, batch, self._pool.submit_batch(name, filenames), perf_counter(), True))
+                    continue
+                tik = perf_counter()
+                # a single span for the batch, each file is recorded by `_batch_done`
+                with span(f'extract.{name}', [f.task.filename for f in batch]):
+                    try:
+                        outputs = obj.extract_context_batch([f.context for f in batch])
+                    except Exception as e:
+                        logging.warning(f'[extract] {name} failed on a batch, retrying file by file: {e}')
+                        outputs = [self._retry(f, lambda f=f: obj.extract_context(f.context)) for f in batch]
+                self._batch_done(name, batch, outputs, perf_counter() - tik)
+        for f in files:
+            for name, obj in f.exts:
+                if f.error is not None or getattr(obj, 'batch_size', 1) > 1:
+                    continue
+                if self._pool is not None and getattr(obj, 'cpu_bound', False):
+                    pending.append((name, [f], self._pool.submit(name, f.task.filename), perf_counter(), False))
+                    continue
+                key = f'extract.{name}'
+                try:
+                    with self.metrics.timer(key), span(key, f.task.filename, f.task.stat.st_size):
+                        f.doc[name] = obj.extract_context(f.context)
+                except Exception as e:
+                    f.error = e
+            f.context.close()
+        for name, batch, result, tik, batched in pending:
+            try:
+                outputs = result.get() if batched else [result.get()]
+            except Exception as e:
+                if batched:
+                    logging.warning(f'[extract] {name} failed on a batch, retrying file by file: {e}')
+                outputs = [self._retry(f, lambda f=f: self._pool.submit(name, f.task.filename).get())
+                           if batched else None for f in batch]
+                if not batched:
+                    batch[0].error = e
+            self._batch_done(name, batch, outputs, perf_counter() - tik)
+        r = []
+        for f in files:
+            if f.error is not None:
+                self._batch_failed(f.task, f.error)
+                continue
+            r.append(self._finish(f.task, f.doc, f.exts))
+        # the documents of the batch are released one by one once indexed,
+        # they are acquired at once: waiting for a part of them would wait
+        # for the ones this thread holds already
+        self._in_flight.acquire(0, sum(ElasticizeEngine._doc_size(d) for d in r))
+        return r
+
+    def _batch_done(self, name, batch, outputs, elapsed):
+        """ Set the `outputs` of the extractor `name` on the
+        :class:`Extraction` of `batch` """
+        if len(outputs) != len(batch):
+            error = Exception(f'{name} returned {len(outputs)} outputs for {len(batch)} files')
+            outputs = [None] * len(batch)
+            for f in batch:
+                f.error = error
+        for f, output in zip(batch, outputs):
+            if f.error is None:
+                f.doc[name] = output
+            self.metrics.observe(f'extract.{name}', elapsed / len(batch))
+            if self._profiler is not None:
+                self._profiler.record(f'extract.{name}', f.task.filename, f.task.stat.st_size,
+                                      elapsed / len(batch))
+
+    @staticmethod
+    def _retry(f, fn):
+        """ Extract a file of a failed batch alone, recording the error on
+        its :class:`Extraction` """
+        try:
+            return fn()
+        except Exception as e:
+            f.error = e
+
+    def _batch_failed(self, task, error):
+        logging.error(f'[extract] failed on {task.filename}: {error}')
+        self.metrics.count('extract.errors')
+        self._task_failed(task)
+
+    def _on_index_failure(self, file_id, error):
+        logging.error(f'indexing of {file_id} failed: {error}')
+        if self._state is not None:
+            self._state.discard(file_id)
+        if self._unconfirmed is not None:
+            filename = self._unconfirmed.pop(file_id, None)
+            if filename is not None:
+                # its previous document is kept by reconcile
+                self._failed_files.add(filename)
+
+    def _on_index_success(self, file_ids):
+        if self._state is not None:
+            self._state.confirm(file_ids)
+        if self._unconfirmed is not None:
+            for file_id in file_ids:
+                self._unconfirmed.pop(file_id, None)
+
+    @staticmethod
+    def _split_chunks(r):
+        """ Move the chunks of the outputs (see :attr:`Extractor.CHUNKS`) of
+        the document `r` to child documents
+
+        :return: a tuple `(document, children)`
+        """
+        children = []
+        for name, output in list(r.items()):
+            if not isinstance(output, dict) or Extractor.CHUNKS not in output:
+                continue
+            # outputs may be shared with the dedup cache, they are not changed
+            r = dict(r)
+            r[name] = {k: v for k, v in output.items() if k != Extractor.CHUNKS}
+            for i, chunk in enumerate(output[Extractor.CHUNKS]):
+                children.append({
+                    'file_id': ElasticizeEngine._chunk_id(r['file_id'], name, i),
+                    'parent_id': r['file_id'],
+                    'chunk': i,
+                    'scan_datetime': r['scan_datetime'],
+                    'scan_timestamp': r['scan_timestamp'],
+                    'sha256': r['sha256'],
+                    'filename': r['filename'],
+                    'machine_info': r['machine_info'],
+                    name: chunk,
+                })
+        return r, children
+
+    @staticmethod
+    def _chunk_id(file_id, name, i):
+        """ The id of the document of chunk `i` of output `name` """
+        return f'{file_id}-{name}-{i}'
+
+    @staticmethod
+    def _document_ids(file_id, chunks=None):
+        """ The ids of the document `file_id` and of its chunks
+
+        :param chunks: the number of chunks by output, see :meth:`FileState.chunks`
+        :return: a list of ids
+        """
+        r = [file_id]
+        for name, count in (chunks or {}).items():
+            r.extend(ElasticizeEngine._chunk_id(file_id, name, i) for i in range(count))
+        return r
 
     @staticmethod
     def _check_rules(rules):
@@ -144,6 +965,9 @@ class ElasticizeEngine(object):
                 'format': 'yyyy-MM-dd HH:mm:ss',
             },
             'scan_timestamp': {'type': 'float'},
+            'parent_id': {'type': 'keyword', },
+            'namespace': {'type': 'keyword', },
+            'chunk': {'type': 'long', },
             'sha256': {'type': 'text', },
             'filename': {
                 'type': 'text',
@@ -9,15 +9,30 @@ from elasticizefiles.base import Extractor
 
 class ExtractExif(Extractor):
 
+    cpu_bound = True
+
     def __init__(self):
         Extractor.__init__(self)
+        self._hachoir = None
 
-    def extract(self, filename):
+    def setup(self):
         try:
             from hachoir.metadata import extractMetadata
             from hachoir.parser import createParser
+            self._hachoir = (createParser, extractMetadata)
         except Exception as e:
+            # only the files matching the rule fail, in `extract`
+            self._hachoir = False
+
+    def teardown(self):
+        self._hachoir = None
+
+    def extract(self, filename):
+        if self._hachoir is None:
+            self.setup()
+        if self._hachoir is False:
             raise Exception('module `hachoir` is not installed, try `pip install -U hachoir`')
+        createParser, extractMetadata = self._hachoir
 
         metadata = {}
         try:
@@ -4,11 +4,13 @@ Created by Pierluigi on 2020-02-02
 project: elasticizefiles
 """
 from elasticizefiles.base import Extractor
-from elasticizefiles.utils.files import get_hash
+from elasticizefiles.base import FileContext
 
 
 class ExtractFilename(Extractor):
 
+    path_dependent = True
+
     def __init__(self):
         Extractor.__init__(self)
 
@@ -34,7 +36,11 @@ class ExtractSha256(Extractor):
         Extractor.__init__(self)
 
     def extract(self, filename):
-        return {'sha256': get_hash(filename, hash_type='sha256')}
+        with FileContext(filename) as context:
+            return self.extract_context(context)
+
+    def extract_context(self, context):
+        return {'sha256': context.hash('sha256')}
 
     def mapping(self):
         return {
@@ -51,22 +57,25 @@ class ExtractPythonFunction(Extractor):
         Extractor.__init__(self)
 
     def extract(self, filename):
+        with FileContext(filename) as context:
+            return self.extract_context(context)
+
+    def extract_context(self, context):
         r = {
             'class': [],
             'function': [],
         }
-        with open(filename, 'r') as f:
-            c = 0
-            for line in f.readlines():
-                c += 1
-                line = line.replace('\r', '').replace('\n', '').replace('\t',
-                                                                        ' ').strip()
-                if line.startswith('class'):
-                    r['class'].append({'line': c, 'name': line})
-                    continue
-                if line.startswith('def'):
-                    r['function'].append({'line': c, 'name': line})
-                    continue
+        text = context.text().replace('\r\n', '\n').replace('\r', '\n')
+        c = 0
+        for line in text.split('\n'):
+            c += 1
+            line = line.replace('\t', ' ').strip()
+            if line.startswith('class'):
+                r['class'].append({'line': c, 'name': line})
+                continue
+            if line.startswith('def'):
+                r['function'].append({'line': c, 'name': line})
+                continue
         return r
 
     def mapping(self):
@@ -3,6 +3,7 @@
 Created by Pierluigi on 2020-02-24
 project: elasticizefiles
 """
+import codecs
 
 from elasticizefiles.base import Extractor
 
@@ -13,19 +14,106 @@ class ExtractText(Extractor):
     .ps .rtf .tiff .tif .txt .wav .xlsx .xls) as supported by `textract`
     (https://github.com/deanmalmgren/textract)
 
+    Plain text files (see `plain_text`) are read directly, `chunk_size`
+    characters at a time, so that at most `max_chars` characters of them are
+    ever held in memory; the other filetypes are converted by `textract`
+    as a whole and truncated right after. The text beyond `max_chars` is
+    dropped and the output is flagged `truncated`. `max_chars` is finite by
+    default (10M characters), so that a huge file does not take the memory
+    of the crawl: the output of each file (its chunks included) is built in
+    memory before being indexed.
+
+    With `index_chunks` the text is not stored in the document of the file:
+    each piece of `chunk_size` characters becomes a document of its own,
+    linked to the document of the file by `parent_id` (the engine indexes
+    them, see :attr:`Extractor.CHUNKS`), so that documents and bulk requests
+    have a bounded size.
+
+    :param chunk_size: the number of characters of a piece of text
+    :param max_chars: the max number of characters extracted from a file, if
+                      None the whole text, whatever its size
+    :param index_chunks: if True each piece is indexed as a child document
+    :param encoding: the encoding of the plain text files
+    :param plain_text: the extensions of the files read without `textract`
     """
 
-    def __init__(self):
+    cpu_bound = True
+    version = '2'
+    PLAIN_TEXT = ('.txt', '.log', '.csv', '.tsv', '.json', '.md', '.rst',
+                  '.xml', '.yml', '.yaml', '.ini', '.cfg')
+    MAX_CHARS = 10 * 1024 * 1024
+
+    def __init__(self, chunk_size=64 * 1024, max_chars=MAX_CHARS, index_chunks=False,
+                 encoding='utf-8', plain_text=PLAIN_TEXT):
         Extractor.__init__(self)
+        self._chunk_size = chunk_size
+        self._max_chars = max_chars
+        self._index_chunks = index_chunks
+        self.chunked = index_chunks
+        self._encoding = encoding
+        self._plain_text = tuple(plain_text)
+        self._textract = None
 
-    def extract(self, filename):
+    def cache_key(self):
+        return f'{Extractor.cache_key(self)}:{self._chunk_size}:{self._max_chars}:{self._index_chunks}'
+
+    def setup(self):
         try:
             import textract
+            self._textract = textract
         except Exception as e:
+            # plain text files are still read
+            self._textract = False
+
+    def teardown(self):
+        self._textract = None
+
+    def _read(self, filename):
+        """ The text of `filename` in pieces of at most `chunk_size`
+        characters """
+        if filename.lower().endswith(self._plain_text):
+            decoder = codecs.getincrementaldecoder(self._encoding)(errors='replace')
+            with open(filename, 'rb') as f:
+                while True:
+                    data = f.read(self._chunk_size)
+                    text = decoder.decode(data, final=len(data) == 0)
+                    for i in range(0, len(text), self._chunk_size):
+                        yield text[i:i + self._chunk_size]
+                    if len(data) == 0:
+                        return
+        if self._textract is None:
+            self.setup()
+        if self._textract is False:
             raise Exception('module `textract` is not installed, try `pip install -U textract`')
 
-        text = textract.process(filename)
-        return {'text': text}
+        text = self._textract.process(filename)
+        if self._max_chars is not None:
+            # a utf-8 character takes at most 4 bytes
+            text = text[:self._max_chars * 4]
+        text = text.decode('utf-8', errors='replace')
+        for i in range(0, len(text), self._chunk_size):
+            yield text[i:i + self._chunk_size]
+
+    def extract(self, filename):
+        chunks = []
+        size = 0
+        truncated = False
+        for text in self._read(filename):
+            if self._max_chars is not None and size + len(text) > self._max_chars:
+                text = text[:self._max_chars - size]
+                truncated = True
+            if len(text) > 0:
+                chunks.append(text)
+                size += len(text)
+            if truncated:
+                break
+        if self._index_chunks:
+            return {
+                'chunks': len(chunks),
+                'truncated': truncated,
+                Extractor.CHUNKS: [{'text': text} for text in chunks],
+            }
+        return {'text': ''.join(chunks), 'truncated': truncated}
 
     def mapping(self):
         return {
@@ -34,7 +122,12 @@ class ExtractText(Extractor):
                 'fields': {
                     'keywords': {
                         'type': 'keyword',
+                        # long texts are searched as text only, a keyword
+                        # can not exceed 32766 bytes
+                        'ignore_above': 256,
                     }
                 }
-            }
-        }
\ No newline at end of file
+            },
+            'chunks': {'type': 'long', },
+            'truncated': {'type': 'boolean', },
+        }
@@ -3,14 +3,21 @@
 Created by Pierluigi on 2020-01-29
 project: elasticizefiles
 """
-import hashlib
+import logging
 import os
 from platform import system
+from queue import Empty
+from queue import Queue
+from threading import Event
+from threading import Lock
+from threading import Thread
 from re import findall
 from socket import gethostbyname
 from socket import gethostname
 from uuid import getnode
 
+from elasticizefiles.utils.hashing import hash_file
+
 
 def explore_path(path, recursive=True):
     """ Navigate a given path returning all files in folder and subfolders
@@ -26,30 +33,107 @@ def explore_path(path, recursive=True):
             break
 
 
-def filestat(filename):
+def scan_path(path, recursive=True, n_threads=4, queue_size=1000):
+    """ Navigate a given path returning all files in folder and subfolders
+    together with their stats.
+
+    Unlike :func:`explore_path` subfolders are scanned concurrently by
+    `n_threads` threads and entries are returned while a folder is still
+    being listed. Files come in no particular order.
+
+    :params path: a path to a folder
+    :params recursive: recursively explore subfolder (default `True`)
+    :params n_threads: number of folders scanned at the same time
+    :params queue_size: max number of entries scanned ahead of the consumer
+    :returns: a generator of triples: (`dirname`, `filename`, `stat`)
+    """
+    entries = Queue(maxsize=queue_size)
+    folders = Queue()
+    stop = Event()
+    lock = Lock()
+    pending = [1]
+    done = object()
+
+    def scan(dirname):
+        with os.scandir(dirname) as it:
+            for entry in it:
+                if stop.is_set():
+                    return
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            with lock:
+                                pending[0] += 1
+                            folders.put(entry.path)
+                    elif entry.is_file():
+                        entries.put((dirname, entry.name, entry.stat()))
+                except OSError as e:
+                    logging.warning(f'cannot scan {entry.path}: {e}')
+
+    def worker():
+        while True:
+            dirname = folders.get()
+            if dirname is done:
+                break
+            try:
+                scan(dirname)
+            except OSError as e:
+                logging.warning(f'cannot scan {dirname}: {e}')
+            with lock:
+                pending[0] -= 1
+                last = pending[0] == 0
+            if last:
+                entries.put(done)
+                for _ in range(n_threads):
+                    folders.put(done)
+
+    folders.put(path)
+    threads = [Thread(target=worker, name=f'scan-{i}', daemon=True) for i in range(n_threads)]
+    for t in threads:
+        t.start()
+    try:
+        while True:
+            entry = entries.get()
+            if entry is done:
+                break
+            yield entry
+    finally:
+        # the consumer may stop early: unblock the workers, the ones waiting
+        # for room in `entries` too, until all of them exit
+        stop.set()
+        for _ in range(n_threads):
+            folders.put(done)
+        for t in threads:
+            while t.is_alive():
+                while True:
+                    try:
+                        entries.get_nowait()
+                    except Empty:
+                        break
+                t.join(.01)
+
+
+def filestat(filename, stat=None):
     """ Get file stats and convert it to a dict.
 
     :params filename: a filename comprehensive of path if necessary
+    :params stat: the :func:`os.stat` result if already known
     :returns: a dictionary see [1] for more details
     [1] https://docs.python.org/3.6/library/os.html#os.stat_result
     """
-    fs = os.stat(filename)
+    fs = stat if stat is not None else os.stat(filename)
     return {k: getattr(fs, k) for k in dir(fs) if k.startswith('st_')}
 
 
-def get_hash(filename, hash_type='sha256'):
+def get_hash(filename, hash_type='sha256', strategy='read'):
     """ Get hash of binary files
 
     :params filename: a filename comprehensive of path if necessary
-    :params hash_type: an hashing function from hashlib
+    :params hash_type: an hashing function from hashlib (or xxhash)
+    :params strategy: how the file is read, see :func:`hash_file`
     :returns: a string containing the digest
     """
-    func = getattr(hashlib, hash_type)()
-    f = os.open(filename, (os.O_RDWR | os.O_BINARY))
-    for block in iter(lambda: os.read(f, 2048 * func.block_size), b''):
-        func.update(block)
-    os.close(f)
-    return func.hexdigest()
+    return hash_file(filename, hash_types=(hash_type, ), strategy=strategy)[hash_type]
 
 
 def get_machine_info():
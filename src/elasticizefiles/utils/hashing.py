@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-04-12
+project: elasticizefiles
+
+Hashing of files. Several digests can be computed reading a file once, with
+one of the following strategies:
+
+    - `read`: the file is read in chunks in a reusable buffer
+    - `mmap`: the file is memory-mapped and hashed without copies
+    - `sampled`: only the size, the head, the tail and some blocks in the
+      middle are hashed. It is much faster on huge files but it is not a
+      content hash: use it only as a fast identity.
+
+Besides the functions in `hashlib` (e.g. `sha256`, `blake2b`) the `xxhash`
+functions (`xxh64`, `xxh3_64`, `xxh128`) can be used if the module is
+installed.
+"""
+import hashlib
+import mmap
+import os
+from struct import pack
+from threading import local
+
+STRATEGIES = ('read', 'mmap', 'sampled')
+
+_buffers = local()
+
+
+def new_hash(hash_type):
+    """ Create a new hash object
+
+    :param hash_type: an hashing function from hashlib or xxhash
+    """
+    if hash_type.startswith('xxh'):
+        try:
+            import xxhash
+        except Exception as e:
+            raise Exception('module `xxhash` is not installed, try `pip install -U xxhash`')
+        return getattr(xxhash, hash_type)()
+    return getattr(hashlib, hash_type)()
+
+
+def _buffer(size):
+    """ A buffer of `size` bytes reused by the current thread """
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != size:
+        buffer = bytearray(size)
+        _buffers.buffer = buffer
+    return buffer
+
+
+def _hash_read(f, funcs, buffer_size):
+    buffer = _buffer(buffer_size)
+    view = memoryview(buffer)
+    for n in iter(lambda: f.readinto(buffer), 0):
+        for func in funcs:
+            func.update(view[:n])
+
+
+def _hash_mmap(f, funcs, buffer_size):
+    if os.fstat(f.fileno()).st_size == 0:
+        # empty files cannot be mapped
+        return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        view = memoryview(m)
+        try:
+            for i in range(0, len(view), buffer_size):
+                for func in funcs:
+                    func.update(view[i:i + buffer_size])
+        finally:
+            view.release()
+
+
+def _hash_sampled(f, funcs, buffer_size, samples):
+    size = os.fstat(f.fileno()).st_size
+    for func in funcs:
+        func.update(pack('<Q', size))
+    if size <= (samples + 2) * buffer_size:
+        _hash_read(f, funcs, buffer_size)
+        return
+    buffer = _buffer(buffer_size)
+    stride = (size - buffer_size) // (samples + 1)
+    offsets = [0] + [stride * (i + 1) for i in range(samples)] + [size - buffer_size]
+    for offset in offsets:
+        f.seek(offset)
+        n = f.readinto(buffer)
+        for func in funcs:
+            func.update(memoryview(buffer)[:n])
+
+
+def hash_file(filename, hash_types=('sha256', ), strategy='read',
+              buffer_size=1024 * 1024, samples=16):
+    """ Compute several digests of a file reading it once
+
+    :params filename: a filename comprehensive of path if necessary
+    :params hash_types: the hashing functions, see :func:`new_hash`
+    :params strategy: one of `read`, `mmap` or `sampled`
+    :params buffer_size: the size of the chunks read (and of the blocks
+                         hashed by `sampled`)
+    :params samples: the number of blocks hashed in the middle of the file by
+                     `sampled`
+    :returns: a dict `{hash_type: digest}`
+    """
+    if strategy not in STRATEGIES:
+        raise Exception(f'unknown strategy {strategy}, use one of {STRATEGIES}')
+    funcs = [new_hash(h) for h in hash_types]
+    with open(filename, 'rb', buffering=0) as f:
+        if strategy == 'read':
+            _hash_read(f, funcs, buffer_size)
+        elif strategy == 'mmap':
+            _hash_mmap(f, funcs, buffer_size)
+        else:
+            _hash_sampled(f, funcs, buffer_size, samples)
+    return {h: func.hexdigest() for h, func in zip(hash_types, funcs)}
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-03
+project: elasticizefiles
+
+Counters, gauges and latency histograms of a crawl. Metric names are dotted:
+the first part is the metric family and the rest, if any, a key inside it,
+e.g. `extract.rule1.exif` is the `rule1.exif` key of the `extract` family.
+"""
+import logging
+import re
+import sys
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Event
+from threading import Lock
+from threading import Thread
+from time import perf_counter
+
+# upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1., 5., 10., 60.)
+
+
+class Histogram(object):
+    """ A latency histogram with fixed buckets """
+
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """ Estimate the `q` quantile as the upper bound of its bucket """
+        if self.count == 0:
+            return 0.
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count > 0 else 0.,
+            'max': self.max,
+            'p50': self.quantile(.5),
+            'p90': self.quantile(.9),
+            'p99': self.quantile(.99),
+        }
+
+
+class Metrics(object):
+    """ A thread-safe registry of metrics """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_fns = {}
+        self._histograms = {}
+        self._logger = None
+
+    def count(self, name, value=1):
+        """ Increment the counter `name` """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        """ Set the gauge `name` """
+        with self._lock:
+            self._gauges[name] = value
+
+    def gauge_fn(self, name, fn):
+        """ Register a gauge whose value is read calling `fn` on snapshot """
+        with self._lock:
+            self._gauge_fns[name] = fn
+
+    def observe(self, name, seconds):
+        """ Record a latency in the histogram `name` """
+        with self._lock:
+            h = self._histograms.get(name)
+            if h is None:
+                h = self._histograms[name] = Histogram()
+            h.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """ Record the time spent in the `with` block in the histogram `name` """
+        tik = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - tik)
+
+    def snapshot(self):
+        """ The current value of all the metrics
+
+        :returns: a dict with `counters`, `gauges` and `histograms`
+        """
+        with self._lock:
+            gauges = dict(self._gauges)
+            fns = dict(self._gauge_fns)
+            r = {
+                'counters': dict(self._counters),
+                'histograms': {k: h.snapshot() for k, h in self._histograms.items()},
+            }
+        for name, fn in fns.items():
+            try:
+                gauges[name] = fn()
+            except Exception as e:
+                logging.debug(f'gauge {name} failed: {e}')
+        r['gauges'] = gauges
+        return r
+
+    def to_prometheus(self, prefix='elasticizefiles'):
+        """ Dump the metrics in the Prometheus text format """
+        snapshot = self.snapshot()
+        with self._lock:
+            histograms = {k: (list(h.counts), h.count, h.sum) for k, h in self._histograms.items()}
+        lines = []
+        families = set()
+
+        def family(name, suffix, kind):
+            fam, key = _split(name)
+            metric = f'{prefix}_{fam}{suffix}'
+            if metric not in families:
+                families.add(metric)
+                lines.append(f'# TYPE {metric} {kind}')
+            return metric, key
+
+        for name, value in sorted(snapshot['counters'].items()):
+            metric, key = family(name, '_total', 'counter')
+            lines.append(f'{metric}{_labels(key)} {value}')
+        for name, value in sorted(snapshot['gauges'].items()):
+            metric, key = family(name, '', 'gauge')
+            lines.append(f'{metric}{_labels(key)} {value}')
+        for name, (counts, count, total) in sorted(histograms.items()):
+            metric, key = family(name, '_seconds', 'histogram')
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ('+Inf', ), counts):
+                cumulative += n
+                lines.append(f'{metric}_bucket{_labels(key, le=bound)} {cumulative}')
+            lines.append(f'{metric}_sum{_labels(key)} {total}')
+            lines.append(f'{metric}_count{_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def start_logging(self, interval=60.):
+        """ Log a summary of the metrics every `interval` seconds """
+        self.stop_logging()
+        stop = Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.log()
+
+        self._logger = (stop, Thread(target=run, name='metrics', daemon=True))
+        self._logger[1].start()
+
+    def stop_logging(self):
+        if self._logger is not None:
+            stop, thread = self._logger
+            stop.set()
+            thread.join()
+            self._logger = None
+
+    def log(self, level=logging.INFO):
+        """ Log a summary of the metrics """
+        snapshot = self.snapshot()
+        logging.log(level, f'counters: {snapshot["counters"]}')
+        logging.log(level, f'gauges: {snapshot["gauges"]}')
+        for name, h in sorted(snapshot['histograms'].items()):
+            logging.log(level, f'{name}: {h["count"]} in {h["sum"]:.2f}s '
+                               f'(mean {h["mean"] * 1000:.1f}ms, p90 {h["p90"] * 1000:.1f}ms, '
+                               f'max {h["max"] * 1000:.1f}ms)')
+
+
+def max_rss():
+    """ The peak resident memory of this process, in bytes
+
+    :return: the size or None where it is not available (e.g. Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _split(name):
+    fam, _, key = name.partition('.')
+    return re.sub(r'[^a-zA-Z0-9_]', '_', fam), key
+
+
+def _labels(key, **labels):
+    if key:
+        labels = dict(key=key, **labels)
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
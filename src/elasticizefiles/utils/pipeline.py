@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-03-29
+project: elasticizefiles
+"""
+import logging
+from queue import Empty
+from queue import Queue
+from threading import Condition
+from threading import Lock
+from threading import Thread
+
+# marks the end of the stream flowing through a queue
+_STOP = object()
+
+
+class Stage(object):
+    """ A step of a :class:`Pipeline`: `n_threads` threads taking items from
+    `inbox`, applying `fn` and putting the results in `outbox`.
+
+    `fn` receives an item and returns the output item, or None to drop it.
+    If `batch_size` is greater than 1, `fn` receives a list with the items
+    already waiting in `inbox` (up to `batch_size`, never waiting for more)
+    and returns a list of output items.
+
+    :param name: the stage name
+    :param fn: the function applied on the items
+    :param inbox: the queue the items are taken from
+    :param outbox: the queue the outputs are put in, None for the last stage
+    :param n_threads: the number of threads
+    :param batch_size: max number of items passed to `fn` at once
+    """
+
+    def __init__(self, name, fn, inbox, outbox=None, n_threads=1, batch_size=1):
+        self.name = name
+        self._fn = fn
+        self._inbox = inbox
+        self._outbox = outbox
+        self._n_threads = n_threads
+        self._batch_size = batch_size
+        self._running = n_threads
+        self._lock = Lock()
+        self._threads = []
+        self.processed = 0
+        self.errors = 0
+
+    @property
+    def backlog(self):
+        """ The number of items waiting in `inbox` """
+        return self._inbox.qsize()
+
+    def start(self):
+        for i in range(self._n_threads):
+            t = Thread(target=self._run, name=f'{self.name}-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+
+    def _take(self):
+        """ Take the next items, or None once the stream ended """
+        item = self._inbox.get()
+        if item is _STOP:
+            return None
+        items = [item]
+        while len(items) < self._batch_size:
+            try:
+                item = self._inbox.get_nowait()
+            except Empty:
+                break
+            if item is _STOP:
+                # leave it for the next call
+                self._inbox.put(_STOP)
+                break
+            items.append(item)
+        return items
+
+    def _run(self):
+        while True:
+            items = self._take()
+            if items is None:
+                break
+            try:
+                if self._batch_size > 1:
+                    outputs = self._fn(items)
+                else:
+                    outputs = [self._fn(items[0])]
+            except Exception as e:
+                logging.exception(f'[{self.name}] failed: {e}')
+                with self._lock:
+                    self.errors += len(items)
+                continue
+            with self._lock:
+                self.processed += len(items)
+            if self._outbox is not None:
+                for output in outputs:
+                    if output is not None:
+                        self._outbox.put(output)
+        # let the other threads of this stage stop too
+        self._inbox.put(_STOP)
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last and self._outbox is not None:
+            self._outbox.put(_STOP)
+
+
+class InFlight(object):
+    """ A hard cap on the items, and on their size, between two points of a
+    pipeline (e.g. from the source to the last stage): :meth:`acquire` waits
+    while the limits are reached, :meth:`release` is called once an item is
+    done. An item bigger than `max_bytes` is let through alone, so it never
+    waits forever.
+
+    :param max_items: max number of items in flight, None for no limit
+    :param max_bytes: max size of the items in flight, None for no limit
+    """
+
+    def __init__(self, max_items=None, max_bytes=None):
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+        self._cond = Condition()
+        self.items = 0
+        self.bytes = 0
+        self.peak_items = 0
+        self.peak_bytes = 0
+
+    def _full(self, items, size):
+        if items > 0 and self._max_items is not None and self.items + items > self._max_items:
+            return True
+        if size > 0 and self._max_bytes is not None and self.bytes > 0 \
+                and self.bytes + size > self._max_bytes:
+            return True
+        return False
+
+    def acquire(self, items=1, size=0):
+        """ Wait until `items` items of `size` bytes fit in the limits """
+        with self._cond:
+            while self._full(items, size):
+                self._cond.wait()
+            self.items += items
+            self.bytes += size
+            self.peak_items = max(self.peak_items, self.items)
+            self.peak_bytes = max(self.peak_bytes, self.bytes)
+
+    def release(self, items=1, size=0):
+        with self._cond:
+            self.items -= items
+            self.bytes -= size
+            self._cond.notify_all()
+
+
+class Pipeline(object):
+    """ A chain of stages connected by bounded queues, all running at the
+    same time: when a queue is full the stages before it wait, so memory is
+    bounded and the slowest stage sets the pace.
+
+    Example:
+
+        pipeline = Pipeline(queue_size=10)
+        pipeline.source('read', open('file.txt'))
+        pipeline.stage('parse', parse, n_threads=4)
+        pipeline.stage('store', store)
+        pipeline.run()
+
+    :param queue_size: the size of each queue between two stages
+    """
+
+    def __init__(self, queue_size=100):
+        self._queue_size = queue_size
+        self._source = None
+        self._source_name = None
+        self._stages = []
+        self._queue = Queue(maxsize=queue_size)
+        self.produced = 0
+
+    def source(self, name, iterable):
+        """ Set the items entering the pipeline """
+        self._source_name = name
+        self._source = iterable
+        return self
+
+    def stage(self, name, fn, n_threads=1, batch_size=1):
+        """ Append a stage, see :class:`Stage` """
+        if len(self._stages) > 0:
+            inbox = Queue(maxsize=self._queue_size)
+            self._stages[-1]._outbox = inbox
+        else:
+            inbox = self._queue
+        self._stages.append(Stage(name, fn, inbox, n_threads=n_threads,
+                                  batch_size=batch_size))
+        return self
+
+    @property
+    def stages(self):
+        return list(self._stages)
+
+    def run(self):
+        """ Run the pipeline until the source is exhausted and every item
+        went through all the stages """
+        for stage in self._stages:
+            stage.start()
+        try:
+            for item in self._source:
+                self._queue.put(item)
+                self.produced += 1
+        except Exception as e:
+            logging.exception(f'[{self._source_name}] failed: {e}')
+            raise e
+        finally:
+            self._queue.put(_STOP)
+            for stage in self._stages:
+                stage.join()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-10
+project: elasticizefiles
+
+Opt-in profiling of a crawl. Pass a :class:`Profiler` to
+`ElasticizeEngine.crawl_and_process` and inspect it once the crawl is over:
+
+    profiler = Profiler()
+    engine.crawl_and_process(profiler=profiler)
+    profiler.print_stats(20)
+    print(profiler.slowest())
+    profiler.save_trace('trace.json')  # open it in chrome://tracing
+
+When no profiler is given the engine does not call any of this.
+"""
+import cProfile
+import heapq
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+from contextlib import contextmanager
+from threading import Lock
+from threading import get_ident
+from threading import local
+from time import perf_counter
+
+
+class _NoSpan(object):
+    """ A do-nothing context manager used when profiling is disabled """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+def no_span(name, filename=None, size=None):
+    return NO_SPAN
+
+
+class Profiler(object):
+    """ Collect profiling data of a crawl
+
+    :param cprofile: run `cProfile` in each worker thread, the stats of all
+                     the threads are merged by :meth:`stats`
+    :param slowest: how many of the slowest files to keep for each extractor
+    :param trace: record a timeline of each file through hash, extract and
+                  index, see :meth:`save_trace`
+    """
+
+    def __init__(self, cprofile=True, slowest=10, trace=True):
+        self._cprofile = cprofile
+        self._slowest_n = slowest
+        self._trace = trace
+        self._lock = Lock()
+        self._local = local()
+        self._profiles = []
+        self._slowest = {}
+        self._events = []
+        self._t0 = perf_counter()
+
+    def profiled(self, fn):
+        """ Wrap `fn` so that its calls are profiled by the cProfile of the
+        calling thread
+
+        Since python 3.12 only one cProfile can be active at a time: when a
+        thread can not enable its own, cProfile is given up (with a warning)
+        and `fn` runs unprofiled, spans and slowest files are still recorded.
+        """
+        if not self._cprofile:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            if not self._cprofile:
+                return fn(*args, **kwargs)
+            profile = getattr(self._local, 'profile', None)
+            try:
+                if profile is None:
+                    profile = cProfile.Profile()
+                    profile.enable()
+                    self._local.profile = profile
+                    with self._lock:
+                        self._profiles.append(profile)
+                else:
+                    profile.enable()
+            except ValueError as e:
+                # another profiler is active (another thread, or a tool)
+                with self._lock:
+                    if self._cprofile:
+                        logging.warning(f'profiler: cProfile disabled, {e}')
+                    self._cprofile = False
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.disable()
+
+        return wrapper
+
+    @contextmanager
+    def span(self, name, filename=None, size=None):
+        """ Time the `with` block as step `name` of `filename`
+
+        The time is added to the timeline and, if `size` is given, it is a
+        candidate to the slowest files of `name`.
+        """
+        tik = perf_counter()
+        try:
+            yield
+        finally:
+            tok = perf_counter()
+            if self._trace:
+                event = {
+                    'name': name,
+                    'cat': 'file',
+                    'ph': 'X',
+                    'ts': (tik - self._t0) * 1e6,
+                    'dur': (tok - tik) * 1e6,
+                    'pid': os.getpid(),
+                    'tid': get_ident(),
+                    'args': {'filename': filename},
+                }
+                with self._lock:
+                    self._events.append(event)
+            if size is not None:
+                self.record(name, filename, size, tok - tik)
+
+    def record(self, name, filename, size, seconds):
+        """ Keep `filename` if it is among the slowest for `name` """
+        item = (seconds, filename, size)
+        with self._lock:
+            heap = self._slowest.setdefault(name, [])
+            if len(heap) < self._slowest_n:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    def slowest(self):
+        """ The slowest files of each step
+
+        :returns: a dict `{name: [{'filename', 'size', 'seconds'}, ...]}`
+                  sorted from the slowest
+        """
+        with self._lock:
+            return {name: [{'filename': f, 'size': s, 'seconds': t}
+                           for t, f, s in sorted(heap, reverse=True)]
+                    for name, heap in self._slowest.items()}
+
+    def stats(self):
+        """ The cProfile stats of all the threads merged
+
+        :returns: a :class:`pstats.Stats` or None if nothing was profiled
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+        if len(profiles) == 0:
+            return None
+        stats = pstats.Stats(profiles[0], stream=io.StringIO())
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def print_stats(self, limit=30, sort='cumulative'):
+        stats = self.stats()
+        if stats is None:
+            return
+        stats.stream = sys.stdout
+        stats.sort_stats(sort).print_stats(limit)
+
+    def save_stats(self, filename):
+        """ Save the merged cProfile stats (e.g. for `snakeviz`) """
+        stats = self.stats()
+        if stats is not None:
+            stats.dump_stats(filename)
+
+    def save_trace(self, filename):
+        """ Save the timeline in the Chrome trace format """
+        with self._lock:
+            events = list(self._events)
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-30
+project: elasticizefiles
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+from time import monotonic
+from time import sleep
+
+from elasticizefiles.utils.files import scan_path
+
+CHANGED = 'changed'
+DELETED = 'deleted'
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher(object):
+    """ Watch a tree for changes with the Linux inotify API (through
+    `ctypes`, no extra dependency). Every folder of the tree is watched, so
+    large trees may need a bigger `fs.inotify.max_user_watches`.
+
+    Files are reported changed once closed after a write or moved into the
+    tree; a folder created or moved into the tree is reported changed as a
+    whole (it must be scanned, files may have been written in it before it
+    was watched), as it is the root when the kernel drops events.
+
+    :param path: the folder to be watched
+    """
+
+    MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+            IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+    def __init__(self, path):
+        name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(name, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._path = path
+        self._folders = {}
+        self._watch(path)
+
+    def _watch(self, path):
+        """ Watch `path` and all its subfolders """
+        for dirname, _, _ in os.walk(path):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirname), InotifyWatcher.MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                if e == errno.ENOSPC:
+                    logging.warning('inotify: watch limit reached, raise fs.inotify.max_user_watches')
+                    return
+                logging.warning(f'inotify: cannot watch {dirname}: {os.strerror(e)}')
+                continue
+            # a folder moved within the tree keeps its watch, update its path
+            self._folders[wd] = dirname
+        logging.debug(f'inotify: watching {len(self._folders)} folders')
+
+    def _unwatch(self, path):
+        """ Stop watching `path` and its subfolders, e.g. moved out of the
+        tree """
+        prefix = f'{path}{os.sep}'
+        for wd, dirname in list(self._folders.items()):
+            if dirname == path or dirname.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._folders[wd]
+
+    def read(self, timeout=1.):
+        """ Wait up to `timeout` seconds for changes
+
+        :return: a list of `(kind, path)`, `kind` is `changed` or `deleted`
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        data = b''
+        while True:
+            try:
+                data += os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+        events = []
+        i = 0
+        while i < len(data):
+            wd, mask, _, size = _EVENT.unpack_from(data, i)
+            name = data[i + _EVENT.size:i + _EVENT.size + size].rstrip(b'\0')
+            i += _EVENT.size + size
+            if mask & IN_Q_OVERFLOW:
+                logging.warning('inotify: events lost, rescanning the whole tree')
+                events.append((CHANGED, self._path))
+                continue
+            if mask & IN_IGNORED:
+                self._folders.pop(wd, None)
+                continue
+            dirname = self._folders.get(wd)
+            if dirname is None:
+                continue
+            path = os.path.join(dirname, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch(path)
+                    events.append((CHANGED, path))
+                elif mask & IN_MOVED_FROM:
+                    self._unwatch(path)
+                    events.append((DELETED, path))
+                elif mask & IN_DELETE:
+                    events.append((DELETED, path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                events.append((CHANGED, path))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                events.append((DELETED, path))
+        return events
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher(object):
+    """ Watch a tree for changes scanning it every `interval` seconds and
+    comparing size, modification time and inode of its files with the
+    previous scan. It works everywhere, at the cost of a full scan (without
+    reading the files) for each check.
+
+    :param path: the folder to be watched
+    :param interval: seconds between two scans
+    :param n_walkers: number of folders scanned at the same time
+    """
+
+    def __init__(self, path, interval=5., n_walkers=4):
+        self._path = path
+        self._interval = interval
+        self._n_walkers = n_walkers
+        self._files = self._scan()
+        self._last = monotonic()
+
+    def _scan(self):
+        return {os.path.join(dirname, filename): (st.st_size, st.st_mtime_ns, st.st_ino)
+                for dirname, filename, st in scan_path(self._path, n_threads=self._n_walkers)}
+
+    def read(self, timeout=1.):
+        """ Wait up to `timeout` seconds for changes
+
+        :return: a list of `(kind, path)`, `kind` is `changed` or `deleted`
+        """
+        wait = self._last + self._interval - monotonic()
+        if wait > 0:
+            sleep(min(wait, timeout))
+            if wait > timeout:
+                return []
+        files = self._scan()
+        self._last = monotonic()
+        events = [(CHANGED, path) for path, key in files.items()
+                  if self._files.get(path) != key]
+        events.extend((DELETED, path) for path in self._files if path not in files)
+        self._files = files
+        return events
+
+    def close(self):
+        self._files = {}
+
+
+def watcher(path, interval=None):
+    """ The best watcher available for `path`: inotify on Linux, polling
+    elsewhere or when `interval` is set
+
+    :param path: the folder to be watched
+    :param interval: if set, poll the tree every `interval` seconds
+    """
+    if interval is None and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(path)
+        except Exception as e:
+            logging.warning(f'inotify not available ({e}), polling the tree')
+    return PollingWatcher(path, interval=5. if interval is None else interval)
+
+
+def debounce(watcher, quiet=1., max_delay=10., stop=None):
+    """ Group the changes reported by `watcher` in batches: a batch is
+    emitted once nothing changed for `quiet` seconds, or `max_delay` seconds
+    after its first change during a steady stream of changes. Several changes
+    of the same path in a batch are coalesced in the last one.
+
+    :param watcher: an :class:`InotifyWatcher` or a :class:`PollingWatcher`
+    :param quiet: seconds without changes closing a batch
+    :param max_delay: max seconds a change waits in a batch
+    :param stop: a :class:`threading.Event` ending the watch when set
+    :return: a generator of dicts `{path: kind}`
+    """
+    batch = {}
+    first = None
+    while stop is None or not stop.is_set():
+        events = watcher.read(timeout=quiet if len(batch) > 0 else 1.)
+        now = monotonic()
+        for kind, path in events:
+            batch[path] = kind
+            if first is None:
+                first = now
+        if len(batch) > 0 and (len(events) == 0 or now - first >= max_delay):
+            yield batch
+            batch = {}
+            first = None
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-01-29
+project: elasticizefiles
+"""
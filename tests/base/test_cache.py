@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-06-13
+project: elasticizefiles
+"""
+from elasticizefiles.base.cache import ExtractorCache
+
+
+class Upper(object):
+    version = '1'
+
+    def cache_key(self):
+        return f'Upper:{self.version}'
+
+
+def test_extractor_cache(tmp_path):
+    extractor = Upper()
+    with ExtractorCache(str(tmp_path / 'cache.db')) as cache:
+        assert cache.get('sha', extractor) is None, 'unknown content is cached'
+        cache.put('sha', extractor, {'text': 'A'})
+        assert cache.get('sha', extractor) == {'text': 'A'}, 'pending output not found'
+    with ExtractorCache(str(tmp_path / 'cache.db')) as cache:
+        assert cache.get('sha', extractor) == {'text': 'A'}, 'output not stored'
+        extractor.version = '2'
+        assert cache.get('sha', extractor) is None, 'output of previous version reused'
+        assert (cache.hits, cache.misses) == (1, 1), f'wrong counters {cache.hits} {cache.misses}'
+
+
+def test_extractor_cache_eviction(tmp_path):
+    extractor = Upper()
+    with ExtractorCache(str(tmp_path / 'cache.db'), max_bytes=1000, level=0) as cache:
+        for i in range(10):
+            cache.put(f'sha{i}', extractor, {'text': str(i) * 200})
+            cache.commit()
+        assert cache.get('sha0', extractor) is None, 'least recently used output kept'
+        assert cache.get('sha9', extractor) is not None, 'last output evicted'
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-03-15
+project: elasticizefiles
+"""
+import hashlib
+
+from elasticizefiles.base.context import FileContext
+
+
+def test_file_context(tmp_path):
+    filename = str(tmp_path / 'a.bin')
+    content = bytes(range(256)) * 1000
+    with open(filename, 'wb') as f:
+        f.write(content)
+    with FileContext(filename, chunk_size=1000) as context:
+        assert context.size == len(content), f'{context.size} != {len(content)}'
+        assert context.header(4) == content[:4]
+        hashes = context.hashes('sha256', 'md5')
+        assert hashes['sha256'] == hashlib.sha256(content).hexdigest()
+        assert hashes['md5'] == hashlib.md5(content).hexdigest()
+        assert context.hash('md5') == hashes['md5']
+
+
+def test_file_context_empty(tmp_path):
+    filename = str(tmp_path / 'a.txt')
+    open(filename, 'w').close()
+    with FileContext(filename) as context:
+        assert context.text() == ''
+        assert context.hash('sha256') == hashlib.sha256(b'').hexdigest()
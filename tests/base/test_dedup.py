@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-04-05
+project: elasticizefiles
+"""
+from elasticizefiles.base.dedup import ContentDedup
+
+
+class FakeElastic(object):
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.searches = 0
+
+    def search(self, query, **kwargs):
+        self.searches += 1
+        sha = query['query']['bool']['must']['match']['sha256']
+        hits = [{'_source': {k: v for k, v in d.items() if k in query['_source']}}
+                for d in self.docs if d['sha256'] == sha]
+        return {'hits': {'hits': hits[:kwargs.get('size', 10)]}}
+
+
+def test_dedup_lru():
+    dedup = ContentDedup(max_size=2)
+    dedup.put('a', 'r.x', 1)
+    dedup.put('b', 'r.x', 2)
+    assert dedup.lookup('a', ['r.x', 'r.y']) == {'r.x': 1}
+    dedup.put('c', 'r.x', 3)
+    assert dedup.lookup('b', ['r.x']) == {}, 'b should be evicted'
+    assert dedup.lookup('a', ['r.x']) == {'r.x': 1}
+    assert dedup.hits == 2 and dedup.misses == 2, f'{dedup.hits} {dedup.misses}'
+
+
+def test_dedup_index():
+    es = FakeElastic([{'sha256': 'a', 'r.x': 1, 'r.y': 2}])
+    dedup = ContentDedup(elastic=es)
+    assert dedup.lookup('a', ['r.x']) == {'r.x': 1}
+    assert dedup.lookup('a', ['r.x']) == {'r.x': 1}
+    assert dedup.lookup('b', ['r.x']) == {}
+    assert es.searches == 2, f'{es.searches} != 2'
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-01-29
+project: elasticizefiles
+"""
+import asyncio
+import json
+import time
+
+from elasticizefiles.base.elastic import AsyncElasticBulk
+from elasticizefiles.base.elastic import Elastic
+from elasticizefiles.base.elastic import ElasticBulk
+
+
+class FakeElastic(object):
+
+    def __init__(self, reject=(), throttle=()):
+        self.requests = []
+        self._reject = reject
+        self._throttle = set(throttle)
+
+    def bulk(self, body):
+        lines = body.strip().split('\n')
+        self.requests.append(lines)
+        items = []
+        for action in lines[::2]:
+            _id = json.loads(action)['update']['_id']
+            if _id in self._reject:
+                items.append({'update': {'_id': _id, 'status': 400, 'error': 'rejected'}})
+            elif _id in self._throttle:
+                # rejected once, as an overloaded cluster does
+                self._throttle.remove(_id)
+                items.append({'update': {'_id': _id, 'status': 429, 'error': 'es_rejected_execution_exception'}})
+            else:
+                items.append({'update': {'_id': _id, 'status': 200}})
+        return items
+
+    async def async_bulk(self, body):
+        await asyncio.sleep(0)
+        return self.bulk(body)
+
+
+def test_bulk_flush_on_max_docs():
+    es = FakeElastic()
+    bulk = ElasticBulk(es, max_docs=2)
+    bulk.update(id='a', data={'x': 1})
+    assert len(es.requests) == 0, 'flushed too early'
+    bulk.update(id='b', data={'x': 2})
+    assert len(es.requests) == 1, f'{len(es.requests)} != 1'
+    source = json.loads(es.requests[0][1])
+    assert source == {'doc': {'x': 1}, 'doc_as_upsert': True}, f'{source}'
+    assert bulk.sent == 2, f'{bulk.sent} != 2'
+
+
+def test_bulk_flush_on_max_bytes():
+    es = FakeElastic()
+    bulk = ElasticBulk(es, max_bytes=10)
+    bulk.update(id='a', data={'x': 'a long enough value'})
+    assert len(es.requests) == 1, f'{len(es.requests)} != 1'
+
+
+def test_bulk_flush_on_max_seconds():
+    es = FakeElastic()
+    bulk = ElasticBulk(es, max_seconds=0.05)
+    bulk.update(id='a', data={'x': 1})
+    # no other action is added
+    for _ in range(100):
+        if len(es.requests) > 0:
+            break
+        time.sleep(0.05)
+    assert len(es.requests) == 1, 'old actions not flushed by the timer'
+    assert bulk.sent == 1, f'{bulk.sent} != 1'
+    bulk.close()
+    assert bulk._timer is None, 'timer not stopped'
+    bulk.update(id='b', data={'x': 2})
+    bulk.close()
+    assert len(es.requests) == 2 and bulk.sent == 2, f'{es.requests}'
+
+
+def test_async_bulk_flush_on_max_seconds():
+    async def run(bulk):
+        await bulk.update(id='a', data={'x': 1})
+        for _ in range(100):
+            if len(es.requests) > 0:
+                break
+            await asyncio.sleep(0.05)
+        await bulk.close()
+
+    es = FakeElastic()
+    bulk = AsyncElasticBulk(es, max_seconds=0.05)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(run(bulk))
+    loop.close()
+    assert len(es.requests) == 1, 'old actions not flushed by the timer'
+    assert bulk._timer is None, 'timer not stopped'
+
+
+def test_bulk_failures():
+    failures = []
+    es = FakeElastic(reject=('b', ))
+    with ElasticBulk(es, on_failure=lambda i, e: failures.append(i)) as bulk:
+        bulk.update(id='a', data={})
+        bulk.update(id='b', data={})
+    assert failures == ['b'], f'{failures} != [b]'
+    assert bulk.failed == 1, f'{bulk.failed} != 1'
+
+
+def test_async_bulk():
+    async def run(bulk):
+        await asyncio.gather(*[bulk.update(id=str(i), data={'x': i}) for i in range(10)])
+        await bulk.close()
+
+    es = FakeElastic(reject=('3', ))
+    bulk = AsyncElasticBulk(es, max_requests=2, max_docs=4)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(run(bulk))
+    loop.close()
+    assert [len(r) // 2 for r in es.requests] == [4, 4, 2], f'{es.requests}'
+    assert bulk.sent == 9 and bulk.failed == 1, f'{bulk.sent} {bulk.failed}'
+
+
+def test_bulk_retry():
+    es = FakeElastic(reject=('c', ), throttle=('b', ))
+    with ElasticBulk(es, backoff=0.001) as bulk:
+        for i in 'abcd':
+            bulk.update(id=i, data={})
+    assert [len(r) // 2 for r in es.requests] == [4, 1], f'{es.requests}'
+    assert bulk.sent == 3 and bulk.failed == 1, f'{bulk.sent} {bulk.failed}'
+    assert bulk.retried == 1, f'{bulk.retried} != 1'
+    assert bulk._docs.value < 500, 'batch size not decreased'
+
+
+def test_bulk_in_flight():
+    ids = []
+    es = FakeElastic()
+    bulk = ElasticBulk(es, max_docs=10, max_requests=4,
+                       on_success=lambda i: ids.extend(i))
+    for i in range(100):
+        bulk.update(id=str(i), data={'x': i})
+    bulk.close()
+    assert sorted(ids) == sorted(str(i) for i in range(100)), f'{ids}'
+    assert len(es.requests) == 10, f'{len(es.requests)} != 10'
+    assert bulk._requests.value == 4, f'{bulk._requests.value} != 4'
+
+
+class FakeClient(object):
+    """ The scroll API of an index of `n` documents """
+
+    def __init__(self, n):
+        self._docs = [{'_id': str(i), '_source': {'x': i, 'y': 'y'}} for i in range(n)]
+        self.scrolls = {}
+        self.cleared = []
+
+    def _page(self, sid):
+        docs, size = self.scrolls[sid]
+        self.scrolls[sid] = (docs[size:], size)
+        return {'_scroll_id': sid, 'hits': {'total': {'value': len(docs)}, 'hits': docs[:size]}}
+
+    def search(self, body, size, **kwargs):
+        docs = self._docs
+        if 'slice' in body:
+            docs = [d for d in docs if int(d['_id']) % body['slice']['max'] == body['slice']['id']]
+        if '_source' in body:
+            docs = [dict(d, _source={k: d['_source'][k] for k in body['_source']}) for d in docs]
+        sid = str(len(self.scrolls))
+        self.scrolls[sid] = (docs, size)
+        return self._page(sid)
+
+    def scroll(self, scroll_id, scroll):
+        return self._page(scroll_id)
+
+    def clear_scroll(self, scroll_id):
+        self.cleared.append(scroll_id)
+
+
+def test_iterate_data_sliced():
+    es = Elastic(['localhost:9200'], 'index', 'doc')
+    es._es = FakeClient(1000)
+    docs = list(es.iterate_data({}, page_size=30, slices=4, source=['x']))
+    assert sorted(d['x'] for d in docs) == list(range(1000)), 'documents lost'
+    assert docs[0] == {'x': docs[0]['x']}, f'{docs[0]} is not filtered'
+    assert sorted(es._es.cleared) == ['0', '1', '2', '3'], f'{es._es.cleared}'
+    # a consumer stopping early clears the scroll anyway
+    es._es = FakeClient(1000)
+    assert len(es.get_data({}, limit=10, page_size=100)) == 10
+    assert es._es.cleared == ['0'], f'{es._es.cleared}'
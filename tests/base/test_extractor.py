@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-06-27
+project: elasticizefiles
+"""
+from elasticizefiles.base import Extractor
+from elasticizefiles.base import FileContext
+
+
+class Size(Extractor):
+
+    def extract(self, filename):
+        with FileContext(filename) as context:
+            return {'size': context.size}
+
+    def mapping(self):
+        return None
+
+
+def test_extract_batch(tmp_path):
+    filenames = []
+    for i in range(3):
+        filename = str(tmp_path / f'{i}.txt')
+        with open(filename, 'w') as f:
+            f.write('a' * i)
+        filenames.append(filename)
+    extractor = Size()
+    extractor.setup()
+    contexts = [FileContext(filename) for filename in filenames]
+    r = extractor.extract_context_batch(contexts)
+    assert r == [{'size': 0}, {'size': 1}, {'size': 2}], f'wrong outputs {r}'
+    extractor.teardown()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-03-08
+project: elasticizefiles
+"""
+import re
+
+from elasticizefiles.base.matcher import RuleMatcher
+from elasticizefiles.base.matcher import literal_suffix
+
+RULES = {
+    'text': {'pattern': [r'.*\.txt$', r'.*\.log$'], 'extractor': [{'a': 'A'}]},
+    'image': {'pattern': [r'(?i).*\.jpe?g$', r'.*\.png$'], 'extractor': [{'b': 'B'}, {'c': 'C'}]},
+    'make': {'pattern': [r'.*/Makefile$'], 'extractor': [{'d': 'D'}]},
+    'any': {'pattern': [r'.*/data/.*'], 'extractor': [{'e': 'E'}]},
+    'config': {'pattern': [r'.*/\.git/config$', r'.*\.d/conf$'], 'extractor': [{'f': 'F'}]},
+}
+
+PATHS = [
+    '/a/b.txt', '/a/b.TXT', '/a/data/b.txt', '/a/b.log', '/a/b.JPG', '/a/b.jpeg',
+    '/a/b.png', '/a/Makefile', '/a/data/Makefile', '/a/b', '/a.b/c', '/a/b.txt.gz',
+    '/a/.git/config', '/a/.git/config.txt', '/etc/x.d/conf', '/etc/x.d/conf.log', '/a/d/conf',
+]
+
+
+def naive(rules, filename):
+    return tuple(n for n, r in rules.items() if any(re.match(p, filename) for p in r['pattern']))
+
+
+def test_literal_suffix():
+    assert literal_suffix(r'.*\.txt$') == '.txt'
+    assert literal_suffix(r'.*/Makefile$') == '/Makefile'
+    assert literal_suffix(r'.*\.jpe?g$') == 'g'
+    assert literal_suffix(r'.*\.(txt|log)$') == ''
+    assert literal_suffix(r'.*\d$') == ''
+    assert literal_suffix(r'.*\.txt') == ''
+
+
+def test_rule_matcher():
+    matcher = RuleMatcher(RULES)
+    for path in PATHS:
+        assert matcher.match(path) == naive(RULES, path), f'{path} mismatch'
+    assert matcher.stats['files'] == len(PATHS)
+    assert matcher.hits['text'] == 5, f"{matcher.hits['text']} != 5"
+    assert matcher.hits['config'] == 2, f"{matcher.hits['config']} != 2"
+
+
+def test_rule_matcher_extractors():
+    matcher = RuleMatcher(RULES)
+    assert matcher.extractors('/a/data/b.png') == [('image.b', 'B'), ('image.c', 'C'), ('any.e', 'E')]
+    assert matcher.extractors('/a/b') == []
+
+
+def test_rule_matcher_plans():
+    matcher = RuleMatcher(RULES)
+    plan = matcher.plan('/a/b.png')
+    assert plan > 0 and matcher.plan('/c/d.png') == plan, 'plan not shared'
+    assert matcher.plans[plan] == [('image.b', 'B'), ('image.c', 'C')]
+    assert matcher.plan('/a/b') == 0 and matcher.plans[0] == [], 'unmatched file has a plan'
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-06-06
+project: elasticizefiles
+"""
+from hashlib import sha256
+
+from elasticizefiles.base.seen import BloomFilter
+from elasticizefiles.base.seen import SeenIds
+
+
+def ids(start, stop):
+    return [sha256(str(i).encode()).hexdigest() for i in range(start, stop)]
+
+
+def test_seen_ids():
+    seen = SeenIds(run_size=100)
+    for i in ids(0, 1000) + ['not-a-digest']:
+        seen.add(i)
+    assert len(seen) == 1001, f'{len(seen)} != 1001'
+    assert all(i in seen for i in ids(0, 1000)), 'an id added is missing'
+    assert 'not-a-digest' in seen
+    assert not any(i in seen for i in ids(1000, 2000)), 'an id not added is found'
+    chunk = f'{ids(0, 1)[0]}-text-0'
+    assert chunk not in seen, 'the id of a chunk is the id of its file'
+    seen.add(chunk)
+    assert chunk in seen and f'{ids(0, 1)[0]}-text-1' not in seen
+
+
+def test_bloom_filter():
+    seen = BloomFilter(1000, error_rate=0.01)
+    for i in ids(0, 1000):
+        seen.add(i)
+    assert all(i in seen for i in ids(0, 1000)), 'an id added is missing'
+    false_positives = sum(i in seen for i in ids(1000, 11000))
+    assert false_positives < 300, f'{false_positives} false positives'
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-16
+project: elasticizefiles
+"""
+import gzip
+import json
+import os
+
+import pytest
+
+from elasticizefiles.base.sink import NdjsonSink
+from elasticizefiles.base.sink import Shipper
+from elasticizefiles.base.sink import SpoolSink
+
+
+class FakeElastic(object):
+
+    def __init__(self, fail_after=None):
+        self.ids = []
+        self._fail_after = fail_after
+
+    def bulk(self, body):
+        if self._fail_after is not None and len(self.ids) >= self._fail_after:
+            raise Exception('connection refused')
+        lines = body.decode().strip().split('\n')
+        items = []
+        for action in lines[::2]:
+            _id = json.loads(action)['update']['_id']
+            self.ids.append(_id)
+            items.append({'update': {'_id': _id, 'status': 200}})
+        return items
+
+
+def test_ndjson_sink(tmp_path):
+    filename = str(tmp_path / 'docs.ndjson.gz')
+    written = []
+    with NdjsonSink(filename, max_docs=2, on_success=written.extend) as sink:
+        for i in range(3):
+            sink.update(id=str(i), data={'x': i})
+        assert written == ['0', '1'], f'{written}'
+    assert written == ['0', '1', '2'], f'{written}'
+    with gzip.open(filename) as f:
+        lines = f.read().decode().strip().split('\n')
+    assert len(lines) == 6, f'{len(lines)} != 6'
+    assert json.loads(lines[1]) == {'doc': {'x': 0}, 'doc_as_upsert': True}, lines[1]
+
+
+def test_spool_recovery(tmp_path):
+    directory = str(tmp_path / 'spool')
+    sink = SpoolSink(directory, max_docs=2)
+    for i in range(3):
+        sink.update(id=str(i), data={'x': i})
+    sink.flush()
+    # a crash in the middle of a write
+    sink._file.write(b'{"update": {"_id": "3"}}\n{"doc"')
+    sink._file.flush()
+    sink = SpoolSink(directory)
+    assert SpoolSink.segments(directory) == ['0000000000.ndjson'], os.listdir(directory)
+    sink.update(id='4', data={})
+    sink.close()
+    es = FakeElastic()
+    assert Shipper(directory, es).ship() == 4
+    assert es.ids == ['0', '1', '2', '4'], f'{es.ids}'
+    assert SpoolSink.segments(directory) == [], 'shipped segments are kept'
+
+
+def test_shipper_resume(tmp_path):
+    directory = str(tmp_path / 'spool')
+    with SpoolSink(directory, segment_size=100) as sink:
+        for i in range(10):
+            sink.update(id=str(i), data={'x': i})
+    es = FakeElastic(fail_after=4)
+    with pytest.raises(Exception):
+        Shipper(directory, es, max_docs=2).ship()
+    es._fail_after = None
+    Shipper(directory, es, max_docs=2).ship()
+    assert es.ids == [str(i) for i in range(10)], f'{es.ids}'
+    with SpoolSink(directory) as sink:
+        sink.update(id='10', data={})
+    Shipper(directory, es).ship()
+    assert es.ids[-1] == '10', f'{es.ids}'
+
+
+def test_spool_delete(tmp_path):
+    directory = str(tmp_path / 'spool')
+    with SpoolSink(directory) as sink:
+        sink.update(id='a', data={})
+        sink.delete(id='a')
+        sink.update(id='b', data={})
+    lines = []
+    es = FakeElastic()
+    es.bulk = lambda body: lines.extend(body.decode().strip().split('\n')) or [{'update': {}}] * 3
+    assert Shipper(directory, es).ship() == 3
+    assert json.loads(lines[2]) == {'delete': {'_id': 'a'}}, f'{lines}'
+
+
+class ThrottledElastic(FakeElastic):
+    """ Answer with the next status of each id, the last one repeated """
+
+    def __init__(self, statuses):
+        FakeElastic.__init__(self)
+        self._statuses = statuses
+
+    def bulk(self, body):
+        items = []
+        for action in body.decode().strip().split('\n')[::2]:
+            _id = json.loads(action)['update']['_id']
+            statuses = self._statuses.get(_id, [200])
+            status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+            if status == 200:
+                self.ids.append(_id)
+                items.append({'update': {'_id': _id, 'status': status}})
+            else:
+                items.append({'update': {'_id': _id, 'status': status, 'error': 'rejected'}})
+        return items
+
+
+def test_shipper_retry(tmp_path):
+    directory = str(tmp_path / 'spool')
+    with SpoolSink(directory) as sink:
+        for i in range(4):
+            sink.update(id=str(i), data={'x': i})
+    es = ThrottledElastic({'1': [429, 503, 200], '2': [400], '3': [429]})
+    shipper = Shipper(directory, es, max_retries=3, backoff=0.)
+    assert shipper.ship() == 4
+    assert es.ids == ['0', '1'], f'{es.ids}'
+    with open(os.path.join(directory, 'rejected.ndjson')) as f:
+        rejected = [json.loads(line)['update']['_id'] for line in f.read().strip().split('\n')[::2]]
+    assert rejected == ['2', '3'], f'throttled actions rejected {rejected}'
+    assert (shipper.sent, shipper.failed) == (2, 2), f'{shipper.sent}, {shipper.failed}'
+
+
+class UnavailableElastic(FakeElastic):
+    """ Fail the first `n` requests with a 503 """
+
+    def __init__(self, n):
+        FakeElastic.__init__(self)
+        self._n = n
+
+    def bulk(self, body):
+        from elasticsearch.exceptions import TransportError
+
+        if self._n > 0:
+            self._n -= 1
+            raise TransportError(503, 'unavailable_shards_exception', {})
+        return FakeElastic.bulk(self, body)
+
+
+def test_shipper_retry_request(tmp_path):
+    directory = str(tmp_path / 'spool')
+    with SpoolSink(directory) as sink:
+        for i in range(4):
+            sink.update(id=str(i), data={'x': i})
+    es = UnavailableElastic(1)
+    shipper = Shipper(directory, es, max_retries=3, backoff=0.)
+    assert shipper.ship() == 4
+    assert es.ids == [str(i) for i in range(4)], f'{es.ids}'
+    assert (shipper.sent, shipper.failed) == (4, 0), f'{shipper.sent}, {shipper.failed}'
+    with SpoolSink(directory) as sink:
+        sink.update(id='4', data={})
+    # still unavailable after max_retries, the actions stay in the spool
+    es = UnavailableElastic(4)
+    with pytest.raises(Exception):
+        Shipper(directory, es, max_retries=3, backoff=0.).ship()
+    es._n = 0
+    assert Shipper(directory, es).ship() == 1
+    assert es.ids == ['4'], f'{es.ids}'
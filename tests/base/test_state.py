@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-03-01
+project: elasticizefiles
+"""
+import os
+
+from elasticizefiles.base.state import FileState
+
+
+def test_file_state(tmp_path):
+    filename = str(tmp_path / 'a.txt')
+    with open(filename, 'w') as f:
+        f.write('a')
+    st = os.stat(filename)
+    with FileState(str(tmp_path / 'state.db')) as state:
+        assert state.unchanged([filename], [st], ['p']) == set(), 'unknown file is unchanged'
+        state.stage('id1', filename, st, 'sha', 'p')
+        state.confirm(['id1'])
+        state.commit()
+        assert state.unchanged([filename], [st], ['p']) == {filename}, 'file is changed'
+        assert state.unchanged([filename], [st], ['q']) == set(), 'plan is ignored'
+    with open(filename, 'w') as f:
+        f.write('ab')
+    with FileState(str(tmp_path / 'state.db')) as state:
+        assert state.unchanged([filename], [os.stat(filename)], ['p']) == set(), 'file is unchanged'
+
+
+def test_file_state_discard(tmp_path):
+    filename = str(tmp_path / 'a.txt')
+    open(filename, 'w').close()
+    st = os.stat(filename)
+    with FileState(str(tmp_path / 'state.db')) as state:
+        state.stage('id1', filename, st, 'sha', 'p')
+        state.discard('id1')
+        state.confirm(['id1'])
+        state.commit()
+        assert state.lookup([filename]) == {}, 'discarded file is stored'
+
+
+def test_file_state_folders(tmp_path):
+    st = os.stat(str(tmp_path))
+    with FileState(str(tmp_path / 'state.db')) as state:
+        for i, path in enumerate(['/d/a', '/d/a/b', '/d/a0', '/d/ab/c']):
+            state.stage(str(i), path, st, 'sha', 'p')
+        state.confirm(['0', '1', '2', '3'])
+        state.commit()
+        assert sorted(state.indexed(['/d/a'])) == [('/d/a', '0'), ('/d/a/b', '1')]
+        state.remove(['/d/a'])
+        assert sorted(state.lookup(['/d/a', '/d/a/b', '/d/a0', '/d/ab/c'])) == ['/d/a0', '/d/ab/c']
+
+
+def test_file_state_chunks(tmp_path):
+    st = os.stat(str(tmp_path))
+    with FileState(str(tmp_path / 'state.db')) as state:
+        state.stage('0', '/d/a', st, 'sha', 'p', chunks={'text.text': 3})
+        state.stage('1', '/d/b', st, 'sha', 'p')
+        state.confirm(['0', '1'])
+        state.commit()
+        assert state.chunks(['0', '1']) == {'0': {'text.text': 3}}, f"{state.chunks(['0', '1'])}"
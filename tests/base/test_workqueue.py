@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-23
+project: elasticizefiles
+"""
+import os
+
+from elasticizefiles.base.workqueue import WorkQueue
+from elasticizefiles.distributed import plan_units
+
+
+def test_work_queue_leases(tmp_path):
+    with WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=60, max_attempts=2) as queue:
+        queue.add([('/a', True, 10), ('/b', False, 100)])
+        unit = queue.lease('w1')
+        assert unit[1:] == ('/b', False), f'{unit} is not the biggest'
+        assert queue.renew(unit[0], 'w1'), 'lease not renewed'
+        assert not queue.renew(unit[0], 'w2'), 'lease renewed by another worker'
+        assert queue.complete(unit[0], 'w1', files=100), 'unit not completed'
+        dead = queue.lease('w2')
+        assert dead[1] == '/a', f'{dead}'
+        assert queue.lease('w3') is None, 'a leased unit is handed out'
+        # the lease of the dead worker expires
+        queue._lease_seconds = -1
+        queue._db.execute('UPDATE units SET lease_until = 0 WHERE id = ?', (dead[0], ))
+        assert queue.lease('w3')[0] == dead[0], 'unit not reassigned'
+        assert not queue.renew(dead[0], 'w2'), 'a dead worker keeps its lease'
+        assert not queue.complete(dead[0], 'w2', files=1), 'a dead worker completes a unit'
+        assert queue.lease('w4') is None, 'a unit is tried more than max_attempts'
+        assert queue.progress() == {'done': (1, 100), 'failed': (1, 0)}, f'{queue.progress()}'
+        assert queue.finished()
+
+
+def test_work_queue_shared(tmp_path):
+    filename = str(tmp_path / 'queue.db')
+    WorkQueue(filename).close()
+    with WorkQueue(filename, shared=True) as queue:
+        mode = queue._db.execute('PRAGMA journal_mode').fetchone()[0]
+        assert mode == 'delete', f'{mode} journal on a shared queue'
+
+
+def test_plan_units(tmp_path):
+    for i in range(4):
+        os.makedirs(str(tmp_path / f'd{i}' / 'sub'))
+        for j in range(5):
+            open(str(tmp_path / f'd{i}' / 'sub' / f'{j}.txt'), 'w').close()
+    open(str(tmp_path / 'top.txt'), 'w').close()
+    units = plan_units([str(tmp_path)], unit_size=3)
+    assert (str(tmp_path), False, 1) in units, f'{units}'
+    assert len([u for u in units if u[1]]) == 4, f'{units}'
+    assert plan_units([str(tmp_path)], unit_size=100) == [(str(tmp_path), True, 5)]
+
+
+def test_work_queue_namespace(tmp_path):
+    with WorkQueue(str(tmp_path / 'queue.db')) as queue:
+        with WorkQueue(str(tmp_path / 'queue.db')) as other:
+            assert queue.namespace == other.namespace, 'namespace not shared'
+        with WorkQueue(str(tmp_path / 'other.db')) as other:
+            assert queue.namespace != other.namespace, 'namespace not random'
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-06-20
+project: elasticizefiles
+"""
+from elasticizefiles.base import Extractor
+from elasticizefiles.engine import ElasticizeEngine
+from elasticizefiles.extractors.text import ExtractText
+
+
+def test_extract_text_truncated(tmp_path):
+    filename = str(tmp_path / 'a.log')
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('àbc' * 1000)
+    r = ExtractText(chunk_size=100).extract(filename)
+    assert r == {'text': 'àbc' * 1000, 'truncated': False}, 'wrong text'
+    r = ExtractText(chunk_size=100, max_chars=250).extract(filename)
+    assert r['text'] == ('àbc' * 1000)[:250] and r['truncated'], 'text not truncated'
+    r = ExtractText(chunk_size=100, max_chars=250, index_chunks=True).extract(filename)
+    assert sum(len(c['text']) for c in r[Extractor.CHUNKS]) == 250 and r['truncated'], 'chunks not truncated'
+    assert ExtractText().extract(filename)['truncated'] is False
+    assert ExtractText()._max_chars == ExtractText.MAX_CHARS, 'text not capped by default'
+
+
+def test_extract_text_chunks(tmp_path):
+    filename = str(tmp_path / 'a.txt')
+    with open(filename, 'w') as f:
+        f.write('x' * 250)
+    r = ExtractText(chunk_size=100, index_chunks=True).extract(filename)
+    assert [len(c['text']) for c in r[Extractor.CHUNKS]] == [100, 100, 50], 'wrong chunks'
+    doc = {'file_id': 'f', 'scan_datetime': '', 'scan_timestamp': 0, 'sha256': 's',
+           'filename': filename, 'machine_info': {}, 'text': r}
+    parent, children = ElasticizeEngine._split_chunks(doc)
+    assert parent['text'] == {'chunks': 3, 'truncated': False}, f'wrong parent {parent}'
+    assert Extractor.CHUNKS in doc['text'], 'output changed'
+    assert [c['file_id'] for c in children] == ['f-text-0', 'f-text-1', 'f-text-2']
+    assert all(c['parent_id'] == 'f' for c in children), 'children not linked'
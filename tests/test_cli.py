@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-07-04
+project: elasticizefiles
+"""
+import json
+import subprocess
+import sys
+
+from elasticizefiles.cli import accepted
+from elasticizefiles.cli import load_config
+from elasticizefiles.cli import load_rules
+from elasticizefiles.extractors.text import ExtractText
+
+
+def test_load_rules(tmp_path):
+    filename = str(tmp_path / 'config.json')
+    with open(filename, 'w') as f:
+        json.dump({'rules': {'text': {
+            'pattern': [r'.*\.txt$'],
+            'extractor': [
+                {'sha': 'elasticizefiles.extractors.simple.ExtractSha256'},
+                {'text': {'class': 'elasticizefiles.extractors.text.ExtractText',
+                          'params': {'max_chars': 10}}},
+            ]}}}, f)
+    rules = load_rules(load_config(filename)['rules'])
+    extractors = rules['text']['extractor']
+    assert type(extractors[0]['sha']).__name__ == 'ExtractSha256', f'wrong extractor {extractors[0]}'
+    assert isinstance(extractors[1]['text'], ExtractText), f'wrong extractor {extractors[1]}'
+    assert extractors[1]['text']._max_chars == 10, 'params not applied'
+
+
+def test_lazy_imports():
+    code = 'import sys, elasticizefiles.cli, elasticizefiles.engine; print("elasticsearch" in sys.modules)'
+    out = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE,
+                         universal_newlines=True, check=True).stdout
+    assert out.strip() == 'False', 'elasticsearch imported at startup'
+
+
+def test_version():
+    # a plain attribute, module `__getattr__` needs python 3.7
+    import elasticizefiles
+
+    assert isinstance(vars(elasticizefiles).get('__version__'), str), 'no __version__'
+
+
+def test_accepted():
+
+    def watch(n_jobs=-1, crawl=True):
+        return n_jobs, crawl
+
+    kwargs = accepted(watch, {'n_jobs': 2, 'reconcile': True, 'path': '/data'})
+    assert kwargs == {'n_jobs': 2}, f'{kwargs}'
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-23
+project: elasticizefiles
+"""
+import os
+
+from elasticizefiles.base.workqueue import WorkQueue
+from elasticizefiles.distributed import ScanWorker
+from test_engine import FakeElastic
+from test_engine import MemorySink
+from test_engine import make_engine
+from test_engine import make_tree
+
+
+def test_worker_release(tmp_path):
+    root = make_tree(tmp_path / 'root')
+    sink = MemorySink()
+    workers = []
+    for host in ['00:00:00:00:00:01', '00:00:00:00:00:02']:
+        engine = make_engine(root, sink)
+        engine._machine_info = dict(engine._machine_info, mac_address=host)
+        engine._es = FakeElastic(sink)
+        queue = WorkQueue(str(tmp_path / 'queue.db'))
+        workers.append(ScanWorker(queue, engine, name=host, n_jobs=2, n_processes=0, reconcile=True))
+    queue.add([(f'{root}/a', True, 5)])
+    assert workers[0].run() == 1, 'unit not processed'
+    # the unit is handed out again, to the other host
+    queue._db.execute("UPDATE units SET status = 'pending'")
+    os.remove(f'{root}/a/1.txt')
+    assert workers[1].run() == 1, 'unit not processed'
+    assert len(sink.docs) == 4, f'{len(sink.docs)} != 4, documents duplicated across hosts'
+    assert sink.filenames() == [f'{root}/a/{i}.txt' for i in [0, 2, 3, 4]], f'{sink.filenames()}'
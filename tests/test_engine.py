@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-07-11
+project: elasticizefiles
+"""
+import json
+import os
+import sys
+from threading import Thread
+
+from elasticizefiles.base import Extractor
+from elasticizefiles.base import FileContext
+from elasticizefiles.base import Sink
+from elasticizefiles.async_engine import AsyncElasticizeEngine
+from elasticizefiles.engine import ElasticizeEngine
+from elasticizefiles.extractors.metadata import ExtractExif
+from elasticizefiles.extractors.simple import ExtractSha256
+from elasticizefiles.extractors.text import ExtractText
+from elasticizefiles.utils.profiling import Profiler
+from elasticizefiles.utils.watch import CHANGED
+from elasticizefiles.utils.watch import DELETED
+
+
+class MemorySink(Sink):
+    """ A sink keeping the documents in a dict, as an index would """
+
+    def __init__(self, fail=(), **kwargs):
+        Sink.__init__(self, **kwargs)
+        self.docs = {}
+        self._fail = set(fail)
+        self._pending = []
+
+    def update(self, id, data, upsert=True):
+        self._pending.append((id, data))
+
+    def delete(self, id):
+        self._pending.append((id, None))
+
+    def flush(self):
+        pending = self._pending
+        self._pending = []
+        written = []
+        failures = []
+        for id, data in pending:
+            if data is not None and data['filename'] in self._fail:
+                failures.append((id, 'rejected'))
+                self.failed += 1
+                if self._on_failure is not None:
+                    self._on_failure(id, 'rejected')
+                continue
+            if data is None:
+                self.docs.pop(id, None)
+            else:
+                self.docs.setdefault(id, {}).update(data)
+            written.append(id)
+        self.sent += len(written)
+        if self._on_success is not None and len(written) > 0:
+            self._on_success(written)
+        return failures
+
+    def filenames(self):
+        return sorted(d['filename'] for d in self.docs.values() if 'parent_id' not in d)
+
+
+class FakeElastic(object):
+    """ Search the documents of a :class:`MemorySink` """
+
+    def __init__(self, sink):
+        self._sink = sink
+
+    def iterate_data(self, query, raw=False, **kwargs):
+        owner, prefix = query['query']['bool']['filter']
+        prefix = prefix['prefix']['filename.keywords']
+        for id, doc in list(self._sink.docs.items()):
+            if 'term' in owner:
+                mine = doc.get('namespace') == owner['term']['namespace']
+            else:
+                mine = doc['machine_info']['mac_address'] == owner['match_phrase']['machine_info.mac_address']
+            if mine and doc['filename'].startswith(prefix):
+                yield {'_id': id, '_source': {'filename': doc['filename']}}
+
+    def close(self):
+        pass
+
+    async def async_close(self):
+        pass
+
+
+class Size(Extractor):
+
+    def __init__(self, batch_size=1):
+        Extractor.__init__(self)
+        self.batch_size = batch_size
+        self.calls = []
+
+    def extract(self, filename):
+        return self.extract_batch([filename])[0]
+
+    def extract_batch(self, filenames):
+        self.calls.append(len(filenames))
+        r = []
+        for filename in filenames:
+            with FileContext(filename) as context:
+                r.append({'size': context.size})
+        return r
+
+    def mapping(self):
+        return {'size': {'type': 'long'}}
+
+
+def make_tree(root, n=5):
+    os.makedirs(os.path.join(root, 'a'))
+    for i in range(n):
+        with open(os.path.join(root, 'a', f'{i}.txt'), 'w') as f:
+            f.write('x' * i)
+    with open(os.path.join(root, 'skip.bin'), 'w') as f:
+        f.write('skipped')
+    return str(root).replace('\\', '/')
+
+
+def make_engine(root, sink, extractor=None, engine=ElasticizeEngine, **kwargs):
+    rules = {'text': {'pattern': [r'.*\.txt$'],
+                      'extractor': [{'sha': ExtractSha256()}, {'size': extractor or Size()}]}}
+    return engine(root, rules, None, None, '_doc', sink=sink, **kwargs)
+
+
+def test_crawl(tmp_path):
+    root = make_tree(tmp_path)
+    sink = MemorySink()
+    engine = make_engine(root, sink)
+    assert engine.crawl_and_process(n_jobs=2, n_processes=0) == 5
+    assert sink.filenames() == [f'{root}/a/{i}.txt' for i in range(5)], f'{sink.filenames()}'
+    doc = next(d for d in sink.docs.values() if d['filename'].endswith('/3.txt'))
+    assert doc['text.size'] == {'size': 3}, f"{doc['text.size']}"
+    assert len(doc['text.sha']['sha256']) == 64, 'sha256 not extracted'
+
+
+def test_crawl_state(tmp_path):
+    root = make_tree(tmp_path / 'root')
+    sink = MemorySink()
+    size = Size()
+    engine = make_engine(root, sink, size, state_file=str(tmp_path / 'state.db'))
+    engine.crawl_and_process(n_jobs=2, n_processes=0)
+    assert engine.crawl_and_process(n_jobs=2, n_processes=0) == 0, 'unchanged files processed'
+    with open(f'{root}/a/1.txt', 'w') as f:
+        f.write('changed')
+    assert engine.crawl_and_process(n_jobs=2, n_processes=0) == 1, 'modified file skipped'
+    assert sum(size.calls) == 6, f'{size.calls}'
+
+
+def test_crawl_dedup(tmp_path):
+    root = make_tree(tmp_path)
+    for name in ['b.txt', 'c.txt']:
+        with open(f'{root}/a/{name}', 'w') as f:
+            f.write('x' * 4)
+    sink = MemorySink()
+    size = Size()
+    engine = make_engine(root, sink, size, dedup=True, dedup_lookup_index=False)
+    engine.crawl_and_process(n_jobs=1, n_processes=0)
+    assert len(sink.docs) == 7, f'{len(sink.docs)} != 7'
+    assert sum(size.calls) == 5, f'same contents extracted again {size.calls}'
+
+
+def test_crawl_batch(tmp_path):
+    root = make_tree(tmp_path, n=10)
+    sink = MemorySink()
+    size = Size(batch_size=4)
+    engine = make_engine(root, sink, size)
+    assert engine.crawl_and_process(n_jobs=1, n_processes=0) == 10
+    assert max(size.calls) > 1, f'files not batched {size.calls}'
+    assert len(sink.docs) == 10, f'{len(sink.docs)} != 10'
+
+
+def test_crawl_batch_in_flight_bytes(tmp_path):
+    root = make_tree(tmp_path, n=10)
+    sink = MemorySink()
+    size = Size(batch_size=4)
+    # a batch of documents is larger than the cap
+    engine = make_engine(root, sink, size, max_in_flight_bytes=3000)
+    t = Thread(target=engine.crawl_and_process, kwargs={'n_jobs': 2, 'n_processes': 0}, daemon=True)
+    t.start()
+    t.join(timeout=30)
+    assert not t.is_alive(), 'crawl blocked by max_in_flight_bytes'
+    assert len(sink.docs) == 10, f'{len(sink.docs)} != 10'
+    assert engine._in_flight.bytes == 0 and engine._in_flight.items == 0, 'in flight not released'
+
+
+def test_crawl_profiler(tmp_path, monkeypatch):
+    root = make_tree(tmp_path)
+    for profiler in [None, Profiler()]:
+        sink = MemorySink()
+        engine = make_engine(root, sink)
+        assert engine.crawl_and_process(n_jobs=2, n_processes=0, profiler=profiler) == 5
+        assert len(sink.docs) == 5, f'{len(sink.docs)} != 5 with profiler {profiler}'
+    assert 'hash' in profiler.slowest(), f'{profiler.slowest()}'
+    assert profiler.stats() is not None, 'nothing profiled'
+
+    def enable(self):
+        # python 3.12 allows a single active cProfile
+        raise ValueError('Another profiling tool is already active')
+
+    monkeypatch.setattr('cProfile.Profile.enable', enable)
+    sink = MemorySink()
+    engine = make_engine(root, sink)
+    assert engine.crawl_and_process(n_jobs=2, n_processes=0, profiler=Profiler()) == 5
+    assert len(sink.docs) == 5, 'files lost when cProfile can not be enabled'
+
+
+def test_crawl_batch_profiler(tmp_path):
+    root = make_tree(tmp_path / 'root', n=10)
+    sink = MemorySink()
+    engine = make_engine(root, sink, Size(batch_size=4))
+    profiler = Profiler()
+    assert engine.crawl_and_process(n_jobs=2, n_processes=0, profiler=profiler) == 10
+    slowest = profiler.slowest()
+    for name in ['extract.text.sha', 'extract.text.size']:
+        assert len(slowest.get(name, [])) == 10, f'{name} not recorded: {list(slowest)}'
+    profiler.save_trace(str(tmp_path / 'trace.json'))
+    with open(str(tmp_path / 'trace.json')) as f:
+        names = {e['name'] for e in json.load(f)['traceEvents']}
+    assert {'extract.text.sha', 'extract.text.size'} <= names, f'{names}'
+
+
+def test_crawl_setup_failure(tmp_path, monkeypatch):
+    root = make_tree(tmp_path)
+    with open(f'{root}/a/photo.jpg', 'w') as f:
+        f.write('not a jpeg')
+    # as if `hachoir` was not installed
+    monkeypatch.setitem(sys.modules, 'hachoir', None)
+    rules = {'text': {'pattern': [r'.*\.txt$'], 'extractor': [{'size': Size()}]},
+             'image': {'pattern': [r'.*\.jpg$'], 'extractor': [{'exif': ExtractExif()}]}}
+    for n_processes in [0, 1]:
+        sink = MemorySink()
+        engine = ElasticizeEngine(root, rules, None, None, '_doc', sink=sink)
+        t = Thread(target=engine.crawl_and_process, daemon=True,
+                   kwargs={'n_jobs': 2, 'n_processes': n_processes})
+        t.start()
+        t.join(timeout=60)
+        assert not t.is_alive(), f'crawl blocked with {n_processes} processes'
+        assert sink.filenames() == [f'{root}/a/{i}.txt' for i in range(5)], f'{sink.filenames()}'
+
+
+def test_reconcile(tmp_path):
+    root = make_tree(tmp_path / 'root')
+    sink = MemorySink()
+    engine = make_engine(root, sink, state_file=str(tmp_path / 'state.db'))
+    engine._es = FakeElastic(sink)
+    engine.crawl_and_process(n_jobs=2, n_processes=0)
+    os.remove(f'{root}/a/1.txt')
+    with open(f'{root}/a/2.txt', 'w') as f:
+        f.write('changed')
+    engine.crawl_and_process(n_jobs=2, n_processes=0, reconcile=True)
+    expected = [f'{root}/a/{i}.txt' for i in [0, 2, 3, 4]]
+    assert sink.filenames() == expected, f'{sink.filenames()}'
+
+
+def test_reconcile_index_failure(tmp_path):
+    root = make_tree(tmp_path)
+    sink = MemorySink()
+    engine = make_engine(root, sink)
+    engine._es = FakeElastic(sink)
+    engine.crawl_and_process(n_jobs=2, n_processes=0)
+    with open(f'{root}/a/2.txt', 'w') as f:
+        f.write('changed')
+    sink._fail = {f'{root}/a/2.txt'}
+    engine.crawl_and_process(n_jobs=2, n_processes=0, reconcile=True)
+    assert sink.filenames() == [f'{root}/a/{i}.txt' for i in range(5)], 'document of a failed file removed'
+    assert sink.failed == 1, f'{sink.failed} != 1'
+
+
+def test_reconcile_sink_error(tmp_path, monkeypatch):
+    root = make_tree(tmp_path)
+    sink = MemorySink()
+    engine = make_engine(root, sink)
+    engine._es = FakeElastic(sink)
+    engine.crawl_and_process(n_jobs=2, n_processes=0)
+    with open(f'{root}/a/2.txt', 'w') as f:
+        f.write('changed')
+    update = sink.update
+
+    def fail(id, data, upsert=True):
+        if data['filename'].endswith('/2.txt'):
+            raise TypeError('Object of type object is not JSON serializable')
+        update(id, data, upsert)
+
+    monkeypatch.setattr(sink, 'update', fail)
+    engine.crawl_and_process(n_jobs=2, n_processes=0, reconcile=True)
+    assert sink.filenames() == [f'{root}/a/{i}.txt' for i in range(5)], 'document of a failed file removed'
+    assert engine._in_flight.items == 0, 'in flight not released'
+
+
+def test_reconcile_state_error(tmp_path, monkeypatch):
+    root = make_tree(tmp_path / 'root')
+    sink = MemorySink()
+    engine = make_engine(root, sink, state_file=str(tmp_path / 'state.db'))
+    engine._es = FakeElastic(sink)
+    engine.crawl_and_process(n_jobs=2, n_processes=0)
+
+    def fail(*args):
+        raise OSError('disk I/O error')
+
+    monkeypatch.setattr(engine._state, 'unchanged', fail)
+    engine.crawl_and_process(n_jobs=2, n_processes=0, reconcile=True)
+    assert len(sink.docs) == 5, 'documents of unchecked files removed'
+    assert engine._in_flight.items == 0, 'in flight not released'
+
+
+def test_async_crawl(tmp_path):
+    root = make_tree(tmp_path / 'root')
+    os.makedirs(f'{root}/a/sub')
+    with open(f'{root}/a/sub/s.txt', 'w') as f:
+        f.write('s')
+    sink = MemorySink()
+    engine = make_engine(root, sink, engine=AsyncElasticizeEngine,
+                         state_file=str(tmp_path / 'state.db'))
+    engine._es = FakeElastic(sink)
+    # the params of ElasticizeEngine.crawl_and_process, as a ScanWorker passes them
+    assert engine.crawl_and_process(2, 0, path=f'{root}/a', recursive=False, max_in_flight=4) == 5
+    assert len(sink.docs) == 5, f'{len(sink.docs)} != 5'
+    os.remove(f'{root}/a/1.txt')
+    engine.crawl_and_process(n_jobs=2, n_processes=0, reconcile=True, max_in_flight=4)
+    expected = [f'{root}/a/{i}.txt' for i in [0, 2, 3, 4]] + [f'{root}/a/sub/s.txt']
+    assert sink.filenames() == expected, f'{sink.filenames()}'
+
+
+def test_watch_changes(tmp_path):
+    root = make_tree(tmp_path / 'root')
+    sink = MemorySink()
+    engine = make_engine(root, sink, state_file=str(tmp_path / 'state.db'))
+    engine.crawl_and_process(n_jobs=2, n_processes=0)
+    os.remove(f'{root}/a/0.txt')
+    with open(f'{root}/a/1.txt', 'w') as f:
+        f.write('changed')
+    os.makedirs(f'{root}/b')
+    with open(f'{root}/b/new.txt', 'w') as f:
+        f.write('new')
+    engine._apply_changes({f'{root}/a/0.txt': DELETED, f'{root}/a/1.txt': CHANGED,
+                           f'{root}/b': CHANGED}, 2, 10, 1)
+    expected = [f'{root}/a/{i}.txt' for i in [1, 2, 3, 4]] + [f'{root}/b/new.txt']
+    assert sink.filenames() == expected, f'{sink.filenames()}'
+    doc = next(d for d in sink.docs.values() if d['filename'].endswith('/1.txt'))
+    assert doc['text.size'] == {'size': 7}, 'old document of a modified file kept'
+
+
+def test_watch_chunks(tmp_path):
+    root = make_tree(tmp_path / 'root')
+    with open(f'{root}/a/long.txt', 'w') as f:
+        f.write('y' * 10)
+    sink = MemorySink()
+    engine = make_engine(root, sink, ExtractText(chunk_size=4, index_chunks=True),
+                         state_file=str(tmp_path / 'state.db'))
+    engine._es = FakeElastic(sink)
+    engine.crawl_and_process(n_jobs=2, n_processes=0)
+    chunks = sorted(d['text.size']['text'] for d in sink.docs.values() if 'parent_id' in d)
+    assert chunks == ['x', 'xx', 'xxx', 'xxxx', 'yy', 'yyyy', 'yyyy'], f'{chunks}'
+    # unchanged files keep their chunks
+    engine.crawl_and_process(n_jobs=2, n_processes=0, reconcile=True)
+    assert len(sink.docs) == 13, f'{len(sink.docs)} != 13'
+    with open(f'{root}/a/long.txt', 'w') as f:
+        f.write('z' * 5)
+    os.remove(f'{root}/a/4.txt')
+    engine._apply_changes({f'{root}/a/long.txt': CHANGED, f'{root}/a/4.txt': DELETED}, 2, 10, 1)
+    chunks = sorted(d['text.size']['text'] for d in sink.docs.values() if 'parent_id' in d)
+    assert chunks == ['x', 'xx', 'xxx', 'z', 'zzzz'], f'stale chunks {chunks}'
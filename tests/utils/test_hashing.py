@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-04-12
+project: elasticizefiles
+"""
+import hashlib
+
+from elasticizefiles.utils.files import get_hash
+from elasticizefiles.utils.hashing import hash_file
+
+
+def test_get_hash():
+    with open('setup.py', 'rb') as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+    assert get_hash('setup.py') == expected
+    assert get_hash('setup.py', strategy='mmap') == expected
+
+
+def test_hash_file(tmp_path):
+    filename = str(tmp_path / 'a.bin')
+    content = bytes(range(256)) * 4096
+    with open(filename, 'wb') as f:
+        f.write(content)
+    for strategy in ['read', 'mmap']:
+        r = hash_file(filename, hash_types=('sha256', 'blake2b'), strategy=strategy, buffer_size=1000)
+        assert r['sha256'] == hashlib.sha256(content).hexdigest(), strategy
+        assert r['blake2b'] == hashlib.blake2b(content).hexdigest(), strategy
+
+
+def test_hash_file_sampled(tmp_path):
+    filename = str(tmp_path / 'a.bin')
+    content = bytearray(1024 * 1024)
+    with open(filename, 'wb') as f:
+        f.write(content)
+    before = hash_file(filename, strategy='sampled', buffer_size=1024, samples=4)['sha256']
+    assert before != hashlib.sha256(content).hexdigest()
+    content[-1] = 1
+    with open(filename, 'wb') as f:
+        f.write(content)
+    after = hash_file(filename, strategy='sampled', buffer_size=1024, samples=4)['sha256']
+    assert before != after, 'tail change not detected'
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-03
+project: elasticizefiles
+"""
+from elasticizefiles.utils.metrics import Metrics
+
+
+def test_metrics_snapshot():
+    metrics = Metrics()
+    metrics.count('walk.files')
+    metrics.count('walk.files', 2)
+    metrics.gauge_fn('queue.extract', lambda: 7)
+    for seconds in [0.001, 0.002, 0.5]:
+        metrics.observe('extract.rule.fn', seconds)
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'walk.files': 3}
+    assert snapshot['gauges'] == {'queue.extract': 7}
+    h = snapshot['histograms']['extract.rule.fn']
+    assert h['count'] == 3 and h['max'] == 0.5, f'{h}'
+    assert h['p50'] == 0.005, f"{h['p50']} != 0.005"
+
+
+def test_metrics_prometheus():
+    metrics = Metrics()
+    metrics.count('bytes_read', 10)
+    with metrics.timer('extract.rule.fn'):
+        pass
+    text = metrics.to_prometheus()
+    assert 'elasticizefiles_bytes_read_total 10' in text
+    assert '# TYPE elasticizefiles_extract_seconds histogram' in text
+    assert 'elasticizefiles_extract_seconds_count{key="rule.fn"} 1' in text
+    assert 'elasticizefiles_extract_seconds_bucket{key="rule.fn",le="+Inf"} 1' in text
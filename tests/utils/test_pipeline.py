@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-03-29
+project: elasticizefiles
+"""
+from elasticizefiles.utils.pipeline import InFlight
+from elasticizefiles.utils.pipeline import Pipeline
+
+
+def test_pipeline():
+    out = []
+    pipeline = Pipeline(queue_size=2)
+    pipeline.source('numbers', range(100))
+    pipeline.stage('odd', lambda items: [i for i in items if i % 2], batch_size=10)
+    pipeline.stage('square', lambda i: i * i, n_threads=4)
+    pipeline.stage('collect', out.append)
+    pipeline.run()
+    assert sorted(out) == [i * i for i in range(1, 100, 2)], 'wrong output'
+    assert [s.processed for s in pipeline.stages] == [100, 50, 50]
+
+
+def test_pipeline_errors():
+    def fail(i):
+        if i == 3:
+            raise ValueError(i)
+        return i
+
+    out = []
+    pipeline = Pipeline(queue_size=2)
+    pipeline.source('numbers', range(10))
+    pipeline.stage('fail', fail, n_threads=2)
+    pipeline.stage('collect', out.append)
+    pipeline.run()
+    assert sorted(out) == [0, 1, 2, 4, 5, 6, 7, 8, 9], 'wrong output'
+    assert pipeline.stages[0].errors == 1
+
+
+def test_in_flight():
+    out = []
+    in_flight = InFlight(max_items=3, max_bytes=100)
+
+    def admit(items):
+        for i in items:
+            in_flight.acquire(1, 40)
+            yield i
+
+    def done(i):
+        assert in_flight.items <= 3 and in_flight.bytes <= 100, 'limits exceeded'
+        out.append(i)
+        in_flight.release(1, 40)
+
+    pipeline = Pipeline(queue_size=10)
+    pipeline.source('numbers', admit(range(50)))
+    pipeline.stage('done', done)
+    pipeline.run()
+    assert len(out) == 50, 'items lost'
+    assert in_flight.peak_items <= 2 and in_flight.peak_bytes <= 100, f'{in_flight.peak_bytes}'
+    in_flight.acquire(0, 500)
+    assert in_flight.bytes == 500, 'big item not let through alone'
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-10
+project: elasticizefiles
+"""
+import json
+from threading import Thread
+
+from elasticizefiles.utils.profiling import Profiler
+from elasticizefiles.utils.profiling import no_span
+
+
+def test_profiler(tmp_path):
+    profiler = Profiler(slowest=2)
+
+    @profiler.profiled
+    def work(i):
+        with profiler.span('extract.rule.fn', f'file{i}', size=i):
+            return sum(range(1000 * i))
+
+    threads = [Thread(target=work, args=(i, )) for i in range(1, 5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    slowest = profiler.slowest()['extract.rule.fn']
+    assert len(slowest) == 2, f'{len(slowest)} != 2'
+    assert slowest[0]['seconds'] >= slowest[1]['seconds']
+    assert profiler.stats().total_calls > 0
+    profiler.save_trace(str(tmp_path / 'trace.json'))
+    with open(str(tmp_path / 'trace.json')) as f:
+        events = json.load(f)['traceEvents']
+    assert len(events) == 4, f'{len(events)} != 4'
+
+
+def test_no_span():
+    profiler = Profiler()
+    for span in (profiler.span, no_span):
+        with span('hash', 'file', 10):
+            pass
+
+
+class BusyProfile(object):
+    """ A cProfile failing as on python 3.12 when another one is active """
+
+    def enable(self):
+        raise ValueError('Another profiling tool is already active')
+
+
+def test_profiler_busy(monkeypatch):
+    monkeypatch.setattr('cProfile.Profile', BusyProfile)
+    profiler = Profiler()
+    work = profiler.profiled(lambda i: i * 2)
+    assert [work(i) for i in range(3)] == [0, 2, 4], 'calls failed without cProfile'
+    assert profiler.stats() is None, 'stats of a disabled cProfile'
@@ -3,8 +3,12 @@
 Created by Pierluigi on 2020-01-29
 project: elasticizefiles
 """
+import threading
+import time
+
 from elasticizefiles.utils.files import explore_path
 from elasticizefiles.utils.files import filestat
+from elasticizefiles.utils.files import scan_path
 
 
 def test_explore_path():
@@ -19,3 +23,37 @@ def test_explore_path():
 def test_filestat():
     for k, _ in filestat('setup.py').items():
         assert k.startswith('st_'), f'{k} does not start with `st_`'
+
+
+def test_scan_path(tmp_path):
+    for d in ['a', 'a/b', 'c']:
+        (tmp_path / d).mkdir()
+        for i in range(3):
+            (tmp_path / d / f'{i}.txt').write_text('x' * i)
+    expected = sorted((d, f) for d, f in explore_path(str(tmp_path)))
+    scanned = list(scan_path(str(tmp_path), n_threads=2))
+    assert sorted((d, f) for d, f, _ in scanned) == expected
+    for d, f, st in scanned:
+        assert st.st_size == int(f[0]), f'{d}/{f} wrong stats'
+    assert len(list(scan_path(str(tmp_path), recursive=False))) == 0
+
+
+def test_scan_path_early_stop(tmp_path):
+    for i in range(100):
+        (tmp_path / f'{i}.txt').write_text('')
+    for _ in scan_path(str(tmp_path), queue_size=2):
+        break
+
+
+def test_scan_path_early_stop_threads(tmp_path):
+    for d in range(8):
+        (tmp_path / str(d)).mkdir()
+        for i in range(50):
+            (tmp_path / str(d) / f'{i}.txt').write_text('')
+    scanner = scan_path(str(tmp_path), n_threads=4, queue_size=1)
+    next(scanner)
+    # the workers are blocked on the full queue
+    time.sleep(.1)
+    scanner.close()
+    alive = [t.name for t in threading.enumerate() if t.name.startswith('scan-')]
+    assert alive == [], f'scanner threads leaked {alive}'
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Pierluigi on 2020-05-30
+project: elasticizefiles
+"""
+import os
+import sys
+
+import pytest
+
+from elasticizefiles.utils.watch import CHANGED
+from elasticizefiles.utils.watch import DELETED
+from elasticizefiles.utils.watch import InotifyWatcher
+from elasticizefiles.utils.watch import PollingWatcher
+from elasticizefiles.utils.watch import debounce
+
+
+def changes(tmp_path):
+    with open(str(tmp_path / 'a.txt'), 'w') as f:
+        f.write('a')
+    os.rename(str(tmp_path / 'old.txt'), str(tmp_path / 'sub' / 'new.txt'))
+
+
+def expected(tmp_path):
+    return {
+        str(tmp_path / 'a.txt'): CHANGED,
+        str(tmp_path / 'old.txt'): DELETED,
+        str(tmp_path / 'sub' / 'new.txt'): CHANGED,
+    }
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is Linux only')
+def test_inotify_watcher(tmp_path):
+    os.makedirs(str(tmp_path / 'sub'))
+    open(str(tmp_path / 'old.txt'), 'w').close()
+    watcher = InotifyWatcher(str(tmp_path))
+    changes(tmp_path)
+    batch = next(debounce(watcher, quiet=0.1))
+    watcher.close()
+    assert batch == expected(tmp_path), f'{batch}'
+
+
+def test_polling_watcher(tmp_path):
+    os.makedirs(str(tmp_path / 'sub'))
+    open(str(tmp_path / 'old.txt'), 'w').close()
+    watcher = PollingWatcher(str(tmp_path), interval=0.1)
+    changes(tmp_path)
+    batch = next(debounce(watcher, quiet=0.1))
+    assert batch == expected(tmp_path), f'{batch}'